@@ -0,0 +1,58 @@
+import datetime
+import logging
+import time
+
+import httpcore
+from hishel._serializers import Metadata
+
+from httpxthrottlecache.serializer import BinaryByteSerializer, JSONByteSerializer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+N = 20_000
+
+
+def entry(body: bytes):
+    headers = [
+        (b"Content-Type", b"application/json"),
+        (b"Content-Length", str(len(body)).encode()),
+        (b"Date", b"Mon, 01 Jan 2024 00:00:00 GMT"),
+        (b"Last-Modified", b"Mon, 01 Jan 2024 00:00:00 GMT"),
+        (b"Cache-Control", b"max-age=600"),
+        (b"Vary", b"Accept-Encoding"),
+        (b"Server", b"nginx"),
+        (b"X-Request-Id", b"0123456789abcdef"),
+    ]
+    response = httpcore.Response(200, headers=headers, content=body, extensions={"http_version": b"HTTP/1.1"})
+    response.read()
+    request = httpcore.Request(
+        "GET",
+        "https://data.sec.gov/submissions/CIK0000320193.json",
+        headers=[(b"Host", b"data.sec.gov"), (b"User-Agent", b"Example example@example.com")],
+        extensions={"timeout": {"connect": 5.0, "read": 5.0, "write": 5.0, "pool": 5.0}},
+    )
+    metadata = Metadata(cache_key="k", created_at=datetime.datetime.now(datetime.timezone.utc), number_of_uses=3)
+    return response, request, metadata
+
+
+def bench(serializer: JSONByteSerializer, data: bytes) -> float:
+    start = time.process_time()
+    for _ in range(N):
+        serializer.loads(data)
+    return (time.process_time() - start) / N * 1e6
+
+
+if __name__ == "__main__":
+    for size in (1_000, 100_000, 10_000_000):
+        e = entry(b"x" * size)
+        for serializer in (JSONByteSerializer(), BinaryByteSerializer()):
+            data = serializer.dumps(*e)
+            assert isinstance(data, bytes)
+            logger.info(
+                "%s body=%s bytes: header=%s bytes, loads=%.1fus",
+                type(serializer).__name__,
+                size,
+                len(data) - size,
+                bench(serializer, data),
+            )
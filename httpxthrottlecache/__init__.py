@@ -1,7 +1,9 @@
 from ._version import __version__
+from .batch import SpilledBody
 from .httpxclientmanager import HttpxThrottleCache
+from .inventory import CachePlan
 
-__all__ = ["HttpxThrottleCache", "__version__"]
+__all__ = ["CachePlan", "HttpxThrottleCache", "SpilledBody", "__version__"]
 
 
 EDGAR_CACHE_RULES = {
@@ -0,0 +1,134 @@
+"""Helpers for get_batch: bounding the memory held by in-memory batch results"""
+
+import logging
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Optional, Union
+
+import aiofiles
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:  # pragma: no cover
+        pass
+
+
+class SpilledBody:
+    """
+    A response body that was written to a temporary file instead of being held in memory.
+
+    The content is read lazily, via read() or open(). The temporary file is removed by close(), or when the
+    SpilledBody is garbage collected.
+    """
+
+    def __init__(self, path: Union[str, Path], size: int):
+        self.path = Path(path)
+        self.size = size
+        self._finalizer = weakref.finalize(self, _unlink, str(self.path))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"SpilledBody(path={self.path!r}, size={self.size})"
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    def read(self) -> bytes:
+        return self.path.read_bytes()
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: object):
+        self.close()
+
+
+class MemoryBudget:
+    """Tracks the bytes held in memory across a batch. Not thread safe: intended for a single event loop."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.held = 0
+
+    def reserve(self, n: int) -> bool:
+        if self.held + n > self.limit:
+            return False
+        self.held += n
+        return True
+
+    def release(self, n: int):
+        self.held -= n
+
+
+async def _spill(
+    r: httpx.Response,
+    head: Union[bytes, bytearray],
+    chunks: AsyncIterator[bytes],
+    spill_dir: Optional[Union[str, Path]],
+) -> SpilledBody:
+    fd, name = tempfile.mkstemp(prefix="httpxthrottlecache-", suffix=".spill", dir=spill_dir)
+    os.close(fd)
+    spilled = SpilledBody(name, len(head))
+    logger.debug("Spilling %s to %s", r.url, name)
+
+    async with aiofiles.open(name, "wb") as f:
+        await f.write(head)
+        async for chunk in chunks:
+            await f.write(chunk)
+            spilled.size += len(chunk)
+
+    return spilled
+
+
+async def read_bounded(
+    r: httpx.Response, budget: MemoryBudget, spill_dir: Optional[Union[str, Path]] = None
+) -> Union[bytearray, SpilledBody]:
+    """
+    Reads the response body into memory if it fits within budget, otherwise spills it to a temporary file.
+
+    If the Content-Length is known (and the body isn't content-encoded), the body is read into a preallocated buffer.
+    """
+    content_length = r.headers.get("content-length")
+    length = int(content_length) if content_length and not r.headers.get("content-encoding") else None
+
+    chunks = r.aiter_bytes()
+    if length is not None:
+        if not budget.reserve(length):
+            return await _spill(r, b"", chunks, spill_dir)
+
+        buf = bytearray(length)
+        pos = 0
+        async for chunk in chunks:
+            n = len(chunk)
+            if pos + n > length:  # pragma: no cover - Content-Length was wrong
+                budget.held += pos + n - max(length, pos)
+            buf[pos : pos + n] = chunk
+            pos += n
+
+        if pos < length:  # pragma: no cover - Content-Length was wrong
+            budget.release(length - pos)
+            del buf[pos:]
+        return buf
+
+    buf = bytearray()
+    async for chunk in chunks:
+        if not budget.reserve(len(chunk)):
+            # Over budget: move what's been read so far to a temporary file, and stream the rest
+            budget.release(len(buf))
+            buf += chunk
+            return await _spill(r, buf, chunks, spill_dir)
+        buf += chunk
+
+    return buf
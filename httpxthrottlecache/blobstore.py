@@ -0,0 +1,145 @@
+"""
+Content-addressed body storage, so identical bodies cached under different keys are stored once.
+
+Bodies are stored under <root>/<digest[:2]>/<digest>, where digest is the body's SHA-256, and cache entries are
+hardlinks to them. The hardlink count is the reference count: removing an entry drops a reference, and gc() removes
+bodies that no entry refers to.
+
+Hardlinks can't cross filesystems, so a cache striped across several root directories has a BlobStore per root: see
+BlobStores.
+
+Entries must never be modified in place, since that would modify every entry sharing the body: they are always
+replaced, by writing a new file and renaming it over the entry.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = ".blobs"
+
+
+def tmp_path(path: Path) -> Path:
+    """A temporary path next to path, unique to this writer, for a file that will be renamed over path"""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+class BlobStore:
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _link(self, blob: Path, path: Path):
+        """Atomically replaces path with a hardlink to blob"""
+        try:
+            if os.path.samestat(path.stat(), blob.stat()):
+                return
+        except FileNotFoundError:
+            pass
+
+        tmp = tmp_path(path)
+        os.link(blob, tmp)
+        os.replace(tmp, path)
+
+    def publish(self, tmp: Union[str, Path], path: Path, digest: str):
+        """
+        Moves tmp, whose content hashes to digest, to path. If an identical body is already stored, path becomes a
+        hardlink to it and tmp is discarded.
+        """
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                os.link(tmp, blob)
+            except FileExistsError:
+                try:
+                    self._link(blob, path)
+                except FileNotFoundError:  # removed by a concurrent gc(): tmp becomes the blob
+                    continue
+                os.unlink(tmp)
+                return
+            except OSError as e:  # e.g. a filesystem without hardlinks: store without deduplication
+                logger.warning("Unable to deduplicate %s: %s", path, e)
+            break
+
+        os.replace(tmp, path)
+
+    def store(self, body: bytes, path: Path) -> str:
+        """Writes body to path as a hardlink to its blob, writing the blob if it isn't already stored"""
+        hexdigest = hashlib.sha256(body).hexdigest()
+
+        blob = self.blob_path(hexdigest)
+        if blob.exists():
+            try:
+                self._link(blob, path)
+                return hexdigest
+            except FileNotFoundError:  # pragma: no cover - removed by a concurrent gc()
+                pass
+
+        tmp = tmp_path(path)
+        with open(tmp, "wb") as f:
+            f.write(body)
+        self.publish(tmp, path, hexdigest)
+        return hexdigest
+
+    def gc(self) -> tuple[int, int]:
+        """
+        Removes bodies that no entry refers to.
+
+        Returns:
+            (number of bodies removed, bytes freed)
+        """
+        removed = 0
+        freed = 0
+        try:
+            shards = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0, 0
+
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            with os.scandir(shard.path) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                        if stat.st_nlink <= 1:
+                            os.unlink(entry.path)
+                            removed += 1
+                            freed += stat.st_size
+                    except FileNotFoundError:  # pragma: no cover
+                        pass
+
+        logger.info("Removed %s unreferenced blobs, %s bytes", removed, freed)
+        return removed, freed
+
+
+class BlobStores:
+    """A BlobStore in each cache root directory, at <root>/.blobs"""
+
+    def __init__(self, roots: Sequence[Union[str, Path]]):
+        self.stores = {Path(root): BlobStore(Path(root) / BLOB_DIR) for root in roots}
+
+    def for_path(self, path: Path) -> BlobStore:
+        """Returns the BlobStore on the same root as path"""
+        for root, store in self.stores.items():
+            if path.is_relative_to(root):
+                return store
+        raise ValueError(f"{path} isn't in a cache root: {list(self.stores)}")
+
+    def gc(self) -> tuple[int, int]:
+        removed = 0
+        freed = 0
+        for store in self.stores.values():
+            r, f = store.gc()
+            removed += r
+            freed += f
+        return removed, freed
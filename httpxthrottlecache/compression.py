@@ -0,0 +1,116 @@
+"""
+Codecs for compressing Hishel cache entries at rest.
+
+zlib, lzma and bz2 are always available. zstd is used when the optional zstandard package is installed.
+"""
+
+import bz2
+import importlib.util
+import lzma
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional, Union
+
+ZSTD = importlib.util.find_spec("zstandard") is not None
+
+DEFAULT_CODEC = "zstd" if ZSTD else "zlib"
+
+UNCOMPRESSIBLE_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/zstd",
+)
+"""Media type prefixes of bodies that are already compressed, which are stored as is"""
+
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompressor: Callable[[], Any]
+    """Returns a new object with a decompress(data) method, and optionally flush()"""
+
+
+CODECS: dict[str, Codec] = {
+    "zlib": Codec("zlib", zlib.compress, zlib.decompressobj),
+    "lzma": Codec("lzma", lzma.compress, lzma.LZMADecompressor),
+    "bz2": Codec("bz2", bz2.compress, bz2.BZ2Decompressor),
+}
+
+if ZSTD:
+    import zstandard
+
+    # ZstdCompressor and ZstdDecompressor aren't thread safe, so a new one is created for each entry
+    CODECS["zstd"] = Codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda: zstandard.ZstdDecompressor().decompressobj(),
+    )
+
+
+def get_codec(name: str) -> Codec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unsupported compression codec {name}, expected one of {sorted(CODECS)}")
+    return codec
+
+
+def choose_codec(
+    content_type: Optional[str],
+    content_encoding: Optional[str],
+    size: int,
+    codecs: dict[str, Optional[str]],
+    default: Optional[str],
+    min_size: int,
+) -> Optional[str]:
+    """
+    Chooses the codec for a body, or None if it should be stored uncompressed.
+
+    Args:
+        content_type: The response's Content-Type
+        content_encoding: The response's Content-Encoding. Bodies with a Content-Encoding are already compressed.
+        size: Body size
+        codecs: Media type prefix to codec name (or None to store uncompressed). The first matching prefix is used.
+        default: Codec for media types that don't match codecs
+        min_size: Bodies smaller than this are stored uncompressed
+
+    Returns:
+        Codec name or None
+    """
+    if size < min_size or (content_encoding and content_encoding.strip().lower() != "identity"):
+        return None
+
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type.startswith(UNCOMPRESSIBLE_TYPES):
+        return None
+
+    for prefix, codec in codecs.items():
+        if media_type.startswith(prefix):
+            return codec
+    return default
+
+
+def decompress_stream(name: str, data: Union[bytes, memoryview]) -> Iterator[bytes]:
+    """Decompresses data in chunks, so the compressed and decompressed bodies aren't both held as single buffers"""
+    decompressor = get_codec(name).decompressor()
+    view = memoryview(data)
+    for start in range(0, len(view), _CHUNK_SIZE):
+        chunk = decompressor.decompress(view[start : start + _CHUNK_SIZE])
+        if chunk:
+            yield chunk
+
+    flush = getattr(decompressor, "flush", None)
+    if flush is not None:
+        chunk = flush()
+        if chunk:
+            yield chunk
@@ -7,10 +7,18 @@ import httpcore
 
 logger = logging.getLogger(__name__)
 
+CacheRule = Union[bool, int, dict[str, Any]]
+"""
+True to cache forever, False or 0 not to cache, or the seconds to cache for. Or a dict of the "ttl", one of those, and
+"status": error status codes to negative TTLs, for which the status (without the body) is cached. For example:
+{"ttl": 3600, "status": {404: 300, 410: True}}
+"""
 
-def get_rules(
-    request_host: str, cache_rules: dict[str, dict[str, Union[bool, int]]]
-) -> Optional[dict[str, Union[bool, int]]]:
+CacheRules = dict[str, dict[str, CacheRule]]
+"""Site regular expressions to path regular expressions to CacheRule"""
+
+
+def get_rules(request_host: str, cache_rules: CacheRules) -> Optional[dict[str, CacheRule]]:
     for site_pattern, rules in cache_rules.items():
         if re.match(site_pattern, request_host):
             logger.info("matched %s, using value %s: %s", site_pattern, request_host, rules)
@@ -20,7 +28,7 @@ def get_rules(
     logger.debug("No patterns matched %s", request_host)
 
 
-def match_request(target: str, cache_rules_for_site: dict[str, Union[bool, int]]):
+def match_request(target: str, cache_rules_for_site: dict[str, CacheRule]) -> Optional[CacheRule]:
     for pat, v in cache_rules_for_site.items():
         if re.match(pat, target):
             logger.info("%s matched %s, using value %s", target, pat, v)
@@ -28,21 +36,51 @@ def match_request(target: str, cache_rules_for_site: dict[str, Union[bool, int]]
             return v
 
 
-def get_rule_for_request(
-    request_host: str, target: str, cache_rules: dict[str, dict[str, Union[bool, int]]]
-) -> Optional[Union[bool, int]]:
+def match_rule(request_host: str, target: str, cache_rules: CacheRules) -> Optional[CacheRule]:
     cache_rules_for_site = get_rules(request_host=request_host, cache_rules=cache_rules)
 
     if cache_rules_for_site:
-        is_cacheable = match_request(target=target, cache_rules_for_site=cache_rules_for_site)
-        return is_cacheable
+        return match_request(target=target, cache_rules_for_site=cache_rules_for_site)
 
     return None
 
 
+def get_rule_for_request(request_host: str, target: str, cache_rules: CacheRules) -> Optional[Union[bool, int]]:
+    rule = match_rule(request_host=request_host, target=target, cache_rules=cache_rules)
+    return rule.get("ttl") if isinstance(rule, dict) else rule
+
+
+def negative_ttl(rule: Optional[CacheRule], status: int) -> Optional[Union[bool, int]]:
+    """The negative TTL for status under rule, if it has one. Status codes may be ints or strings, as read from JSON."""
+    if not isinstance(rule, dict):
+        return None
+    statuses = rule.get("status") or {}
+    return statuses.get(status, statuses.get(str(status)))
+
+
+def get_negative_ttl(
+    request_host: str, target: str, cache_rules: CacheRules, status: int
+) -> Optional[Union[bool, int]]:
+    rule = match_rule(request_host=request_host, target=target, cache_rules=cache_rules)
+    return negative_ttl(rule, status)
+
+
+def negative_status_codes(cache_rules: CacheRules) -> list[int]:
+    """Every status code with a negative TTL in cache_rules"""
+    return sorted(
+        {
+            int(status)
+            for rules in cache_rules.values()
+            for rule in rules.values()
+            if isinstance(rule, dict)
+            for status in (rule.get("status") or {})
+        }
+    )
+
+
 def get_cache_controller(
     key_generator: Callable[[httpcore.Request, Optional[bytes]], str],
-    cache_rules: dict[str, dict[str, Union[bool, int]]],
+    cache_rules: CacheRules,
     **kwargs: dict[str, Any],
 ):
     class EdgarController(hishel.Controller):
@@ -50,6 +88,17 @@ def get_cache_controller(
             if response.status not in self._cacheable_status_codes:
                 return False
 
+            if response.status != 200:
+                # Negative caching
+                return bool(
+                    get_negative_ttl(
+                        request_host=request.url.host.decode(),
+                        target=request.url.target.decode(),
+                        cache_rules=cache_rules,
+                        status=response.status,
+                    )
+                )
+
             cache_period = get_rule_for_request(
                 request_host=request.url.host.decode(), target=request.url.target.decode(), cache_rules=cache_rules
             )
@@ -72,6 +121,19 @@ def get_cache_controller(
             ):  # pragma: no cover - would only occur if the cache was loaded then rules changed
                 return None
 
+            if response.status != 200:
+                ttl = get_negative_ttl(
+                    request_host=request.url.host.decode(),
+                    target=request.url.target.decode(),
+                    cache_rules=cache_rules,
+                    status=response.status,
+                )
+                age_seconds = hishel._controller.get_age(response, self._clock)  # pyright: ignore[reportPrivateUsage]
+                if ttl is True or (ttl and age_seconds <= ttl):
+                    logger.debug("Negative cache hit for %s (%s)", request.url, response.status)
+                    return response
+                return None
+
             cache_period = get_rule_for_request(
                 request_host=request.url.host.decode(), target=request.url.target.decode(), cache_rules=cache_rules
             )
@@ -106,7 +168,10 @@ def get_cache_controller(
                 return super().construct_response_from_cache(request, response, original_request)
 
     controller = EdgarController(
-        cacheable_methods=["GET", "POST"], cacheable_status_codes=[200], key_generator=key_generator, **kwargs
+        cacheable_methods=["GET", "POST"],
+        cacheable_status_codes=[200, *negative_status_codes(cache_rules)],
+        key_generator=key_generator,
+        **kwargs,
     )
 
     return controller
@@ -0,0 +1,101 @@
+"""
+Durability of FileCache writes, trading crash safety for write throughput:
+- fsync: each file is fsynced before it's renamed over the entry. Survives a crash, at the cost of an fsync per file.
+- batch: written files and their directories are fsynced together, interval seconds after the first of them was
+  written, and at exit. A crash can lose the entries written since the last sync.
+- none: left to the operating system.
+
+Entries record their size in the .meta, so an entry truncated by a crash is detected and discarded when it's read.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Literal, Optional
+
+logger = logging.getLogger(__name__)
+
+Durability = Literal["none", "batch", "fsync"]
+
+
+def _fsync_path(path: Path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:  # replaced or removed since it was written
+        return
+    except OSError:  # pragma: no cover - directories can't be opened on Windows
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_batch_syncers: "weakref.WeakSet[Syncer]" = weakref.WeakSet()
+"""Syncers in batch mode, synced at exit. A Syncer with pending files is kept alive by its timer."""
+
+
+def _sync_all():
+    for syncer in list(_batch_syncers):
+        syncer.sync()
+
+
+atexit.register(_sync_all)
+
+
+class Syncer:
+    def __init__(self, durability: Durability = "fsync", interval: float = 5.0):
+        if durability not in ("none", "batch", "fsync"):
+            raise ValueError(f"Unknown durability {durability}, expected none, batch or fsync")
+        self.durability = durability
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._pending: set[Path] = set()
+        self._last_sync = time.monotonic()
+        self._timer: Optional[threading.Timer] = None
+        """Syncs pending files interval after the first of them"""
+        if durability == "batch":
+            _batch_syncers.add(self)
+
+    def before_publish(self, fd: int):
+        """Called with a temporary file's descriptor, before it's renamed over the entry"""
+        if self.durability == "fsync":
+            os.fsync(fd)
+
+    def published(self, *paths: Path):
+        """Called once paths have been renamed into place"""
+        if self.durability != "batch":
+            return
+        with self._lock:
+            self._pending.update(paths)
+            due = time.monotonic() - self._last_sync >= self.interval
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.interval, self._sync_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.sync()
+
+    def _sync_timer(self):
+        with self._lock:
+            self._timer = None
+        self.sync()
+
+    def sync(self):
+        """fsyncs the files published since the last sync, then their directories"""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._last_sync = time.monotonic()
+        if not pending:
+            return
+
+        for path in pending:
+            _fsync_path(path)
+        for directory in {path.parent for path in pending}:
+            _fsync_path(directory)
+        logger.debug("Synced %s files", len(pending))
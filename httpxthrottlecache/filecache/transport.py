@@ -1,25 +1,52 @@
 """An alternative cache using:
 - Flat files
+- Optionally, a shared S3 tier behind the local files (S3Tier)
 
 """
 
 import calendar
+import hashlib
 import json
 import logging
 import os
 import time
+import uuid
+from functools import partial
 from pathlib import Path
-from typing import Callable, Iterator, Optional, Tuple, Union
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Sequence, Tuple, Union
 from urllib.parse import quote, unquote
 
 import aiofiles
 import httpx
-from filelock import AsyncFileLock, FileLock
+from anyio import to_thread
+from filelock import AsyncFileLock, FileLock, Timeout
+from httpx._decoders import SUPPORTED_DECODERS
 
-from ..controller import get_rule_for_request
+from ..blobstore import BlobStore, BlobStores, tmp_path
+from ..controller import CacheRules, get_negative_ttl, get_rule_for_request, match_rule, negative_ttl
+from ..durability import Durability, Syncer
+from ..key_generator import KeyCanonicalizer
+from ..layout import NAME_MAX, ShardedLayout, StripedRoots
 
 logger = logging.getLogger(__name__)
 
+META_KEY = "filecache-meta"
+"""S3 object metadata key holding a tiered entry's .meta JSON"""
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+"""Network chunks are collected into writes of at least this size by the async tee, so each thread pool round trip
+writes a large block rather than a few KB"""
+
+ACCEPT_ENCODING = ", ".join(coding for coding in SUPPORTED_DECODERS if coding != "identity")
+"""Sent on every FileCache fetch, so entries are stored compressed: gzip and deflate, plus br and zstd when their
+decoders are installed"""
+
+NEGATIVE_SUFFIX = ".neg"
+"""A cached error status, for the negative TTLs in cache_rules"""
+
+PART_SUFFIX = ".part"
+"""An interrupted download, kept to be resumed with a Range request, alongside a .part.meta holding its validator"""
+
 
 class AlreadyLockedError(Exception):
     pass
@@ -61,32 +88,348 @@ class DualFileStream(httpx.SyncByteStream, httpx.AsyncByteStream):
             await self.async_on_close()
 
 
+class RangeFileStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Streams parts: literal bytes, or (start, end) byte ranges of path, end inclusive"""
+
+    def __init__(self, path: Path, parts: Sequence[Union[bytes, tuple[int, int]]], chunk_size: int = 1024 * 1024):
+        self.path, self.parts, self.chunk_size = Path(path), parts, chunk_size
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            for part in self.parts:
+                if isinstance(part, bytes):
+                    yield part
+                    continue
+                f.seek(part[0])
+                remaining = part[1] - part[0] + 1
+                while remaining > 0:
+                    b = f.read(min(self.chunk_size, remaining))
+                    if not b:
+                        break  # pragma: no cover
+                    remaining -= len(b)
+                    yield b
+
+    async def __aiter__(self):
+        async with aiofiles.open(self.path, "rb") as f:
+            for part in self.parts:
+                if isinstance(part, bytes):
+                    yield part
+                    continue
+                await f.seek(part[0])
+                remaining = part[1] - part[0] + 1
+                while remaining > 0:
+                    b = await f.read(min(self.chunk_size, remaining))
+                    if not b:
+                        break  # pragma: no cover
+                    remaining -= len(b)
+                    yield b
+
+
+class DecodedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Decodes a stream with the given content coding, for callers that don't accept it"""
+
+    def __init__(self, stream: Union[httpx.SyncByteStream, httpx.AsyncByteStream], coding: str):
+        self.stream, self.coding = stream, coding
+
+    def __iter__(self):
+        decoder = SUPPORTED_DECODERS[self.coding]()
+        for chunk in self.stream:  # type: ignore[union-attr]
+            decoded = decoder.decode(chunk)
+            if decoded:
+                yield decoded
+        decoded = decoder.flush()
+        if decoded:
+            yield decoded
+
+    def close(self) -> None:
+        self.stream.close()  # type: ignore[union-attr]
+
+    async def __aiter__(self):
+        decoder = SUPPORTED_DECODERS[self.coding]()
+        async for chunk in self.stream:  # type: ignore[union-attr]
+            decoded = decoder.decode(chunk)
+            if decoded:
+                yield decoded
+        decoded = decoder.flush()
+        if decoded:
+            yield decoded
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()  # type: ignore[union-attr]
+
+
+def accepts(accept_encoding: Optional[str], coding: str) -> bool:
+    """True if a request with accept_encoding accepts a body with the given content coding"""
+    if accept_encoding is None:
+        return True
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() in (coding.lower(), "*"):
+            q = params.replace(" ", "").lower().removeprefix("q=")
+            return not q or not q.replace(".", "").isdigit() or float(q) > 0
+    return False
+
+
+def _decoded(coding: Optional[str], accept_encoding: Optional[str]) -> Optional[str]:
+    """The coding to decode a body with before returning it, if the caller doesn't accept it"""
+    if coding is None or accepts(accept_encoding, coding) or coding not in SUPPORTED_DECODERS:
+        return None
+    return coding
+
+
+_DECODED_DROPPED = ("content-encoding", "content-length", "transfer-encoding")
+"""Headers that don't describe a decoded body"""
+
+
+def parse_range(header: str, size: int) -> Optional[list[tuple[int, int]]]:
+    """
+    Parses a Range header for a body of size bytes.
+
+    Returns:
+        The satisfiable (start, end) ranges, end inclusive: empty if none are. None if the header isn't a valid bytes
+        range, and so is ignored.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, sep, last = spec.strip().partition("-")
+        if not sep or not (first + last).isdigit():
+            return None
+        if not first:  # the last n bytes
+            if int(last) > 0 and size > 0:
+                ranges.append((max(size - int(last), 0), size - 1))
+        elif last and int(last) < int(first):
+            return None
+        elif int(first) < size:
+            ranges.append((int(first), min(int(last), size - 1) if last else size - 1))
+    return ranges
+
+
+def _is_fresh(cached: Union[bool, int], fetched: float) -> bool:
+    return cached is True or time.time() - fetched <= cached
+
+
+def _write_meta(meta_path: Path, meta: dict[str, Any], syncer: Optional[Syncer] = None):
+    """Atomically replaces meta_path: concurrent writers each write their own file, and the last rename wins"""
+    tmp = tmp_path(meta_path)
+    with open(tmp, "w") as f:
+        f.write(json.dumps(meta))
+        if syncer is not None:
+            f.flush()
+            syncer.before_publish(f.fileno())
+    if meta["fetched"]:
+        # The .meta mtime mirrors "fetched", so bulk scans can check freshness from a stat alone
+        os.utime(tmp, (meta["fetched"], meta["fetched"]))
+    os.replace(tmp, meta_path)
+
+
+class S3Tier:
+    """
+    A shared S3 (or S3-compatible) tier behind FileCache's local files, so a fleet of workers fetches each document
+    from the origin once.
+
+    Entries are objects named <prefix><site>/<name>, with the entry's .meta as object metadata. Local misses are
+    filled from the tier when its copy is fresh, and origin fetches are written through to it. Bodies are moved with
+    the client's managed transfers (upload_fileobj and download_fileobj), which stream large objects in parts.
+    """
+
+    def __init__(
+        self, bucket_name: str, client: Optional[Any] = None, prefix: str = "filecache/", transfer_config: Any = None
+    ):
+        if client is None:  # pragma: no cover
+            import boto3
+
+            client = boto3.client("s3")
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.transfer_config = transfer_config
+
+    def fill(self, key: str, path: Path, cached: Union[bool, int], syncer: Optional[Syncer] = None) -> bool:
+        """Downloads key to path if the tier's copy is fresh. Returns True if path was filled."""
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=self.prefix + key)
+            meta = json.loads(head["Metadata"][META_KEY])
+        except Exception:  # missing object or metadata: a miss
+            return False
+
+        if not meta.get("fetched") or not _is_fresh(cached, meta["fetched"]):
+            logger.info("S3 tier copy of %s is stale", key)
+            return False
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tmp_path(path)
+        try:
+            with open(tmp, "wb") as f:
+                self.client.download_fileobj(
+                    Bucket=self.bucket_name, Key=self.prefix + key, Fileobj=f, Config=self.transfer_config
+                )
+                f.flush()
+                if syncer is not None:
+                    syncer.before_publish(f.fileno())
+                if meta.get("size") is not None and f.tell() != meta["size"]:
+                    raise ValueError(f"Expected {meta['size']} bytes, downloaded {f.tell()}")
+            os.replace(tmp, path)
+        except Exception:
+            logger.warning("Failed to fill %s from the S3 tier", key, exc_info=True)
+            tmp.unlink(missing_ok=True)
+            return False
+
+        meta_path = path.with_suffix(path.suffix + ".meta")
+        _write_meta(meta_path, meta, syncer)
+        if syncer is not None:
+            syncer.published(path, meta_path)
+        logger.info("Filled %s from the S3 tier", path)
+        return True
+
+    def upload(self, key: str, path: Path, meta: dict[str, Any]):
+        """Writes the entry at path through to the tier. Failures are logged: the local entry is still usable."""
+        try:
+            with open(path, "rb") as f:
+                self.client.upload_fileobj(
+                    Fileobj=f,
+                    Bucket=self.bucket_name,
+                    Key=self.prefix + key,
+                    ExtraArgs={"Metadata": {META_KEY: json.dumps(meta)}},
+                    Config=self.transfer_config,
+                )
+        except Exception:
+            logger.warning("Failed to write %s through to the S3 tier", key, exc_info=True)
+
+
 class FileCache:
-    def __init__(self, cache_dir: Union[str, Path], locking: bool = True):
-        self.cache_dir = Path(cache_dir)
-        logger.info("cache_dir=%s", self.cache_dir)
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(
+        self,
+        cache_dir: Union[str, Path, Sequence[Union[str, Path]]],
+        locking: bool = True,
+        dedup: bool = False,
+        canonicalizer: Optional[KeyCanonicalizer] = None,
+        layout: Optional[ShardedLayout] = None,
+        weights: Optional[Sequence[float]] = None,
+        tier: Optional[S3Tier] = None,
+        durability: Durability = "fsync",
+    ):
+        """
+        Args:
+            cache_dir: Cache directory, or a list of directories to stripe entries across (see StripedRoots)
+            weights: Relative capacity of each cache directory, when striped
+            tier: Shared S3 tier behind the local files
+            durability: When written files are synced to disk: see Syncer
+        """
+        self.roots = StripedRoots([cache_dir] if isinstance(cache_dir, (str, Path)) else cache_dir, weights)
+        self.cache_dir = self.roots.roots[0]
+        logger.info("cache_dir=%s", self.roots.roots)
+        for root in self.roots.roots:
+            root.mkdir(parents=True, exist_ok=True)
         self.locking = locking
+        self.blobs = BlobStores(self.roots.roots) if dedup else None
+        self.canonicalizer = canonicalizer
+        self.layout = layout
+        self.tier = tier
+        self.syncer = Syncer(durability)
 
     def _meta_path(self, p: Path) -> Path:
         return p.with_suffix(p.suffix + ".meta")
 
-    def _load_meta(self, p: Path) -> dict[str, str]:
+    def _load_meta(self, p: Path) -> dict[str, Any]:
+        """The entry's .meta, or {} if it's missing, such as when migrate_layout has just moved it"""
         try:
             return json.loads(self._meta_path(p).read_text())
-        except FileNotFoundError:  # pragma: no cover
+        except FileNotFoundError:
             return {}
 
     def to_path(self, host: str, path: str, query: str) -> Path:
+        site, name = self._canonical_site_name(host, path, query)
+        return self._path(self.roots.root_for(f"{site}/{name}"), site, name)
+
+    def store(self, url: httpx.URL, tmp: Path, resp: httpx.Response) -> Path:
+        """Publishes the complete body in tmp as url's entry, with resp's headers. Returns the entry's path."""
+        host, path, query = url.host, url.path, url.query.decode()
+        target = self.to_path(host, path, query)
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        blobs = self.blobs.for_path(target) if self.blobs is not None else None
+        digest = None
+        if blobs is not None:
+            digest = hashlib.sha256()
+            with open(tmp, "rb") as f:
+                for chunk in iter(partial(f.read, 1024 * 1024), b""):
+                    digest.update(chunk)
+
+        fd = os.open(tmp, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            self.syncer.before_publish(fd)
+        finally:
+            os.close(fd)
+        size = tmp.stat().st_size
+        _publish(tmp, target, blobs, digest)
+
+        fetched = _http_time(resp.headers.get("Date")) or int(time.time())
+        meta = _meta(resp, fetched, _http_time(resp.headers.get("Last-Modified")), size)
+        meta_path = self._meta_path(target)
+        _write_meta(meta_path, meta, self.syncer)
+        self.syncer.published(target, meta_path)
+        if self.tier is not None:
+            self.tier.upload(self.tier_key(host, path, query), target, meta)
+        return target
+
+    def tier_key(self, host: str, path: str, query: str) -> str:
+        """Name of the entry in the S3 tier"""
+        return "/".join(self._canonical_site_name(host, path, query))
+
+    def _canonical_site_name(self, host: str, path: str, query: str) -> tuple[str, str]:
+        if self.canonicalizer is not None:
+            host, path, query = self.canonicalizer(host, path, query)
+        return self._site_name(host, path, query)
+
+    def _path(self, root: Path, site: str, name: str) -> Path:
+        if self.layout is not None:
+            return self.layout.path(root / site, name)
+        return root / site / name
+
+    def _site_name(self, host: str, path: str, query: str) -> tuple[str, str]:
         site = host.lower().rstrip(".")
-        (self.cache_dir / site).mkdir(parents=True, exist_ok=True)
         name = unquote(path).strip("/").replace("/", "-") or "index"
         if query:
             name += "-" + unquote(query).replace("&", "-").replace("=", "-")
-        return self.cache_dir / site / quote(name, safe="._-~")
+        return site, quote(name, safe="._-~")
+
+    def candidate_paths(self, host: str, path: str, query: str) -> list[Path]:
+        """
+        Paths the entry may be stored at, starting with to_path. Entries written before canonicalization, the
+        sharded layout or another cache root were added are stored at the others.
+        """
+        parts = [(host, path, query)]
+        if self.canonicalizer is not None:
+            parts.insert(0, self.canonicalizer(host, path, query))
+
+        paths: list[Path] = []
+        for site, name in dict.fromkeys(self._site_name(*p) for p in parts):
+            for root in self.roots.ranked(f"{site}/{name}"):
+                paths.append(self._path(root, site, name))
+                if self.layout is not None and len(name) <= NAME_MAX:
+                    paths.append(root / site / name)
+        return paths
 
     def get_if_fresh(
-        self, host: str, path: str, query: str, cache_rules: dict[str, dict[str, Union[bool, int]]]
+        self, host: str, path: str, query: str, cache_rules: CacheRules, tier: bool = True
+    ) -> tuple[bool, Optional[Path]]:
+        """Checks the local cache, then, if tier, fills a miss from the S3 tier"""
+        fresh, p = self._get_local_if_fresh(host, path, query, cache_rules)
+        if fresh or self.tier is None or not tier:
+            return fresh, p
+
+        cached = get_rule_for_request(request_host=host, target=path, cache_rules=cache_rules)
+        target = self.to_path(host, path, query)
+        if cached and self.tier.fill(self.tier_key(host, path, query), target, cached, self.syncer):
+            return True, target
+        return fresh, p
+
+    def _get_local_if_fresh(
+        self, host: str, path: str, query: str, cache_rules: CacheRules
     ) -> tuple[bool, Optional[Path]]:
         cached = get_rule_for_request(request_host=host, target=path, cache_rules=cache_rules)
 
@@ -94,15 +437,25 @@ class FileCache:
             logger.info("No cache policy for %s://%s, not retrieving from cache", host, path)
             return False, None
 
-        p = self.to_path(host=host, path=path, query=query)
-        if not p.exists():
-            logger.info("Cache file doesn't exist: %s for %s", path, p)
+        candidates = self.candidate_paths(host=host, path=path, query=query)
+        p = next((c for c in candidates if c.exists()), None)
+        if p is None:
+            logger.info("Cache file doesn't exist: %s for %s", path, candidates[0])
             return False, None
 
         meta = self._load_meta(p)
+        size = meta.get("size")
+        try:
+            st = p.stat()
+        except FileNotFoundError:  # pragma: no cover - moved by migrate_layout
+            return False, None
+        if size is not None and st.st_size != size:
+            self._discard_if_truncated(p, st, size)
+            return False, None
+
         fetched = meta.get("fetched")
         if not fetched:
-            return False, p  # pragma: no cover
+            return False, p
 
         if cached is True:
             logger.info("Cache policy allows unlimited cache, returning %s", p)
@@ -114,16 +467,190 @@ class FileCache:
         logger.info("file is %s seconds old, policy allows caching for up to %s", age, cached)
         return (age <= cached, p)
 
+    def _discard_if_truncated(self, p: Path, st: os.stat_result, size: int):
+        """
+        Writers publish the body before its .meta, so a body that's newer than its .meta is being published and is
+        only a miss. One that isn't was torn, such as by a crash, and is discarded. A deduplicated body is a hardlink
+        to an older blob, so the body's ctime, updated by the link and rename, is what's compared.
+        """
+        try:
+            meta_mtime = self._meta_path(p).stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if max(st.st_mtime_ns, st.st_ctime_ns) > meta_mtime:
+            logger.info("Cache entry %s is being published, treating it as a miss", p)
+            return
+
+        logger.warning("Discarding truncated cache entry %s: expected %s bytes", p, size)
+        p.unlink(missing_ok=True)
+        self._meta_path(p).unlink(missing_ok=True)
+
+    def get_negative(self, host: str, path: str, query: str, cache_rules: CacheRules) -> Optional[int]:
+        """Returns the status of a fresh negative entry for the request, if there is one"""
+        rule = match_rule(request_host=host, target=path, cache_rules=cache_rules)
+        if not isinstance(rule, dict) or not rule.get("status"):
+            return None
+
+        for p in self.candidate_paths(host=host, path=path, query=query):
+            try:
+                negative = json.loads(_negative_path(p).read_text())
+            except FileNotFoundError:
+                continue
+            ttl = negative_ttl(rule, negative["status"])
+            if ttl and _is_fresh(ttl, negative["fetched"]):
+                logger.info("Negative cache hit for %s: %s", p, negative["status"])
+                return negative["status"]
+            return None
+        return None
+
+    def store_negative(self, host: str, path: str, query: str, status: int):
+        """Records that the request got status, without its body"""
+        negative = _negative_path(self.to_path(host, path, query))
+        negative.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tmp_path(negative)
+        tmp.write_text(json.dumps({"status": status, "fetched": time.time()}))
+        os.replace(tmp, negative)
+
+
+def _negative_path(path: Path) -> Path:
+    return path.with_suffix(path.suffix + NEGATIVE_SUFFIX)
+
+
+def _http_time(value: Optional[str]) -> Optional[int]:
+    return calendar.timegm(time.strptime(value, "%a, %d %b %Y %H:%M:%S GMT")) if value else None
+
+
+def _publish(tmp: Path, path: Path, blobs: Optional[BlobStore], digest: Optional["hashlib._Hash"]):
+    if blobs is not None and digest is not None:
+        blobs.publish(tmp, path, digest.hexdigest())
+    else:
+        os.replace(tmp, path)
+
+
+def _meta(resp: httpx.Response, fetched: Optional[int], origin_lm: Optional[int], size: int) -> dict[str, Any]:
+    headers = {
+        "content-type": resp.headers.get("content-type"),
+        "content-encoding": resp.headers.get("content-encoding"),
+    }
+    # size marks the entry as complete: a truncated entry is discarded when read
+    return {"fetched": fetched, "origin_lm": origin_lm, "headers": headers, "size": size}
+
+
+class _Part(NamedTuple):
+    """An interrupted download taken over to be resumed"""
+
+    tmp: Path
+    offset: int
+    validator: str
+
+
+def _part_path(path: Path) -> Path:
+    return path.with_suffix(path.suffix + PART_SUFFIX)
+
+
+def if_range_validator(resp: httpx.Response) -> Optional[str]:
+    """The validator for If-Range: a strong ETag, else Last-Modified"""
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return resp.headers.get("Last-Modified")
+
+
+def _keep_part(tmp: Path, path: Path, validator: Optional[str]):
+    """Keeps the partial body in tmp to be resumed, if it can be: otherwise, removes it"""
+    try:
+        size = tmp.stat().st_size
+    except FileNotFoundError:
+        return
+    if not size or not validator:
+        tmp.unlink(missing_ok=True)
+        return
+
+    part = _part_path(path)
+    part_meta = part.with_suffix(part.suffix + ".meta")
+    meta_tmp = tmp_path(part_meta)
+    meta_tmp.write_text(json.dumps({"validator": validator}))
+    os.replace(meta_tmp, part_meta)
+    os.replace(tmp, part)
+    logger.info("Keeping %s bytes of %s to resume", size, path)
+
+
+def _take_part(path: Path) -> Optional[_Part]:
+    """Takes over the interrupted download of path, if there is one, by renaming it to a temporary file"""
+    part = _part_path(path)
+    part_meta = part.with_suffix(part.suffix + ".meta")
+    tmp = tmp_path(path)
+    try:
+        validator = json.loads(part_meta.read_text())["validator"]
+        os.replace(part, tmp)
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    part_meta.unlink(missing_ok=True)
+    return _Part(tmp, tmp.stat().st_size, validator)
+
+
+def _resumes(net: httpx.Response, part: _Part) -> bool:
+    """True if net is the remainder of part's body"""
+    if net.status_code != 206:
+        return False
+    content_range = net.headers.get("Content-Range", "")
+    unit, _, spec = content_range.partition(" ")
+    start = spec.partition("-")[0]
+    return unit == "bytes" and start.isdigit() and int(start) == part.offset
+
+
+def _content_length(net: httpx.Response) -> Optional[str]:
+    """The complete length of a 206 response's representation, if known"""
+    total = net.headers.get("Content-Range", "").rpartition("/")[2]
+    return total if total.isdigit() else None
+
+
+def _read_prefix(tmp: Path, offset: int, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    with open(tmp, "rb") as f:
+        while offset > 0:
+            chunk = f.read(min(chunk_size, offset))
+            if not chunk:
+                break  # pragma: no cover
+            offset -= len(chunk)
+            yield chunk
+
 
 class _TeeCore:
-    def __init__(self, resp: httpx.Response, path: Path, locking: bool, last_modified: str, access_date: str):
+    def __init__(
+        self,
+        resp: httpx.Response,
+        path: Path,
+        lock: Optional[FileLock],
+        last_modified: str,
+        access_date: str,
+        blobs: Optional[BlobStore] = None,
+        on_stored: Optional[Callable[[dict[str, Any]], None]] = None,
+        syncer: Optional[Syncer] = None,
+        part: Optional[_Part] = None,
+    ):
+        """
+        lock: the entry's single-flight lock, already held by the caller. Released once the entry is written.
+        part: an interrupted download that resp resumes. Its bytes are served, then resp's are appended.
+
+        The entry is only published once the whole body has been written: if the stream fails or is closed early,
+        the partial body is kept as a .part to be resumed, if resp has a validator.
+        """
         assert path is not None
 
         self.resp = resp
         self.path = path
-        self.tmp = path.with_name(path.name + ".tmp")
-        self.lock = FileLock(str(path) + ".lock") if locking else None
+        self.tmp = part.tmp if part is not None else tmp_path(path)
+        self.lock = lock
         self.fh = None
+        self.blobs = blobs
+        self.digest = hashlib.sha256() if blobs is not None else None
+        self.on_stored = on_stored
+        self.syncer = syncer or Syncer()
+        self.part = part
+        self.validator = if_range_validator(resp) or (part.validator if part is not None else None)
+        self.size = 0
+        self.complete = False
+        self.finalized = False
         if last_modified:
             self.mtime = calendar.timegm(time.strptime(last_modified, "%a, %d %b %Y %H:%M:%S GMT"))
         else:
@@ -134,48 +661,75 @@ class _TeeCore:
         else:
             self.atime = None  # pragma: no cover
 
-    def acquire(self):
-        self.lock and self.lock.acquire()  # pyright: ignore[reportUnusedExpression]
-
     def open_tmp(self):
-        self.fh = open(self.tmp, "wb")
+        self.fh = open(self.tmp, "ab" if self.part is not None else "wb")
+
+    def prefix(self) -> Iterator[bytes]:
+        """The resumed part's bytes"""
+        if self.part is None:
+            return
+        for chunk in _read_prefix(self.tmp, self.part.offset):
+            self.size += len(chunk)
+            if self.digest is not None:
+                self.digest.update(chunk)
+            yield chunk
 
     def write(self, chunk: bytes):
         self.fh.write(chunk)  # pyright: ignore[reportOptionalMemberAccess]
+        self.size += len(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
 
     def finalize(self):
         try:
-            if self.fh and not self.fh.closed:
+            if self.finalized:
+                return
+            self.finalized = True
+            if self.fh is not None:
                 self.fh.flush()
-                os.fsync(self.fh.fileno())
+                if self.complete:
+                    self.syncer.before_publish(self.fh.fileno())
                 self.fh.close()
-                os.replace(self.tmp, self.path)
-            try:
-                meta_path = self.path.with_suffix(self.path.suffix + ".meta")
-                headers = {
-                    "content-type": self.resp.headers.get("content-type"),
-                    "content-encoding": self.resp.headers.get("content-encoding"),
-                }
-
-                meta_path.write_text(json.dumps({"fetched": self.atime, "origin_lm": self.mtime, "headers": headers}))
-            except FileNotFoundError:  # pragma: no cover
-                pass
+            if not self.complete:
+                logger.warning("Incomplete response for %s", self.path)
+                _keep_part(self.tmp, self.path, self.validator)
+                return
+
+            _publish(self.tmp, self.path, self.blobs, self.digest)
+            meta = _meta(self.resp, self.atime, self.mtime, self.size)
+            meta_path = self.path.with_suffix(self.path.suffix + ".meta")
+            _write_meta(meta_path, meta, self.syncer)
+            self.syncer.published(self.path, meta_path)
+            if self.on_stored is not None:
+                self.on_stored(meta)
         finally:
             if self.lock and getattr(self.lock, "is_locked", False):
                 self.lock.release()
 
 
 class _TeeToDisk(httpx.SyncByteStream):
-    def __init__(self, resp: httpx.Response, path: Path, locking: bool, last_modified: str, access_date: str) -> None:
-        self.core = _TeeCore(resp, path, locking, last_modified, access_date)
+    def __init__(
+        self,
+        resp: httpx.Response,
+        path: Path,
+        lock: Optional[FileLock],
+        last_modified: str,
+        access_date: str,
+        blobs: Optional[BlobStore] = None,
+        on_stored: Optional[Callable[[dict[str, Any]], None]] = None,
+        syncer: Optional[Syncer] = None,
+        part: Optional[_Part] = None,
+    ) -> None:
+        self.core = _TeeCore(resp, path, lock, last_modified, access_date, blobs, on_stored, syncer, part)
 
     def __iter__(self) -> Iterator[bytes]:
-        self.core.acquire()
         try:
+            yield from self.core.prefix()
             self.core.open_tmp()
             for chunk in self.core.resp.iter_raw():
                 self.core.write(chunk)
                 yield chunk
+            self.core.complete = True
         finally:
             self.core.finalize()
 
@@ -187,11 +741,29 @@ class _TeeToDisk(httpx.SyncByteStream):
 
 
 class _AsyncTeeToDisk(httpx.AsyncByteStream):
-    def __init__(self, resp: httpx.Response, path: Path, locking: bool, last_modified: str, access_date: str):
+    def __init__(
+        self,
+        resp: httpx.Response,
+        path: Path,
+        lock: Optional[AsyncFileLock],
+        last_modified: str,
+        access_date: str,
+        blobs: Optional[BlobStore] = None,
+        on_stored: Optional[Callable[[dict[str, Any]], None]] = None,
+        syncer: Optional[Syncer] = None,
+        part: Optional[_Part] = None,
+    ):
+        """See _TeeCore"""
         self.resp = resp
         self.path = path
-        self.tmp = path.with_name(path.name + ".tmp")
-        self.lock = AsyncFileLock(str(path) + ".lock") if locking else None
+        self.tmp = part.tmp if part is not None else tmp_path(path)
+        self.lock = lock
+        self.blobs = blobs
+        self.digest = hashlib.sha256() if blobs is not None else None
+        self.on_stored = on_stored
+        self.syncer = syncer or Syncer()
+        self.part = part
+        self.validator = if_range_validator(resp) or (part.validator if part is not None else None)
         if last_modified:
             self.mtime = calendar.timegm(time.strptime(last_modified, "%a, %d %b %Y %H:%M:%S GMT"))
         else:
@@ -203,21 +775,54 @@ class _AsyncTeeToDisk(httpx.AsyncByteStream):
             self.atime = None  # pragma: no cover
 
     async def __aiter__(self):
-        if self.lock:
-            await self.lock.acquire()
+        complete = False
         try:
-            async with aiofiles.open(self.tmp, "wb") as f:
-                async for chunk in self.resp.aiter_raw():
-                    await f.write(chunk)
-                    yield chunk
-            os.replace(self.tmp, self.path)
-            async with aiofiles.open(self.path.with_suffix(self.path.suffix + ".meta"), "w") as m:
-                headers = {
-                    "content-type": self.resp.headers.get("content-type"),
-                    "content-encoding": self.resp.headers.get("content-encoding"),
-                }
-                await m.write(json.dumps({"fetched": self.atime, "origin_lm": self.mtime, "headers": headers}))
+            size = 0
+            if self.part is not None:
+                async with aiofiles.open(self.tmp, "rb") as f:
+                    while size < self.part.offset:
+                        chunk = await f.read(min(WRITE_BUFFER_SIZE, self.part.offset - size))
+                        if not chunk:
+                            break  # pragma: no cover
+                        size += len(chunk)
+                        if self.digest is not None:
+                            self.digest.update(chunk)
+                        yield chunk
+
+            buffer = bytearray()
+            async with aiofiles.open(self.tmp, "ab" if self.part is not None else "wb") as f:
+                try:
+                    async for chunk in self.resp.aiter_raw():
+                        buffer += chunk
+                        if len(buffer) >= WRITE_BUFFER_SIZE:
+                            await f.write(buffer)
+                            size += len(buffer)
+                            buffer = bytearray()
+                        if self.digest is not None:
+                            self.digest.update(chunk)
+                        yield chunk
+                except Exception:
+                    await f.write(buffer)  # kept to be resumed
+                    raise
+                if buffer:
+                    await f.write(buffer)
+                    size += len(buffer)
+                await f.flush()
+                await to_thread.run_sync(self.syncer.before_publish, f.fileno())
+            complete = True
+
+            _publish(self.tmp, self.path, self.blobs, self.digest)
+            meta = _meta(self.resp, self.atime, self.mtime, size)
+            meta_path = self.path.with_suffix(self.path.suffix + ".meta")
+            await to_thread.run_sync(_write_meta, meta_path, meta, self.syncer)
+            await to_thread.run_sync(self.syncer.published, self.path, meta_path)
+            if self.on_stored is not None:
+                await to_thread.run_sync(self.on_stored, meta)
         finally:
+            if not complete:
+                # Only complete bodies are published
+                logger.warning("Incomplete response for %s", self.path)
+                _keep_part(self.tmp, self.path, self.validator)
             if self.lock:
                 await self.lock.release()
 
@@ -225,23 +830,52 @@ class _AsyncTeeToDisk(httpx.AsyncByteStream):
         try:
             await self.resp.aclose()
         finally:
+            # A resumed part that was never read
+            _keep_part(self.tmp, self.path, self.validator)
             if self.lock:
                 await self.lock.release()
 
 
 class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
-    cache_rules: dict[str, dict[str, Union[bool, int]]]
+    """
+    Misses that cache_rules cache are single-flight across threads and processes: before going to the network, the
+    entry's lock is taken, and the cache is checked again once it's held, so a request that waited on another's fetch
+    is served from the entry that fetch wrote. The lock is held until the response body has been written to the
+    cache. The S3 tier is only checked once the lock is held.
+
+    Writes don't rely on the lock: each writer writes its own temporary files, and renames the body and then the .meta
+    over the entry, so concurrent writers never see each other's partial files and the last writer wins.
+    """
+
+    cache_rules: CacheRules
     streaming_cutoff: int = 8 * 1024 * 1024
+    lock_timeout: float = 300
+    """Seconds to wait for another fetch of the same entry, before fetching it anyway"""
 
     transport: httpx.HTTPTransport
     _cache: FileCache 
     def __init__(
         self,
-        cache_dir: Union[str, Path],
-        cache_rules: dict[str, dict[str, Union[bool, int]]],
+        cache_dir: Union[str, Path, Sequence[Union[str, Path]]],
+        cache_rules: CacheRules,
         transport: Optional[httpx.BaseTransport] = None,
+        dedup: bool = False,
+        canonicalizer: Optional[KeyCanonicalizer] = None,
+        layout: Optional[ShardedLayout] = None,
+        weights: Optional[Sequence[float]] = None,
+        tier: Optional[S3Tier] = None,
+        durability: Durability = "fsync",
     ):
-        self._cache = FileCache(cache_dir=cache_dir, locking=True)
+        self._cache = FileCache(
+            cache_dir=cache_dir,
+            locking=True,
+            dedup=dedup,
+            canonicalizer=canonicalizer,
+            layout=layout,
+            weights=weights,
+            tier=tier,
+            durability=durability,
+        )
         self.transport = transport or httpx.HTTPTransport()
         self.cache_rules = cache_rules
 
@@ -261,12 +895,33 @@ class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
 
         headers = [
             ("x-cache", "HIT"),
-            ("content-length", str(size)),
             ("Date", date),
             ("Last-Modified", last_modified),
+            ("Accept-Ranges", "bytes"),
         ]
+
+        decode = _decoded(ce, req.headers.get("Accept-Encoding")) if status_code == 200 else None
+        if decode:
+            # Decoded as it's streamed, so the length isn't known
+            if ct:
+                headers.append(("content-type", ct))
+            return httpx.Response(
+                status_code=status_code,
+                headers=headers,
+                stream=DecodedStream(DualFileStream(path), decode),
+                request=req,
+            )
+
         if ce:
             headers.append(("content-encoding", ce))
+
+        # Ranges of an encoded body can't be decoded by the client, so it's served whole
+        if status_code == 200 and "range" in req.headers and not ce:
+            ranges = self._requested_ranges(req, last_modified, size)
+            if ranges is not None:
+                return self._range_response(req, path, headers, ct, size, ranges)
+
+        headers.append(("content-length", str(size)))
         if ct:
             headers.append(("content-type", ct))
 
@@ -287,38 +942,207 @@ class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
                 request=req,
             )
 
-    def _cache_miss_response(self, req: httpx.Request, net: httpx.Response, path: Path, tee_factory):
-        if net.status_code != 200:
-            return net
+    def _requested_ranges(self, req: httpx.Request, last_modified: str, size: int) -> Optional[list[tuple[int, int]]]:
+        """The ranges to serve, or None to serve the whole body"""
+        if_range = req.headers.get("If-Range")
+        if if_range is not None and if_range != last_modified:
+            # Changed, or an ETag, which isn't stored
+            return None
+        return parse_range(req.headers["Range"], size)
 
+    def _range_response(
+        self,
+        req: httpx.Request,
+        path: Path,
+        headers: list[tuple[str, str]],
+        ct: Optional[str],
+        size: int,
+        ranges: list[tuple[int, int]],
+    ) -> httpx.Response:
+        """A 206 with ranges of the cached body, as multipart/byteranges if there's more than one"""
+        if not ranges:
+            headers += [("content-range", f"bytes */{size}"), ("content-length", "0")]
+            return httpx.Response(status_code=416, headers=headers, content=b"", request=req)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers.append(("content-range", f"bytes {start}-{end}/{size}"))
+            if ct:
+                headers.append(("content-type", ct))
+            parts: list[Union[bytes, tuple[int, int]]] = [ranges[0]]
+            length = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            headers.append(("content-type", f"multipart/byteranges; boundary={boundary}"))
+            parts, length = [], 0
+            for start, end in ranges:
+                part_headers = f"--{boundary}\r\n"
+                if ct:
+                    part_headers += f"Content-Type: {ct}\r\n"
+                part_headers += f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                separator = ("\r\n" if parts else "").encode() + part_headers.encode()
+                parts += [separator, (start, end)]
+                length += len(separator) + end - start + 1
+            closing = f"\r\n--{boundary}--\r\n".encode()
+            parts.append(closing)
+            length += len(closing)
+
+        headers.append(("content-length", str(length)))
+        return httpx.Response(status_code=206, headers=headers, stream=RangeFileStream(path, parts), request=req)
+
+    def _lock_path(self, path: Path) -> str:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return str(path) + ".lock"
+
+    def _cacheable(self, request: httpx.Request) -> bool:
+        """Only misses that cache_rules cache are single-flight: others are never served from the cache"""
+        return bool(get_rule_for_request(request.url.host, request.url.path, self.cache_rules))
+
+    def _acquire(self, path: Path) -> Optional[FileLock]:
+        if not self._cache.locking:
+            return None
+        lock = FileLock(self._lock_path(path), thread_local=False)
+        try:
+            lock.acquire(timeout=self.lock_timeout)
+        except Timeout:
+            logger.warning("Timed out waiting for another fetch of %s, fetching anyway", path)
+            return None
+        return lock
+
+    async def _acquire_async(self, path: Path) -> Optional[AsyncFileLock]:
+        if not self._cache.locking:
+            return None
+        lock = AsyncFileLock(self._lock_path(path))
+        try:
+            await lock.acquire(timeout=self.lock_timeout)
+        except Timeout:
+            logger.warning("Timed out waiting for another fetch of %s, fetching anyway", path)
+            return None
+        return lock
+
+    def _negotiate(self, request: httpx.Request) -> Optional[str]:
+        """Asks for a compressed body, whatever the caller accepts, so it's stored compressed. Returns the caller's
+        Accept-Encoding. A caller's Range is of the body as it accepts it, so its encoding is left alone."""
+        accept_encoding = request.headers.get("Accept-Encoding")
+        if "range" not in request.headers:
+            request.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        return accept_encoding
+
+    def _resume(self, request: httpx.Request, target: Path, path: Optional[Path]) -> Optional[_Part]:
+        """Takes over an interrupted download of target, if there is one, and asks for the rest of it"""
+        if path is not None or "range" in request.headers:
+            return None
+        part = _take_part(target)
+        if part is not None:
+            request.headers["Range"] = f"bytes={part.offset}-"
+            request.headers["If-Range"] = part.validator
+        return part
+
+    def _resumed(self, request: httpx.Request, net: httpx.Response, part: _Part) -> bool:
+        """Returns True if net resumes part. Otherwise, part is discarded."""
+        del request.headers["Range"], request.headers["If-Range"]
+        if _resumes(net, part):
+            logger.info("Resuming %s from %s bytes", request.url, part.offset)
+            return True
+        logger.info("Couldn't resume %s: %s", request.url, net.status_code)
+        part.tmp.unlink(missing_ok=True)
+        return False
+
+    def _cache_miss_response(
+        self,
+        req: httpx.Request,
+        net: httpx.Response,
+        path: Path,
+        tee_factory: Callable[..., Union[httpx.SyncByteStream, httpx.AsyncByteStream]],
+        lock: Union[FileLock, AsyncFileLock, None],
+        part: Optional[_Part] = None,
+        accept_encoding: Optional[str] = None,
+    ) -> httpx.Response:
+        """
+        Returns net if it's not cacheable, decoded if its accept_encoding doesn't accept net's content coding.
+        Otherwise, the response tees the body to path and releases lock.
+
+        If net resumes part, the response is the complete body: part's bytes followed by net's. The body is stored as
+        sent, and decoded for the caller if its accept_encoding doesn't accept net's content coding.
+        """
+        if net.status_code != 200 and part is None:
+            if get_negative_ttl(req.url.host, req.url.path, self.cache_rules, net.status_code):
+                self._cache.store_negative(req.url.host, req.url.path, req.url.query.decode(), net.status_code)
+            decode = _decoded(net.headers.get("content-encoding"), accept_encoding)
+            if decode is None:
+                return net
+            return httpx.Response(
+                status_code=net.status_code,
+                headers=[(k, v) for k, v in net.headers.items() if k.lower() not in _DECODED_DROPPED],
+                stream=DecodedStream(net.stream, decode),
+                request=req,
+                extensions={**net.extensions, "decode_content": False},
+            )
+
+        on_stored = None
+        if self._cache.tier is not None:
+            # Write through to the shared tier
+            key = self._cache.tier_key(req.url.host, req.url.path, req.url.query.decode())
+            on_stored = partial(self._cache.tier.upload, key, path)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        decode = _decoded(net.headers.get("content-encoding"), accept_encoding)
+        dropped = ["transfer-encoding"]
+        if part is not None:
+            dropped += ["content-range", "content-length"]
+        if decode:
+            # Decoded as it's streamed, so the length isn't known
+            dropped += ["content-encoding", "content-length"]
         miss_headers = [
             (k, v)
             for k, v in net.headers.items()
-            if k.lower() not in ("transfer-encoding",)  # "content-encoding", "content-length", "transfer-encoding")
+            if k.lower() not in dropped  # "content-encoding", "content-length", "transfer-encoding")
         ]
+        if part is not None and _content_length(net) is not None and not decode:
+            miss_headers.append(("content-length", _content_length(net)))
         miss_headers.append(("x-cache", "MISS"))
+
+        stream = tee_factory(
+            net,
+            path,
+            lock,
+            net.headers.get("Last-Modified"),
+            net.headers.get("Date"),
+            self._cache.blobs.for_path(path) if self._cache.blobs is not None else None,
+            on_stored,
+            self._cache.syncer,
+            part,
+        )
         return httpx.Response(
-            status_code=net.status_code,
+            status_code=200,
             headers=miss_headers,
-            stream=tee_factory(
-                net, path, self._cache.locking, net.headers.get("Last-Modified"), net.headers.get("Date")
-            ),
+            stream=DecodedStream(stream, decode) if decode else stream,
             request=req,
             extensions={**net.extensions, "decode_content": False},
         )
 
-    def return_if_fresh(self, request: httpx.Request) -> Tuple[Optional[httpx.Response], Optional[Path]]:
+    def return_if_fresh(
+        self, request: httpx.Request, tier: bool = True
+    ) -> Tuple[Optional[httpx.Response], Optional[Path]]:
         host = request.url.host
         path = request.url.path
         query = request.url.query.decode() if request.url.query else ""
 
-        fresh, path = self._cache.get_if_fresh(host, path, query, self.cache_rules)
+        fresh, path = self._cache.get_if_fresh(host, path, query, self.cache_rules, tier)
+        if not fresh:
+            status = self._cache.get_negative(host, request.url.path, query, self.cache_rules)
+            if status is not None:
+                return httpx.Response(status_code=status, headers=[("x-cache", "HIT")], request=request), None
 
         if path:
             if fresh:
-                return self._cache_hit_response(request, path), path
+                try:
+                    return self._cache_hit_response(request, path), path
+                except FileNotFoundError:
+                    # Moved by migrate_layout since it was found
+                    return None, None
             else:
-                lm = json.loads(path.with_suffix(path.suffix + ".meta").read_text()).get("origin_lm")
+                lm = self._cache._load_meta(path).get("origin_lm")
                 if lm:
                     request.headers["If-Modified-Since"] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(lm))
                     return None, path
@@ -331,36 +1155,87 @@ class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
         if request.method != "GET":
             return self.transport.handle_request(request)
 
-        response, path = self.return_if_fresh(request)
+        # The S3 tier is only checked once the lock is held, so a miss makes one tier request
+        response, path = self.return_if_fresh(request, tier=False)
         if response:
             return response
 
-        net = self.transport.handle_request(request)
-        if net.status_code == 304:
-            logger.info("304 for %s", request)
-            assert path is not None  # must be true
-            return self._cache_hit_response(request, path, status_code=304)
-
         host = request.url.host
-        path = request.url.path
         query = request.url.query.decode() if request.url.query else ""
+        target = self._cache.to_path(host, request.url.path, query)
 
-        path = self._cache.to_path(host, path, query)
-        return self._cache_miss_response(request, net, path, _TeeToDisk)
+        lock = self._acquire(target) if self._cacheable(request) else None
+        try:
+            # Another fetch of this entry may have completed while waiting for the lock
+            response, path = self.return_if_fresh(request)
+            if response:
+                return response
+
+            accept_encoding = self._negotiate(request)
+            part = self._resume(request, target, path)
+            try:
+                net = self.transport.handle_request(request)
+            except Exception:
+                if part is not None:
+                    _keep_part(part.tmp, target, part.validator)
+                raise
+            if part is not None and not self._resumed(request, net, part):
+                part = None
+                if net.status_code in (206, 416):  # A different range, or none: fetch it all
+                    net.close()
+                    net = self.transport.handle_request(request)
+            if net.status_code == 304:
+                logger.info("304 for %s", request)
+                assert path is not None  # must be true
+                return self._cache_hit_response(request, path, status_code=304)
+
+            response = self._cache_miss_response(request, net, target, _TeeToDisk, lock, part, accept_encoding)
+            if response is not net:
+                lock = None  # released by the tee
+            return response
+        finally:
+            if lock is not None:
+                lock.release()
 
     async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
         if request.method != "GET":
             return await self.transport.handle_async_request(request)  # type: ignore[attr-defined]
 
-        response, path = self.return_if_fresh(request)
+        response, path = self.return_if_fresh(request, tier=False)
         if response:
             return response
 
-        net: httpx.Response = await self.transport.handle_async_request(request)
-        if net.status_code == 304:
-            assert path is not None  # must be true
-            logger.info("304 for %s", request)
-            return self._cache_hit_response(request, path, status_code=304)
+        target = self._cache.to_path(request.url.host, request.url.path, request.url.query.decode())
+
+        lock = await self._acquire_async(target) if self._cacheable(request) else None
+        try:
+            # Another fetch of this entry may have completed while waiting for the lock
+            response, path = self.return_if_fresh(request)
+            if response:
+                return response
 
-        path = self._cache.to_path(request.url.host, request.url.path, request.url.query.decode())
-        return self._cache_miss_response(request, net, path, _AsyncTeeToDisk)
+            accept_encoding = self._negotiate(request)
+            part = self._resume(request, target, path)
+            try:
+                net: httpx.Response = await self.transport.handle_async_request(request)  # type: ignore[attr-defined]
+            except Exception:
+                if part is not None:
+                    _keep_part(part.tmp, target, part.validator)
+                raise
+            if part is not None and not self._resumed(request, net, part):
+                part = None
+                if net.status_code in (206, 416):  # A different range, or none: fetch it all
+                    await net.aclose()
+                    net = await self.transport.handle_async_request(request)  # type: ignore[attr-defined]
+            if net.status_code == 304:
+                assert path is not None  # must be true
+                logger.info("304 for %s", request)
+                return self._cache_hit_response(request, path, status_code=304)
+
+            response = self._cache_miss_response(request, net, target, _AsyncTeeToDisk, lock, part, accept_encoding)
+            if response is not net:
+                lock = None  # released by the tee
+            return response
+        finally:
+            if lock is not None:
+                await lock.release()
@@ -1,24 +1,59 @@
 import asyncio
+import concurrent.futures
+import functools
 import importlib.util
 import logging
+import multiprocessing.context
 import os
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, AsyncGenerator, Callable, Generator, Literal, Mapping, Optional, Sequence, Union
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import hishel
+import httpcore
 import httpx
+from anyio import to_thread
 from httpx._types import ProxyTypes
 from pyrate_limiter import Duration, Limiter
 
-from .controller import get_cache_controller
-from .filecache.transport import CachingTransport
-from .key_generator import file_key_generator
+from .batch import MemoryBudget, SpilledBody, read_bounded
+from .blobstore import BlobStores, tmp_path
+from .controller import CacheRules, get_cache_controller, get_rule_for_request
+from .filecache.transport import CachingTransport, FileCache, S3Tier
+from .inventory import CachePlan, plan
+from .key_generator import KeyCanonicalizer, canonical_key_generator, file_key_generator, request_for_url
+from .layout import ShardedLayout, StripedRoots, migrate
 from .ratelimiter import AsyncRateLimitingTransport, RateLimitingTransport, create_rate_limiter
-from .serializer import JSONByteSerializer
+from .segmented import DEFAULT_CONNECTIONS, download_segmented
+from .segments import SegmentStore
+from .serializer import BinaryByteSerializer, CompressingSerializer
+from .storage import (
+    SEGMENT_DIR,
+    AsyncSegmentFileStorage,
+    AsyncSQLiteFileStorage,
+    AsyncStreamingFileStorage,
+    AsyncStreamingS3Storage,
+    SegmentFileStorage,
+    SQLiteFileStorage,
+    StreamingFileStorage,
+    StreamingS3Storage,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -42,27 +77,61 @@ class HttpxThrottleCache:
         default_factory=lambda: {"default_encoding": "utf-8", "http2": HTTP2, "verify": True}
     )
 
-    cache_rules: dict[str, dict[str, Union[bool, int]]] = field(default_factory=lambda: {})
+    cache_rules: CacheRules = field(default_factory=lambda: {})
     rate_limiter_enabled: bool = True
-    cache_mode: Literal[False, "Disabled", "Hishel-S3", "Hishel-File", "FileCache"] = "Hishel-File"
+    cache_mode: Literal[
+        False, "Disabled", "Hishel-S3", "Hishel-File", "Hishel-Segment", "Hishel-SQLite", "FileCache"
+    ] = "Hishel-File"
     request_per_sec_limit: int = 10
     max_delay: Duration = field(default_factory=lambda: Duration.DAY)
     _client: Optional[httpx.Client] = None
 
     rate_limiter: Optional[Limiter] = None
     s3_bucket: Optional[str] = None
+    """Bucket for Hishel-S3. With FileCache, a shared S3 tier behind the local cache_dir: see S3Tier."""
     s3_client: Optional[Any] = None
     user_agent: Optional[str] = None
     user_agent_factory: Optional[Callable[[], str]] = None
 
-    cache_dir: Optional[Union[Path, str]] = None
+    cache_dir: Optional[Union[Path, str, list[Union[Path, str]]]] = None
+    """Cache directory, or a list of directories (such as one per drive) to stripe FileCache and Hishel-File entries
+    across"""
+    cache_dir_weights: Optional[list[float]] = None
+    """Relative capacity of each cache_dir, when a list"""
+    cache_compression: bool = False
+    """Compress Hishel-File and Hishel-S3 entries at rest, choosing the codec by Content-Type"""
+    cache_dedup: bool = False
+    """Store identical bodies once, shared across cache keys. FileCache and Hishel-File only."""
+    canonical_keys: bool = False
+    """Canonicalize URLs before building cache keys, so equivalent URLs share a cache entry. See KeyCanonicalizer."""
+    ignored_query_params: dict[str, list[str]] = field(default_factory=lambda: {})
+    """Site regular expression to query parameter name regular expressions to drop from cache keys. Requires
+    canonical_keys=True."""
+    cache_layout: Literal["flat", "sharded"] = "flat"
+    """sharded fans FileCache and Hishel-File entries out into hash-prefixed subdirectories. See migrate_layout."""
+    cache_durability: Literal["none", "batch", "fsync"] = "fsync"
+    """When FileCache writes are synced to disk: fsync each file, batch periodic syncs, or none. See Syncer."""
+    segmented_download_size: Optional[int] = None
+    """get_batch downloads bodies at least this large (by a HEAD request's Content-Length) as segmented_connections
+    byte ranges in parallel, into the FileCache or the destination path. The HEAD request costs a rate limiter token
+    for each URL that isn't fresh in the cache. None disables segmented downloads."""
+    segmented_connections: int = DEFAULT_CONNECTIONS
 
     lock = threading.Lock()
 
     proxy: Optional[ProxyTypes] = None
 
+    _file_cache: Optional[FileCache] = field(default=None, init=False, repr=False)
+    _lookup_storage: Optional[Union[StreamingFileStorage, StreamingS3Storage]] = field(
+        default=None, init=False, repr=False
+    )
+    _lookup_controller: Optional[tuple[Any, hishel.Controller]] = field(default=None, init=False, repr=False)
+
     def __post_init__(self):
-        self.cache_dir = Path(self.cache_dir) if isinstance(self.cache_dir, str) else self.cache_dir
+        if isinstance(self.cache_dir, list):
+            self.cache_dir = [Path(p) for p in self.cache_dir]
+        else:
+            self.cache_dir = Path(self.cache_dir) if isinstance(self.cache_dir, str) else self.cache_dir
         # self.lock = threading.Lock()
 
         if self.rate_limiter_enabled and self.rate_limiter is None:
@@ -70,6 +139,9 @@ class HttpxThrottleCache:
                 requests_per_second=self.request_per_sec_limit, max_delay=self.max_delay
             )
 
+        if self.ignored_query_params and not self.canonical_keys:
+            raise ValueError("ignored_query_params requires canonical_keys=True")
+
         if (self.cache_mode != "Disabled" or self.cache_mode is False) and not self.cache_rules:
             logger.info("Cache is enabled, but no cache_rules provided. Will use default caching.")
 
@@ -78,12 +150,17 @@ class HttpxThrottleCache:
         elif self.cache_mode == "Hishel-S3":
             if self.s3_bucket is None:
                 raise ValueError("s3_bucket must be provided if using Hishel-S3 storage")
-        else:  # Hishel-File or FileCache
+            if self.cache_dedup:
+                raise ValueError("cache_dedup is only supported for file based caches, not Hishel-S3")
+            if self.cache_layout != "flat":
+                raise ValueError("cache_layout is only supported for file based caches, not Hishel-S3")
+        else:  # Hishel-File, Hishel-Segment, Hishel-SQLite or FileCache
             if self.cache_dir is None:
                 raise ValueError(f"cache_dir must be provided if using a file based cache: {self.cache_mode}")
             else:
-                if not self.cache_dir.exists():
-                    self.cache_dir.mkdir()
+                for root in self._get_roots().roots:
+                    if not root.exists():
+                        root.mkdir()
 
         logger.debug(
             "Initialized cache with cache_mode=%s, cache_dir=%s, rate_limiter_enabled=%s",
@@ -116,6 +193,8 @@ class HttpxThrottleCache:
         self,
         *,
         urls: Sequence[str] | Mapping[str, Path],
+        max_in_memory: Optional[int] = None,
+        spill_dir: Optional[Union[str, Path]] = None,
         _client_mocker: Optional[Callable[[httpx.AsyncClient], httpx.AsyncClient]] = None,
     ):
         """
@@ -126,10 +205,14 @@ class HttpxThrottleCache:
 
         Args:
             urls (Sequence[str] | Mapping[str, Path]):
+            max_in_memory (Optional[int]): For in-memory results, the maximum total bytes of content held in memory.
+                Content beyond this is spilled to temporary files and returned as SpilledBody handles.
+            spill_dir (Optional[Union[str, Path]]): Directory for spilled temporary files. Defaults to the system temp dir.
 
         Returns:
             list:
                 - If given mappings, then returns a list of Paths. Else, a list of the Content
+                - If max_in_memory is set, the Content is a bytearray or a SpilledBody
 
         Raises:
             RuntimeError: If any URL responds with a status code other than 200 or 304.
@@ -137,13 +220,20 @@ class HttpxThrottleCache:
 
         import aiofiles
 
-        async def _run() -> Sequence[Path | bytes]:
-            async with self.async_http_client() as client:
+        budget = MemoryBudget(max_in_memory) if max_in_memory is not None else None
+
+        async def _run() -> Sequence[Path | bytes | bytearray | SpilledBody]:
+            async with self.async_http_client() as client, self._segmented_client() as segmented:
                 if _client_mocker:
                     # For testing
                     _client_mocker(client)
+                    if segmented is not None:
+                        _client_mocker(segmented)
+
+                async def task(url: str, path: Optional[Path]) -> Path | bytes | bytearray | SpilledBody:
+                    if segmented is not None and await self._download_segmented(segmented, url, path):
+                        return path  # type: ignore[return-value]
 
-                async def task(url: str, path: Optional[Path]) -> Path | bytes:
                     async with client.stream("GET", url) as r:
                         if r.status_code in (200, 304):
                             if path:
@@ -152,6 +242,8 @@ class HttpxThrottleCache:
                                     async for chunk in r.aiter_bytes():
                                         await f.write(chunk)
                                 return path
+                            elif budget is not None:
+                                return await read_bounded(r, budget, spill_dir)
                             else:
                                 return await r.aread()
                         else:
@@ -165,6 +257,188 @@ class HttpxThrottleCache:
         with ThreadPoolExecutor(1) as pool:
             return pool.submit(lambda: asyncio.run(_run())).result()
 
+    @asynccontextmanager
+    async def _segmented_client(self) -> AsyncGenerator[Optional[httpx.AsyncClient], None]:
+        """A client for segmented downloads, if enabled. Ranges bypass the cache, but not the rate limiter."""
+        if self.segmented_download_size is None:
+            yield None
+            return
+        async with self.async_http_client(bypass_cache=True) as client:
+            yield client
+
+    async def _download_segmented(self, client: httpx.AsyncClient, url: str, path: Optional[Path]) -> bool:
+        """
+        Downloads url as byte ranges in parallel if it's large enough and isn't already cached: with FileCache, if
+        cache_rules cache url, into the cache, so it's then served from there. Otherwise, to path.
+
+        Its size is found with a HEAD request, which pays a rate limiter token, unless a stale FileCache copy shows
+        it's too small.
+
+        Returns:
+            True if url was downloaded to path
+        """
+        assert self.segmented_download_size is not None
+        if self._lookup(url, body=False)[0]:
+            return False
+
+        parsed = httpx.URL(url)
+        if self.cache_mode == "FileCache" and get_rule_for_request(parsed.host, parsed.path, self.cache_rules):
+            file_cache = self._get_file_cache()
+            target = file_cache.to_path(parsed.host, parsed.path, parsed.query.decode())
+            if target.is_file() and target.stat().st_size < self.segmented_download_size:
+                return False  # a stale copy was too small, so this one likely is: save the HEAD request
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = tmp_path(target)
+            head = await download_segmented(client, url, tmp, self.segmented_download_size, self.segmented_connections)
+            if head is not None:
+                await to_thread.run_sync(file_cache.store, parsed, tmp, head)
+            return False
+        elif path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = tmp_path(path)
+            head = await download_segmented(client, url, tmp, self.segmented_download_size, self.segmented_connections)
+            if head is None:
+                return False
+            os.replace(tmp, path)
+            return True
+        return False
+
+    def _fetch(self, client: httpx.Client, url: str, path: Optional[Path]) -> Path | bytes:
+        with client.stream("GET", url) as r:
+            if r.status_code in (200, 304):
+                if path:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(path, "wb") as f:
+                        for chunk in r.iter_bytes():
+                            f.write(chunk)
+                    return path
+                else:
+                    return r.read()
+            else:
+                raise RuntimeError(f"URL status code is not 200 or 304: {url=}")
+
+    def get_batch_threaded(
+        self,
+        *,
+        urls: Sequence[str] | Mapping[str, Path],
+        max_workers: int = 8,
+        as_completed: bool = False,
+        _client_mocker: Optional[Callable[[httpx.Client], Any]] = None,
+    ) -> Union[list[Path | bytes], Iterator[tuple[str, Path | bytes]]]:
+        """
+        Fetch a batch of URLs concurrently using a thread pool and the shared synchronous client.
+
+        Unlike get_batch, no event loop is used: requests go through the same httpx.Client (and connection pool)
+        returned by http_client(), and the same rate limiting and caching transports.
+
+        Args:
+            urls (Sequence[str] | Mapping[str, Path]): URLs, or a mapping of URLs to the Path to write each to
+            max_workers (int): Number of threads
+            as_completed (bool): If True, returns an iterator of (url, result) in completion order
+
+        Returns:
+            If as_completed, an iterator of (url, result). Else, a list of results in the order of urls.
+            Results are Paths if given a mapping, else the Content.
+
+        Raises:
+            RuntimeError: If any URL responds with a status code other than 200 or 304.
+        """
+        with self.http_client() as client:
+            if _client_mocker:
+                # For testing
+                _client_mocker(client)
+
+        items = list(urls.items()) if isinstance(urls, Mapping) else [(url, None) for url in urls]
+
+        if as_completed:
+            return self._iter_batch_threaded(client, items, max_workers)
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            return list(pool.map(lambda item: self._fetch(client, *item), items))
+
+    def _iter_batch_threaded(
+        self, client: httpx.Client, items: list[tuple[str, Optional[Path]]], max_workers: int
+    ) -> Iterator[tuple[str, Path | bytes]]:
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = {pool.submit(self._fetch, client, url, path): url for url, path in items}
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+
+    def get_batch_pipeline(
+        self,
+        *,
+        urls: Sequence[str] | Mapping[str, Path],
+        func: Callable[[Any], Any],
+        max_workers: int = 8,
+        process_workers: Optional[int] = None,
+        mp_context: Optional[multiprocessing.context.BaseContext] = None,
+        _client_mocker: Optional[Callable[[httpx.Client], Any]] = None,
+    ) -> Iterator[tuple[str, Any]]:
+        """
+        Fetch a batch of URLs and process each result in a process pool, as soon as it's downloaded.
+
+        Downloads use a thread pool and the shared synchronous client, as in get_batch_threaded, so they go through
+        the shared rate limiter and cache. Each downloaded result is passed to func in a ProcessPoolExecutor, so
+        parsing overlaps with fetching and runs across all cores.
+
+        Args:
+            urls (Sequence[str] | Mapping[str, Path]): URLs, or a mapping of URLs to the Path to write each to.
+                For large bodies, prefer a mapping: func then receives the Path, rather than the pickled Content.
+            func (Callable): Picklable callable, called with the Path (if given a mapping) or the Content
+            max_workers (int): Number of download threads
+            process_workers (Optional[int]): Number of worker processes, defaults to the number of CPUs
+            mp_context: Multiprocessing context for the ProcessPoolExecutor
+
+        Returns:
+            Iterator of (url, func(result)), in completion order.
+
+        Raises:
+            RuntimeError: If any URL responds with a status code other than 200 or 304.
+        """
+        with self.http_client() as client:
+            if _client_mocker:
+                # For testing
+                _client_mocker(client)
+
+        items = list(urls.items()) if isinstance(urls, Mapping) else [(url, None) for url in urls]
+
+        return self._iter_batch_pipeline(client, items, func, max_workers, process_workers, mp_context)
+
+    def _iter_batch_pipeline(
+        self,
+        client: httpx.Client,
+        items: list[tuple[str, Optional[Path]]],
+        func: Callable[[Any], Any],
+        max_workers: int,
+        process_workers: Optional[int],
+        mp_context: Optional[multiprocessing.context.BaseContext],
+    ) -> Iterator[tuple[str, Any]]:
+        done: queue.SimpleQueue[tuple[str, concurrent.futures.Future[Any]]] = queue.SimpleQueue()
+
+        threads = ThreadPoolExecutor(max_workers)
+        processes = ProcessPoolExecutor(process_workers, mp_context=mp_context)
+
+        def on_fetched(url: str, fetched: concurrent.futures.Future[Any]):
+            if fetched.cancelled() or fetched.exception() is not None:
+                done.put((url, fetched))
+                return
+            try:
+                parsed = processes.submit(func, fetched.result())
+            except RuntimeError:  # pragma: no cover - pool was shut down, the caller has stopped iterating
+                return
+            parsed.add_done_callback(lambda f: done.put((url, f)))
+
+        try:
+            for url, path in items:
+                threads.submit(self._fetch, client, url, path).add_done_callback(functools.partial(on_fetched, url))
+
+            for _ in range(len(items)):
+                url, future = done.get()
+                yield url, future.result()
+        finally:
+            threads.shutdown(wait=True, cancel_futures=True)
+            processes.shutdown(wait=True, cancel_futures=True)
+
     def _get_httpx_transport_params(self, params: dict[str, Any]):
         http2 = params.get("http2", False)
         proxy = self.proxy
@@ -246,21 +520,22 @@ class HttpxThrottleCache:
             return next_transport
         elif self.cache_mode == "FileCache":
             assert self.cache_dir is not None
-            return CachingTransport(cache_dir=self.cache_dir, transport=next_transport, cache_rules=self.cache_rules)
+            return CachingTransport(
+                cache_dir=self._get_roots().roots,
+                transport=next_transport,
+                cache_rules=self.cache_rules,
+                dedup=self.cache_dedup,
+                canonicalizer=self._get_canonicalizer(),
+                layout=self._get_layout(),
+                weights=self.cache_dir_weights,
+                tier=self._get_tier(),
+                durability=self.cache_durability,
+            )
         else:
-            # either Hishel-S3 or Hishel-File
-            assert self.cache_mode == "Hishel-File" or self.cache_mode == "Hishel-S3"
-            controller = get_cache_controller(key_generator=file_key_generator, cache_rules=self.cache_rules)
-
-            if self.cache_mode == "Hishel-S3":
-                assert self.s3_bucket is not None
-                storage = hishel.S3Storage(
-                    client=self.s3_client, bucket_name=self.s3_bucket, serializer=JSONByteSerializer()
-                )
-            else:
-                assert self.cache_mode == "Hishel-File"
-                assert self.cache_dir is not None
-                storage = hishel.FileStorage(base_path=Path(self.cache_dir), serializer=JSONByteSerializer())
+            # Hishel-S3, Hishel-File, Hishel-Segment or Hishel-SQLite
+            assert self.cache_mode in ("Hishel-File", "Hishel-Segment", "Hishel-SQLite", "Hishel-S3")
+            controller = get_cache_controller(key_generator=self._get_key_generator(), cache_rules=self.cache_rules)
+            storage = self._get_storage()
 
             return hishel.CacheTransport(transport=next_transport, storage=storage, controller=controller)
 
@@ -284,24 +559,255 @@ class HttpxThrottleCache:
             return next_transport
         elif self.cache_mode == "FileCache":
             assert self.cache_dir is not None
-            return CachingTransport(cache_dir=self.cache_dir, transport=next_transport, cache_rules=self.cache_rules)  # pyright: ignore[reportArgumentType]
+            return CachingTransport(
+                cache_dir=self._get_roots().roots,
+                transport=next_transport,  # pyright: ignore[reportArgumentType]
+                cache_rules=self.cache_rules,
+                dedup=self.cache_dedup,
+                canonicalizer=self._get_canonicalizer(),
+                layout=self._get_layout(),
+                weights=self.cache_dir_weights,
+                tier=self._get_tier(),
+                durability=self.cache_durability,
+            )
         else:
-            # either Hishel-S3 or Hishel-File
-            assert self.cache_mode == "Hishel-File" or self.cache_mode == "Hishel-S3"
-            controller = get_cache_controller(key_generator=file_key_generator, cache_rules=self.cache_rules)
-
-            if self.cache_mode == "Hishel-S3":
-                assert self.s3_bucket is not None
-                storage = hishel.AsyncS3Storage(
-                    client=self.s3_client, bucket_name=self.s3_bucket, serializer=JSONByteSerializer()
-                )
-            else:
-                assert self.cache_mode == "Hishel-File"
-                assert self.cache_dir is not None
-                storage = hishel.AsyncFileStorage(base_path=Path(self.cache_dir), serializer=JSONByteSerializer())
+            # Hishel-S3, Hishel-File, Hishel-Segment or Hishel-SQLite
+            assert self.cache_mode in ("Hishel-File", "Hishel-Segment", "Hishel-SQLite", "Hishel-S3")
+            controller = get_cache_controller(key_generator=self._get_key_generator(), cache_rules=self.cache_rules)
+            storage = self._get_async_storage()
 
             return hishel.AsyncCacheTransport(transport=next_transport, storage=storage, controller=controller)
 
+    def _get_canonicalizer(self) -> Optional[KeyCanonicalizer]:
+        if not self.canonical_keys:
+            return None
+        return KeyCanonicalizer(ignored_query_params=self.ignored_query_params)
+
+    def _get_key_generator(self) -> Callable[[httpcore.Request, Optional[bytes]], str]:
+        canonicalizer = self._get_canonicalizer()
+        return file_key_generator if canonicalizer is None else canonical_key_generator(canonicalizer)
+
+    def _get_layout(self) -> Optional[ShardedLayout]:
+        if self.cache_layout == "flat":
+            return None
+        elif self.cache_layout == "sharded":
+            return ShardedLayout()
+        else:
+            raise ValueError(f"Unknown cache_layout {self.cache_layout}, expected flat or sharded")
+
+    def _get_roots(self) -> StripedRoots:
+        assert self.cache_dir is not None
+        roots = self.cache_dir if isinstance(self.cache_dir, list) else [self.cache_dir]
+        return StripedRoots(roots, self.cache_dir_weights)
+
+    def _get_tier(self) -> Optional[S3Tier]:
+        if self.cache_mode != "FileCache" or self.s3_bucket is None:
+            return None
+        return S3Tier(bucket_name=self.s3_bucket, client=self.s3_client)
+
+    def _get_blob_store(self) -> Optional[BlobStores]:
+        if not self.cache_dedup:
+            return None
+        return BlobStores(self._get_roots().roots)
+
+    def _get_serializer(self) -> BinaryByteSerializer:
+        return CompressingSerializer() if self.cache_compression else BinaryByteSerializer()
+
+    def _get_storage(self) -> Union[StreamingFileStorage, StreamingS3Storage]:
+        if self.cache_mode == "Hishel-S3":
+            assert self.s3_bucket is not None
+            return StreamingS3Storage(
+                client=self.s3_client, bucket_name=self.s3_bucket, serializer=self._get_serializer()
+            )
+        else:
+            assert self.cache_dir is not None
+            storage_class = {
+                "Hishel-File": StreamingFileStorage,
+                "Hishel-Segment": SegmentFileStorage,
+                "Hishel-SQLite": SQLiteFileStorage,
+            }[self.cache_mode]
+            return storage_class(
+                base_path=self._get_roots().roots[0],
+                serializer=self._get_serializer(),
+                blobs=self._get_blob_store(),
+                layout=self._get_layout(),
+                roots=self._get_roots(),
+            )
+
+    def _get_async_storage(self) -> hishel.AsyncBaseStorage:
+        if self.cache_mode == "Hishel-S3":
+            assert self.s3_bucket is not None
+            return AsyncStreamingS3Storage(
+                client=self.s3_client, bucket_name=self.s3_bucket, serializer=self._get_serializer()
+            )
+        else:
+            assert self.cache_dir is not None
+            storage_class = {
+                "Hishel-File": AsyncStreamingFileStorage,
+                "Hishel-Segment": AsyncSegmentFileStorage,
+                "Hishel-SQLite": AsyncSQLiteFileStorage,
+            }[self.cache_mode]
+            return storage_class(
+                base_path=self._get_roots().roots[0],
+                serializer=self._get_serializer(),
+                blobs=self._get_blob_store(),
+                layout=self._get_layout(),
+                roots=self._get_roots(),
+            )
+
+    def _get_file_cache(self) -> FileCache:
+        if self._file_cache is None:
+            assert self.cache_dir is not None
+            self._file_cache = FileCache(
+                cache_dir=self._get_roots().roots,
+                dedup=self.cache_dedup,
+                canonicalizer=self._get_canonicalizer(),
+                layout=self._get_layout(),
+                weights=self.cache_dir_weights,
+                tier=self._get_tier(),
+                durability=self.cache_durability,
+            )
+        return self._file_cache
+
+    def _lookup(self, url: str, body: bool = True) -> tuple[bool, Optional[Path], Optional[bytes]]:
+        """
+        Looks up url directly against the cache backend, applying cache_rules freshness.
+
+        Returns (fresh, path, content). path is only populated for FileCache, content only for Hishel, and only if
+        body: otherwise only the entry's header is read.
+        """
+        if self.cache_mode == "Disabled" or self.cache_mode is False:
+            return False, None, None
+
+        if self.cache_mode == "FileCache":
+            parsed = httpx.URL(url)
+            query = parsed.query.decode() if parsed.query else ""
+            fresh, path = self._get_file_cache().get_if_fresh(parsed.host, parsed.path, query, self.cache_rules)
+            return fresh, path if fresh else None, None
+
+        if self._lookup_storage is None:
+            self._lookup_storage = self._get_storage()
+
+        if self._lookup_controller is None or self._lookup_controller[0] is not self.cache_rules:
+            controller = get_cache_controller(key_generator=self._get_key_generator(), cache_rules=self.cache_rules)
+            self._lookup_controller = (self.cache_rules, controller)
+
+        controller = self._lookup_controller[1]
+        request = request_for_url(url)
+        key = controller._key_generator(request, b"")  # pyright: ignore[reportPrivateUsage]
+        stored = self._lookup_storage.retrieve(key) if body else self._lookup_storage.retrieve_header(key)
+        if stored is None:
+            return False, None, None
+
+        stored_response, stored_request, _ = stored
+        res = controller.construct_response_from_cache(
+            request=request, response=stored_response, original_request=stored_request
+        )
+        # A negatively cached error page isn't a cached copy of url
+        if isinstance(res, httpcore.Response) and res.status == 200:
+            return True, None, res.read() if body else None
+
+        return False, None, None
+
+    def contains(self, url: str) -> bool:
+        """
+        Returns True if a fresh copy of url is in the cache.
+
+        Checks the cache backend directly: no HTTPX client, transport, network or rate limiter is involved.
+        """
+        fresh, _, _ = self._lookup(url, body=False)
+        return fresh
+
+    def get_cached(self, url: str) -> Optional[bytes]:
+        """
+        Returns the cached body of url if a fresh copy is in the cache, otherwise None.
+
+        The body is returned as stored: for FileCache, this is the raw (possibly content-encoded) bytes.
+        """
+        fresh, path, content = self._lookup(url)
+        if not fresh:
+            return None
+        elif path is not None:
+            return path.read_bytes()
+        else:
+            return content
+
+    def get_cached_path(self, url: str) -> Optional[Path]:
+        """
+        Returns the Path of the cached file for url if a fresh copy is in the cache, otherwise None.
+
+        Only supported for cache_mode="FileCache", since Hishel entries aren't stored as plain files.
+        """
+        if self.cache_mode != "FileCache":
+            raise ValueError(f"get_cached_path requires cache_mode='FileCache', not {self.cache_mode}")
+
+        _, path, _ = self._lookup(url)
+        return path
+
+    def plan(self, urls: Iterable[str]) -> CachePlan:
+        """
+        Classifies urls as fresh, stale, missing or uncacheable, without making any requests.
+
+        Each cache directory is scanned once, so this is suitable for very large sets of URLs, though with the
+        sharded layout that's about one scan per URL. Supported for FileCache and Hishel-File.
+
+        Returns:
+            CachePlan: counts, bytes, the urls that need to be fetched and the estimated time to fetch them
+        """
+        return plan(
+            urls=urls,
+            cache_mode=self.cache_mode,
+            roots=self._get_roots() if self.cache_dir is not None else None,
+            cache_rules=self.cache_rules,
+            request_per_sec_limit=self.request_per_sec_limit if self.rate_limiter_enabled else None,
+            file_cache=self._get_file_cache() if self.cache_mode == "FileCache" else None,
+            key_generator=self._get_key_generator(),
+            layout=self._get_layout(),
+        )
+
+    def migrate_layout(self) -> int:
+        """
+        Moves FileCache or Hishel-File entries stored in the flat layout to the sharded layout. Requires
+        cache_layout="sharded". Entries are read from either layout, so this can run while the cache is in use: an
+        entry caught mid-move is read from where its files are, or refetched.
+
+        Returns:
+            Number of files moved
+        """
+        layout = self._get_layout()
+        if layout is None:
+            raise ValueError("migrate_layout requires cache_layout='sharded'")
+        return sum(
+            migrate(cache_dir=root, cache_mode=str(self.cache_mode), layout=layout) for root in self._get_roots().roots
+        )
+
+    def gc_blobs(self) -> tuple[int, int]:
+        """
+        Removes deduplicated bodies that no cache entry refers to any more. Requires cache_dedup=True.
+
+        Returns:
+            (number of bodies removed, bytes freed)
+        """
+        blobs = self._get_blob_store()
+        if blobs is None:
+            raise ValueError("gc_blobs requires cache_dedup=True")
+        return blobs.gc()
+
+    def compact_segments(self, min_garbage: float = 0.5) -> tuple[int, int]:
+        """
+        Reclaims the space of overwritten and removed Hishel-Segment entries, by rewriting the segments that are at
+        least min_garbage garbage. Requires cache_mode="Hishel-Segment".
+
+        Returns:
+            (number of segments removed, bytes freed)
+
+        Raises:
+            SegmentStoreLockedError: if another process holds the segments
+        """
+        if self.cache_mode != "Hishel-Segment":
+            raise ValueError(f"compact_segments requires cache_mode='Hishel-Segment', not {self.cache_mode}")
+        return SegmentStore.open(self._get_roots().roots[0] / SEGMENT_DIR).compact(min_garbage)
+
     def __enter__(self):
         return self
 
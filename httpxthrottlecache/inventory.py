@@ -0,0 +1,183 @@
+"""
+Bulk cache inventory: classifies large sets of URLs as fresh, stale, missing or uncacheable.
+
+Rather than checking each URL individually, URLs are grouped by their cache directory and each directory is
+scanned once with os.scandir. Entries not found where they're written are looked up where lookups fall back to, in
+further rounds: see FileCache.candidate_paths and storage.entry_paths. Freshness is determined from the directory
+entries' stat results:
+- FileCache: the .meta sidecar's mtime, which is set to the "fetched" time when the entry is written
+- Hishel-File: the entry's mtime, which Hishel preserves across metadata updates
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+import httpx
+
+from .controller import CacheRules, get_rule_for_request
+from .filecache.transport import FileCache
+from .key_generator import file_key_generator, request_for_url
+from .layout import ShardedLayout, StripedRoots
+from .storage import BODY_SUFFIX, entry_paths
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachePlan:
+    """Summary of the cache state for a set of URLs."""
+
+    fresh: int = 0
+    stale: int = 0
+    missing: int = 0
+    uncacheable: int = 0
+
+    fresh_bytes: int = 0
+    stale_bytes: int = 0
+
+    request_per_sec_limit: Optional[int] = None
+
+    to_fetch: list[str] = field(default_factory=lambda: [])
+    """URLs that will require a network request: stale, missing and uncacheable"""
+
+    @property
+    def total(self) -> int:
+        return self.fresh + self.stale + self.missing + self.uncacheable
+
+    @property
+    def estimated_fetch_seconds(self) -> Optional[float]:
+        """Lower bound on the time to fetch to_fetch, given the rate limit. None if not rate limited."""
+        if not self.request_per_sec_limit:
+            return None
+        return len(self.to_fetch) / self.request_per_sec_limit
+
+
+def _is_fresh(cache_period: Union[bool, int], fetched: float, now: float) -> bool:
+    if cache_period is True:
+        return True
+    return now - fetched <= cache_period
+
+
+def _scan(directory: Path) -> dict[str, os.DirEntry[str]]:
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries}
+    except FileNotFoundError:
+        return {}
+
+
+def plan(
+    urls: Iterable[str],
+    cache_mode: Union[str, bool],
+    roots: Optional[StripedRoots],
+    cache_rules: CacheRules,
+    request_per_sec_limit: Optional[int] = None,
+    file_cache: Optional[FileCache] = None,
+    key_generator: Callable[..., str] = file_key_generator,
+    layout: Optional[ShardedLayout] = None,
+) -> CachePlan:
+    """
+    Classifies urls against the cache.
+
+    Args:
+        urls: URLs to classify
+        cache_mode: FileCache, Hishel-File or Disabled
+        roots: Cache directories
+        cache_rules: Rules used to determine cacheability and freshness
+        request_per_sec_limit: Used to estimate fetch time
+        file_cache: FileCache instance, used to map URLs to paths for cache_mode="FileCache"
+        key_generator: Key generator, used to map URLs to keys for cache_mode="Hishel-File"
+        layout: Directory layout of Hishel-File entries. FileCache's layout is applied by file_cache.
+            With the sharded layout, most entries are in a shard directory of their own, so this is about one
+            scandir per URL.
+
+    Returns:
+        CachePlan
+    """
+    result = CachePlan(request_per_sec_limit=request_per_sec_limit)
+    now = time.time()
+
+    if cache_mode == "Disabled" or cache_mode is False:
+        for url in urls:
+            result.uncacheable += 1
+            result.to_fetch.append(url)
+        return result
+
+    if cache_mode not in ("FileCache", "Hishel-File"):
+        raise ValueError(f"Cache planning is only supported for file based caches, not {cache_mode}")
+
+    assert roots is not None
+
+    # Each URL's candidate paths, in lookup order
+    pending: list[tuple[str, list[Path], Union[bool, int, None]]] = []
+    for url in urls:
+        parsed = httpx.URL(url)
+        cache_period = get_rule_for_request(request_host=parsed.host, target=parsed.path, cache_rules=cache_rules)
+
+        if cache_mode == "FileCache":
+            if not cache_period:
+                # FileCache only caches when a rule applies
+                result.uncacheable += 1
+                result.to_fetch.append(url)
+                continue
+            assert file_cache is not None
+            query = parsed.query.decode() if parsed.query else ""
+            candidates = file_cache.candidate_paths(parsed.host, parsed.path, query)
+        else:
+            if cache_period is False or cache_period == 0:
+                result.uncacheable += 1
+                result.to_fetch.append(url)
+                continue
+            key = key_generator(request_for_url(url), b"")
+            candidates = entry_paths(key, roots.ranked(key), layout)
+
+        pending.append((url, candidates, cache_period))
+
+    # Each round looks up the next candidate of the URLs not found yet, grouped by directory, so each directory is
+    # only scanned once per round. Most entries are found at their first candidate, in the first round.
+    while pending:
+        by_dir: dict[Path, list[tuple[str, list[Path], Union[bool, int, None]]]] = defaultdict(list)
+        for url, candidates, cache_period in pending:
+            by_dir[candidates[0].parent].append((url, candidates, cache_period))
+        pending = []
+
+        for directory, items in by_dir.items():
+            entries = _scan(directory)
+            logger.debug("Scanned %s: %s entries for %s urls", directory, len(entries), len(items))
+
+            for url, candidates, cache_period in items:
+                name = candidates[0].name
+                entry = entries.get(name)
+                if entry is None:
+                    if len(candidates) > 1:
+                        pending.append((url, candidates[1:], cache_period))
+                    else:
+                        result.missing += 1
+                        result.to_fetch.append(url)
+                    continue
+
+                size = entry.stat().st_size
+                if cache_mode == "FileCache":
+                    meta = entries.get(name + ".meta")
+                    fetched = meta.stat().st_mtime if meta is not None else None
+                else:
+                    fetched = entry.stat().st_mtime
+                    body = entries.get(name + BODY_SUFFIX)
+                    if body is not None:  # deduplicated body
+                        size += body.stat().st_size
+
+                # cache_period is None: Hishel falls back to the response's caching headers, so it may need revalidation
+                if fetched is not None and cache_period is not None and _is_fresh(cache_period, fetched, now):
+                    result.fresh += 1
+                    result.fresh_bytes += size
+                else:
+                    result.stale += 1
+                    result.stale_bytes += size
+                    result.to_fetch.append(url)
+
+    return result
@@ -1,6 +1,78 @@
-from typing import Optional
+import re
+import string
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Optional
 
 import httpcore
+import httpx
+
+_PERCENT_ESCAPE = re.compile(r"%([0-9A-Fa-f]{2})")
+_UNRESERVED = frozenset(string.ascii_letters + string.digits + "-._~")
+
+
+def _normalize_percent(s: str) -> str:
+    """Decodes percent-escaped unreserved characters, and uppercases the remaining escapes (RFC 3986 6.2.2)"""
+
+    def normalize(m: re.Match[str]) -> str:
+        c = chr(int(m.group(1), 16))
+        return c if c in _UNRESERVED else "%" + m.group(1).upper()
+
+    return _PERCENT_ESCAPE.sub(normalize, s) if "%" in s else s
+
+
+@dataclass
+class KeyCanonicalizer:
+    """
+    Canonicalizes the URL parts that cache keys are built from, so equivalent URLs share a cache entry:
+    - The host is lowercased, and a trailing dot is removed
+    - Percent-encoding is normalized in the path and query
+    - Query parameters are sorted by name. Repeated parameters keep their relative order.
+    - Query parameters matching ignored_query_params for the host are dropped
+
+    An already canonical URL is unchanged, so its key is the same as without canonicalization.
+    """
+
+    ignored_query_params: dict[str, list[str]] = field(default_factory=lambda: {})
+    """Site regular expression to a list of query parameter name regular expressions, for example:
+    {".*": ["utm_.*"], "www.sec.gov": ["_"]}"""
+
+    def __post_init__(self):
+        self._ignored = lru_cache(maxsize=1024)(self._ignored_for_host)
+
+    def _ignored_for_host(self, host: str) -> Optional[re.Pattern[str]]:
+        patterns = [
+            pattern
+            for site_pattern, params in self.ignored_query_params.items()
+            if re.match(site_pattern, host)
+            for pattern in params
+        ]
+        return re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+    def __call__(self, host: str, path: str, query: str) -> tuple[str, str, str]:
+        host = host.lower().rstrip(".")
+        path = _normalize_percent(path)
+        if not query:
+            return host, path, query
+
+        ignored = self._ignored(host)
+        params = []
+        for param in query.split("&"):
+            if not param:
+                continue
+            name, eq, value = param.partition("=")
+            name = _normalize_percent(name)
+            if ignored is not None and ignored.fullmatch(name):
+                continue
+            params.append((name, eq + _normalize_percent(value)))
+
+        params.sort(key=lambda p: p[0])
+        return host, path, "&".join(name + value for name, value in params)
+
+
+def _key(host: str, path: str, query: str) -> str:
+    url_p = path.replace("/", "__") + (f"__{query.replace('&', '__').replace('=', '__')}" if query else "")
+    return f"{host}_{url_p}"
 
 
 def file_key_generator(request: httpcore.Request, body: Optional[bytes]) -> str:
@@ -15,8 +87,25 @@ def file_key_generator(request: httpcore.Request, body: Optional[bytes]) -> str:
     """
     host = request.url.host.decode()
     path_b, _, query_b = request.url.target.partition(b"?")
-    path = path_b.decode()
-    query = query_b.decode()
-    url_p = path.replace("/", "__") + (f"__{query.replace('&', '__').replace('=', '__')}" if query else "")
-    key = f"{host}_{url_p}"
-    return key
+    return _key(host, path_b.decode(), query_b.decode())
+
+
+def canonical_key_generator(
+    canonicalizer: KeyCanonicalizer,
+) -> Callable[[httpcore.Request, Optional[bytes]], str]:
+    """Returns a key generator like file_key_generator, that canonicalizes the URL first"""
+
+    def key_generator(request: httpcore.Request, body: Optional[bytes]) -> str:
+        path_b, _, query_b = request.url.target.partition(b"?")
+        return _key(*canonicalizer(request.url.host.decode(), path_b.decode(), query_b.decode()))
+
+    return key_generator
+
+
+def request_for_url(url: str, method: str = "GET") -> httpcore.Request:
+    """Builds the httpcore.Request that Hishel would build for url, so keys can be generated without a client."""
+    parsed = httpx.URL(url)
+    return httpcore.Request(
+        method=method,
+        url=httpcore.URL(scheme=parsed.raw_scheme, host=parsed.raw_host, port=parsed.port, target=parsed.raw_path),
+    )
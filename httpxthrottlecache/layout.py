@@ -0,0 +1,166 @@
+"""
+Sharded directory layout for FileCache and Hishel-File entries.
+
+By default, every FileCache entry for a site is stored in one flat <cache_dir>/<site>/ directory, and every
+Hishel-File entry in <cache_dir>/. With millions of entries, lookups and scans of a single directory slow down. The
+sharded layout fans entries out by a hash of their name, into <directory>/<h[0:2]>/<h[2:4]>/<name>, and replaces
+overlong names with a truncated name plus the hash, so names stay well within NAME_MAX.
+
+Lookups fall back to the flat layout, so a cache can be switched to the sharded layout and migrated later: see
+migrate.
+
+A cache can also be striped across several root directories, such as one per drive: see StripedRoots.
+"""
+
+import hashlib
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+NAME_MAX = 255
+"""Maximum file name length on common filesystems, in bytes: longer flat layout names can't exist"""
+
+COMPANION_SUFFIXES = (".meta", ".body", ".neg")
+"""Files stored alongside an entry, which must be sharded by the entry's name"""
+
+TRANSIENT_SUFFIXES = (".lock", ".tmp", ".part", ".part.meta")
+"""Files that are left in place by migrate"""
+
+
+class ShardedLayout:
+    def __init__(self, levels: int = 2, width: int = 2, max_name_bytes: int = 200):
+        """
+        Args:
+            levels: Number of directory levels
+            width: Hex digits per directory level: each level has up to 16**width directories
+            max_name_bytes: Names longer than this are truncated and suffixed with their hash. Leaves room for
+                companion and temporary file suffixes within NAME_MAX (255).
+        """
+        self.levels = levels
+        self.width = width
+        self.max_name_bytes = max_name_bytes
+
+    def relative(self, name: str) -> str:
+        """Returns the path of name relative to its unsharded directory"""
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).hexdigest()
+        shards = [digest[i * self.width : (i + 1) * self.width] for i in range(self.levels)]
+
+        name_b = name.encode("utf-8")
+        if len(name_b) > self.max_name_bytes:
+            name = name_b[: self.max_name_bytes - len(digest) - 1].decode("utf-8", errors="ignore") + "-" + digest
+
+        return "/".join([*shards, name])
+
+    def path(self, directory: Path, name: str) -> Path:
+        return directory / self.relative(name)
+
+
+class StripedRoots:
+    """
+    Places entries across several root directories using weighted rendezvous hashing: each entry goes to the root
+    with the highest score for its name. Adding a root only moves the entries that now score highest on it, about
+    weight / total weight of them, and removing a root only moves the entries that were on it.
+    """
+
+    def __init__(self, roots: Sequence[Union[str, Path]], weights: Optional[Sequence[float]] = None):
+        """
+        Args:
+            roots: Root directories
+            weights: Relative capacity of each root. Defaults to equal weights.
+        """
+        if not roots:
+            raise ValueError("At least one root directory is required")
+        if weights is None:
+            weights = [1.0] * len(roots)
+        if len(weights) != len(roots) or any(w <= 0 for w in weights):
+            raise ValueError(f"Expected {len(roots)} positive weights, got {weights}")
+
+        self.roots = [Path(root) for root in roots]
+        self.weights = list(weights)
+        self._seeds = [str(root).encode("utf-8") + b"\0" for root in self.roots]
+
+    def _score(self, i: int, name: bytes) -> float:
+        h = int.from_bytes(hashlib.blake2b(self._seeds[i] + name, digest_size=8).digest(), "big")
+        u = (h + 0.5) / 2**64  # in (0, 1)
+        return -self.weights[i] / math.log(u)
+
+    def ranked(self, name: str) -> list[Path]:
+        """Returns the roots in placement order for name: the first is where name is stored"""
+        if len(self.roots) == 1:
+            return self.roots
+        name_b = name.encode("utf-8")
+        order = sorted(range(len(self.roots)), key=lambda i: self._score(i, name_b), reverse=True)
+        return [self.roots[i] for i in order]
+
+    def root_for(self, name: str) -> Path:
+        if len(self.roots) == 1:
+            return self.roots[0]
+        name_b = name.encode("utf-8")
+        return self.roots[max(range(len(self.roots)), key=lambda i: self._score(i, name_b))]
+
+
+def _split_suffix(name: str) -> tuple[str, str]:
+    for suffix in COMPANION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)], suffix
+    return name, ""
+
+
+def _flat_files(directory: Path) -> Iterator[os.DirEntry[str]]:
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith("."):
+                yield entry
+
+
+def migrate(cache_dir: Union[str, Path], cache_mode: str, layout: ShardedLayout) -> int:
+    """
+    Moves entries stored in the flat layout to the sharded layout. Entries are renamed, so hardlinks (see
+    cache_dedup) and modification times are preserved. Safe to rerun: entries already sharded aren't touched.
+
+    Each entry's companions are moved before the entry itself, so an entry found in the sharded layout is complete.
+    A reader that found the flat entry may find its companions gone: readers treat that as a miss, or look for them
+    in the sharded layout.
+
+    Args:
+        cache_dir: Cache directory
+        cache_mode: FileCache, Hishel-File, Hishel-Segment or Hishel-SQLite (only standalone entries are moved)
+        layout: Target layout
+
+    Returns:
+        Number of files moved
+    """
+    cache_dir = Path(cache_dir)
+    if cache_mode == "FileCache":
+        directories = [Path(e.path) for e in os.scandir(cache_dir) if e.is_dir() and not e.name.startswith(".")]
+    elif cache_mode in ("Hishel-File", "Hishel-Segment", "Hishel-SQLite"):
+        directories = [cache_dir]
+    else:
+        raise ValueError(f"Layout migration is only supported for file based caches, not {cache_mode}")
+
+    moved = 0
+    for directory in directories:
+        entries: dict[str, list[str]] = {}
+        for entry in _flat_files(directory):
+            if not entry.name.endswith(TRANSIENT_SUFFIXES):
+                name, suffix = _split_suffix(entry.name)
+                entries.setdefault(name, []).append(suffix)
+
+        for name, suffixes in entries.items():
+            sharded = layout.path(directory, name)
+            for suffix in sorted(suffixes, key=lambda s: s == ""):  # the entry itself last
+                target = sharded.with_name(sharded.name + suffix)
+                if target.exists():
+                    # Written since the sharded layout was enabled, so newer than the flat entry
+                    os.unlink(directory / (name + suffix))
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(directory / (name + suffix), target)
+                moved += 1
+
+    logger.info("Moved %s files in %s to the sharded layout", moved, cache_dir)
+    return moved
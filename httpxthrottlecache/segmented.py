@@ -0,0 +1,116 @@
+"""
+Segmented downloads of large bodies.
+
+A single download is limited by the throughput of one connection. A segmented download asks for the body's size with
+a HEAD request, then fetches it as several byte ranges in parallel, each on its own connection, and writes each range
+at its offset in a preallocated file. Each range is a separate request, so each pays its own rate limiter token.
+
+Ranges are requested with If-Range, so a body that changes during the download isn't stitched together from two
+versions: the origin sends a 200 instead of a 206, and the download is abandoned for a normal one.
+"""
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from anyio import to_thread
+
+from .filecache.transport import WRITE_BUFFER_SIZE, if_range_validator
+from .segments import pwrite
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECTIONS = 4
+
+
+class _RangeNotServedError(Exception):
+    pass
+
+
+def _preallocate(fd: int, size: int):
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:  # pragma: no cover - not supported by the filesystem
+            pass
+    os.ftruncate(fd, size)  # pragma: no cover
+
+
+async def _fetch_range(client: httpx.AsyncClient, url: str, fd: int, start: int, end: int, validator: str):
+    headers = {"Range": f"bytes={start}-{end}", "If-Range": validator}
+    async with client.stream("GET", url, headers=headers) as r:
+        if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(f"bytes {start}-{end}/"):
+            raise _RangeNotServedError(f"{r.status_code} for bytes {start}-{end}")
+        if r.headers.get("Content-Encoding"):
+            raise _RangeNotServedError(f"bytes {start}-{end} encoded as {r.headers['Content-Encoding']}")
+
+        offset, buffer = start, bytearray()
+        async for chunk in r.aiter_raw():
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await to_thread.run_sync(pwrite, fd, bytes(buffer), offset)
+                offset, buffer = offset + len(buffer), bytearray()
+        if buffer:
+            await to_thread.run_sync(pwrite, fd, bytes(buffer), offset)
+            offset += len(buffer)
+
+    if offset != end + 1:
+        raise _RangeNotServedError(f"{offset - start} bytes for bytes {start}-{end}")
+
+
+async def download_segmented(
+    client: httpx.AsyncClient,
+    url: str,
+    tmp: Path,
+    min_size: int,
+    connections: int = DEFAULT_CONNECTIONS,
+) -> Optional[httpx.Response]:
+    """
+    Downloads url's body to tmp as connections byte ranges in parallel, if it's at least min_size bytes and the origin
+    serves ranges of it.
+
+    Returns:
+        The HEAD response if the body was downloaded, for its headers. None if it wasn't, and should be fetched
+        normally: tmp is removed.
+    """
+    head = await client.head(url)
+    length = head.headers.get("Content-Length", "")
+    validator = if_range_validator(head)
+    if (
+        head.status_code != 200
+        or not length.isdigit()
+        or int(length) < max(min_size, 1)
+        or head.headers.get("Accept-Ranges", "").lower() != "bytes"
+        or head.headers.get("Content-Encoding")
+        or validator is None
+    ):
+        return None
+
+    size = int(length)
+    step = -(-size // connections)
+    ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    logger.info("Downloading %s bytes of %s as %s ranges", size, url, len(ranges))
+
+    fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    tasks = []
+    try:
+        _preallocate(fd, size)
+        tasks = [asyncio.ensure_future(_fetch_range(client, url, fd, start, end, validator)) for start, end in ranges]
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        os.close(fd)
+        tmp.unlink(missing_ok=True)
+        if isinstance(e, _RangeNotServedError):
+            logger.info("Segmented download of %s abandoned: %s", url, e)
+            return None
+        raise
+
+    os.close(fd)
+    return head
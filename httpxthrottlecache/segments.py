@@ -0,0 +1,284 @@
+"""
+Log structured storage for small cache entries.
+
+Small entries are appended to large segment files rather than each being written to its own file, which saves a
+file (and its blocks and inode) per entry. An in-memory index maps each key to the segment, offset and length of its
+latest record, so reading an entry is a single pread from an already open segment.
+
+Each record is a fixed header (key length, value length, stored time and CRC32 of the value), the key, then the
+value. Removals are appended as tombstones. Overwritten and removed records are garbage, which compact() reclaims by
+copying the live records of mostly-garbage segments to the active segment and deleting them.
+
+The index is rebuilt when the store is opened, by scanning the segments' record headers. A torn record at the end of
+a segment, from a crash during a write, is truncated.
+
+The index is only held in memory, so a segment directory must only be written by one process: a store holds an
+exclusive lock on its directory until it's closed, and opening a directory locked by another process raises
+SegmentStoreLockedError. Within a process, SegmentStore.open returns a single store per directory. A forked child
+doesn't inherit its parent's stores, and opening the parent's directory from the child raises.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import ClassVar, NamedTuple, Optional, Union
+
+from filelock import FileLock, Timeout
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+"""Size at which the active segment is sealed and a new one started"""
+
+LOCK_NAME = ".lock"
+"""Lock file in the segment directory, held by the process whose store writes it"""
+
+_RECORD = struct.Struct("<IIdI")  # key length, value length, stored at, crc32 of the value
+_TOMBSTONE = 0xFFFFFFFF
+
+
+class _Location(NamedTuple):
+    segment: int
+    offset: int
+    """Offset of the value"""
+    length: int
+    stored_at: float
+    crc: int
+
+
+def _record_size(key_length: int, value_length: int) -> int:
+    return _RECORD.size + key_length + value_length
+
+
+def pread(fd: int, length: int, offset: int) -> bytes:
+    """Reads length bytes of fd at offset. Also used by segmented downloads."""
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)  # pragma: no cover - Windows
+    return os.read(fd, length)  # pragma: no cover
+
+
+def pwrite(fd: int, data: bytes, offset: int):
+    """Writes all of data to fd at offset, so threads can write to different offsets of one file"""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, view, offset)
+        else:  # pragma: no cover - Windows
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+class SegmentStoreLockedError(RuntimeError):
+    """The segment directory is held by a store in another process"""
+
+
+class SegmentStore:
+    """Append-only key value store over segment files in directory"""
+
+    _stores: ClassVar[dict[Path, "SegmentStore"]] = {}
+    _stores_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, directory: Union[str, Path], max_segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.directory = Path(directory)
+        self.max_segment_size = max_segment_size
+
+        self._lock = threading.Lock()
+        self._index: dict[str, _Location] = {}
+        self._fds: dict[int, int] = {}
+        self._sizes: dict[int, int] = {}
+        self._live: dict[int, int] = {}
+        """Bytes of each segment held by records in the index"""
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._pid = os.getpid()
+        self._dir_lock = FileLock(self.directory / LOCK_NAME, thread_local=False)
+        try:
+            self._dir_lock.acquire(timeout=0)
+        except Timeout as e:
+            raise SegmentStoreLockedError(f"{self.directory} is held by another process") from e
+
+        for path in sorted(self.directory.glob("*" + SEGMENT_SUFFIX)):
+            self._load(int(path.stem), path)
+        self._active = max(self._fds, default=0)
+        if not self._fds:
+            self._roll()
+
+    @classmethod
+    def open(cls, directory: Union[str, Path], max_segment_size: int = DEFAULT_SEGMENT_SIZE) -> "SegmentStore":
+        """Returns the store for directory, shared by every caller in this process"""
+        path = Path(directory).resolve()
+        with cls._stores_lock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path, max_segment_size)
+            return store
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:08d}{SEGMENT_SUFFIX}"
+
+    def _load(self, segment: int, path: Path):
+        file_size = path.stat().st_size
+        offset = 0
+        self._live.setdefault(segment, 0)
+        with open(path, "rb") as f:
+            while True:
+                head = f.read(_RECORD.size)
+                if len(head) < _RECORD.size:
+                    break
+                key_length, value_length, stored_at, crc = _RECORD.unpack(head)
+                key = f.read(key_length)
+                length = 0 if value_length == _TOMBSTONE else value_length
+                value_offset = offset + _RECORD.size + key_length
+                if len(key) < key_length or value_offset + length > file_size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                self._index_record(key.decode("utf-8"), segment, value_offset, value_length, stored_at, crc)
+                offset = value_offset + length
+
+        if offset < file_size:
+            logger.warning("Truncating torn record at %s:%s", path, offset)
+            os.truncate(path, offset)
+        self._fds[segment] = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self._sizes[segment] = offset
+
+    def _index_record(self, key: str, segment: int, offset: int, value_length: int, stored_at: float, crc: int):
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._live[old.segment] -= _record_size(len(key.encode("utf-8")), old.length)
+        if value_length != _TOMBSTONE:
+            self._index[key] = _Location(segment, offset, value_length, stored_at, crc)
+            self._live[segment] += _record_size(len(key.encode("utf-8")), value_length)
+
+    def _roll(self):
+        self._active += 1
+        path = self._segment_path(self._active)
+        self._fds[self._active] = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self._sizes[self._active] = 0
+        self._live[self._active] = 0
+
+    def _append(self, key: str, value: Optional[bytes], stored_at: float):
+        """Appends a record for key to the active segment, or a tombstone if value is None"""
+        key_b = key.encode("utf-8")
+        if value is None:
+            value, value_length, crc = b"", _TOMBSTONE, 0
+        else:
+            value_length, crc = len(value), zlib.crc32(value)
+
+        size = _record_size(len(key_b), len(value))
+        if self._sizes[self._active] and self._sizes[self._active] + size > self.max_segment_size:
+            self._roll()
+
+        offset = self._sizes[self._active]
+        pwrite(self._fds[self._active], _RECORD.pack(len(key_b), value_length, stored_at, crc) + key_b + value, offset)
+        self._sizes[self._active] = offset + size
+        self._index_record(key, self._active, offset + _RECORD.size + len(key_b), value_length, stored_at, crc)
+
+    def put(self, key: str, value: bytes, stored_at: Optional[float] = None):
+        """Appends value for key. stored_at defaults to now."""
+        with self._lock:
+            self._append(key, value, time.time() if stored_at is None else stored_at)
+
+    def get(self, key: str) -> Optional[tuple[bytes, float]]:
+        """Returns (value, stored_at), or None if key isn't stored"""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            value = pread(self._fds[location.segment], location.length, location.offset)
+
+        if zlib.crc32(value) != location.crc:
+            logger.warning("Corrupt record for %s in segment %s", key, location.segment)
+            return None
+        return value, location.stored_at
+
+    def stored_at(self, key: str) -> Optional[float]:
+        location = self._index.get(key)
+        return location.stored_at if location is not None else None
+
+    def remove(self, key: str) -> bool:
+        """Appends a tombstone for key. Returns True if key was stored."""
+        with self._lock:
+            if key not in self._index:
+                return False
+            self._append(key, None, time.time())
+            return True
+
+    def compact(self, min_garbage: float = 0.5) -> tuple[int, int]:
+        """
+        Copies the live records of sealed segments that are at least min_garbage garbage to the active segment, and
+        deletes those segments.
+
+        Returns:
+            (number of segments removed, bytes freed)
+        """
+        removed = freed = 0
+        with self._lock:
+            sealed = sorted(s for s in self._fds if s != self._active)
+            candidates = [s for s in sealed if self._live[s] <= self._sizes[s] * (1 - min_garbage)]
+
+            for segment in candidates:
+                # A tombstone masks records in older segments, so it's kept while any of those remain
+                keep_tombstones = any(s < segment and s not in candidates for s in sealed)
+                size = self._sizes[segment]
+                data = pread(self._fds[segment], size, 0)
+
+                offset = 0
+                while offset < size:
+                    key_length, value_length, stored_at, _ = _RECORD.unpack_from(data, offset)
+                    value_offset = offset + _RECORD.size + key_length
+                    key = data[offset + _RECORD.size : value_offset].decode("utf-8")
+                    if value_length == _TOMBSTONE:
+                        if keep_tombstones and key not in self._index:
+                            self._append(key, None, stored_at)
+                        offset = value_offset
+                        continue
+
+                    location = self._index.get(key)
+                    if location is not None and (location.segment, location.offset) == (segment, value_offset):
+                        self._append(key, data[value_offset : value_offset + value_length], stored_at)
+                    offset = value_offset + value_length
+
+                os.close(self._fds.pop(segment))
+                self._segment_path(segment).unlink()
+                del self._sizes[segment], self._live[segment]
+                removed += 1
+                freed += size
+
+        logger.debug("Compacted %s segments in %s, freeing %s bytes", removed, self.directory, freed)
+        return removed, freed
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+            # A forked child shares the parent's lock, so releasing it there would release it for the parent
+            if self._pid == os.getpid():
+                self._dir_lock.release()
+        with self._stores_lock:
+            if self._stores.get(self.directory) is self:
+                del self._stores[self.directory]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @classmethod
+    def _forget_stores(cls):
+        cls._stores = {}
+        cls._stores_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=SegmentStore._forget_stores)
@@ -1,7 +1,8 @@
 import json
 import logging
-from datetime import datetime
-from typing import Tuple, Union
+import struct
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple, Union
 
 from hishel._serializers import (
     HEADERS_ENCODING,
@@ -11,7 +12,9 @@ from hishel._serializers import (
     Metadata,
     normalized_url,
 )
-from httpcore import Request, Response
+from httpcore import URL, Request, Response
+
+from .compression import DEFAULT_CODEC, choose_codec, decompress_stream, get_codec
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,19 @@ class JSONByteSerializer(BaseSerializer):
     separated by a single null byte. This avoids base64 encoding, significantly reducing size and
     improving performance for large responses.."""
 
+    separator = b"\0"
+
+    def header_length(self, prefix: bytes) -> Optional[int]:
+        """
+        Returns the length of the header, given the start of a serialized entry, or None if the header length
+        can only be found by searching for the separator.
+        """
+        return None
+
+    def separator_for(self, header: bytes) -> bytes:
+        """Returns the separator that follows header"""
+        return self.separator
+
     def dumps(self, response: Response, request: Request, metadata: Metadata) -> Union[str, bytes]:
         """
         Dumps the HTTP response and its HTTP request.
@@ -33,6 +49,24 @@ class JSONByteSerializer(BaseSerializer):
         :return: Serialized response
         :rtype: Union[str, bytes]
         """
+        header, body = self.dumps_parts(response, request, metadata)
+        return header + self.separator + body
+
+    def dumps_parts(self, response: Response, request: Request, metadata: Metadata) -> Tuple[bytes, bytes]:
+        """
+        Dumps the header and the body to be stored, which storages write separately.
+        :return: Serialized header, not including the separator, and body
+        :rtype: Tuple[bytes, bytes]
+        """
+        return self.dumps_header(response, request, metadata), response.content
+
+    def dumps_header(self, response: Response, request: Request, metadata: Metadata) -> bytes:
+        """
+        Dumps everything but the body: storages can then write the header and body separately, without
+        concatenating them in memory.
+        :return: Serialized header, not including the separator
+        :rtype: bytes
+        """
         response_dict = {
             "status": response.status,
             "headers": [
@@ -66,7 +100,7 @@ class JSONByteSerializer(BaseSerializer):
             "metadata": metadata_dict,
         }
 
-        return json.dumps(full_json, separators=(",", ":")).encode("utf-8") + b"\0" + response.content
+        return json.dumps(full_json, separators=(",", ":")).encode("utf-8")
 
     def loads(self, data: Union[str, bytes]) -> Tuple[Response, Request, Metadata]:
         """
@@ -77,8 +111,20 @@ class JSONByteSerializer(BaseSerializer):
         :rtype: Tuple[Response, Request, Metadata]
         """
         data_b: bytes = data.encode("utf-8") if isinstance(data, str) else data
-        full_json, body = data_b.split(b"\0", 1)
-        full_json = json.loads(full_json.decode("utf-8"))
+        header, body = data_b.split(self.separator_for(data_b), 1)
+        return self.loads_parts(header, body)
+
+    def loads_parts(self, header: bytes, body: bytes) -> Tuple[Response, Request, Metadata]:
+        """
+        Loads the HTTP response and its HTTP request from a header, as produced by dumps_header, and the body.
+        :param header: Serialized header
+        :type header: bytes
+        :param body: Response body
+        :type body: bytes
+        :return: HTTP response and its HTTP request
+        :rtype: Tuple[Response, Request, Metadata]
+        """
+        full_json = json.loads(header.decode("utf-8"))
         response_dict = full_json["response"]
         request_dict = full_json["request"]
         metadata_dict = full_json["metadata"]
@@ -123,3 +169,205 @@ class JSONByteSerializer(BaseSerializer):
     @property
     def is_binary(self) -> bool:  # pragma: no cover
         return True
+
+
+MAGIC = b"\x00HTC"
+"""Starts every BinaryByteSerializer entry. JSONByteSerializer entries start with '{', so the formats can't collide."""
+VERSION = 2
+"""Version 2 added the compression codec"""
+
+_PREFIX = struct.Struct("<4sBI")  # magic, version, length of the rest of the header
+_FIXED = struct.Struct("<HdIi")  # status, created_at (epoch seconds), number_of_uses, port (-1 if None)
+_U32 = struct.Struct("<I")
+
+
+def _pack(parts: list[bytes], items: list[bytes]):
+    parts.append(_U32.pack(len(items)))
+    parts.append(struct.pack(f"<{len(items)}I", *map(len, items)))
+    parts.extend(items)
+
+
+def _unpack(header: bytes, pos: int) -> Tuple[list[bytes], int]:
+    (n,) = _U32.unpack_from(header, pos)
+    pos += _U32.size
+    lengths = struct.unpack_from(f"<{n}I", header, pos)
+    pos += _U32.size * n
+    items: list[bytes] = []
+    for length in lengths:
+        items.append(header[pos : pos + length])
+        pos += length
+    return items, pos
+
+
+def _pairs(items: list[bytes]) -> list[Tuple[bytes, bytes]]:
+    return list(zip(items[0::2], items[1::2], strict=True))
+
+
+class BinaryByteSerializer(JSONByteSerializer):
+    """BinaryByteSerializer stores HTTP metadata as a versioned, length-prefixed binary header followed by raw
+    binary body bytes. Header names and values are stored as raw bytes and timestamps as epoch seconds, so loading
+    an entry needs no JSON decoding, date parsing or header transcoding.
+
+    Entries written by JSONByteSerializer are still loaded, so existing caches can be migrated in place."""
+
+    separator = b""
+
+    def header_length(self, prefix: bytes) -> Optional[int]:
+        if prefix[: len(MAGIC)] != MAGIC or len(prefix) < _PREFIX.size:
+            return None
+        _, _, length = _PREFIX.unpack_from(prefix)
+        return _PREFIX.size + length
+
+    def separator_for(self, header: bytes) -> bytes:
+        return self.separator if header[: len(MAGIC)] == MAGIC else JSONByteSerializer.separator
+
+    def dumps_header(self, response: Response, request: Request, metadata: Metadata, codec: str = "") -> bytes:
+        created_at = metadata["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+
+        url = request.url
+        request_extensions = {
+            key: value for key, value in request.extensions.items() if key in KNOWN_REQUEST_EXTENSIONS
+        }
+
+        parts = [
+            _FIXED.pack(
+                response.status,
+                created_at.timestamp(),
+                metadata["number_of_uses"],
+                url.port if url.port is not None else -1,
+            )
+        ]
+        _pack(
+            parts,
+            [
+                metadata["cache_key"].encode("utf-8"),
+                request.method,
+                url.scheme,
+                url.host,
+                url.target,
+                json.dumps(request_extensions, separators=(",", ":")).encode("utf-8") if request_extensions else b"",
+            ],
+        )
+        _pack(parts, [b for header in response.headers for b in header])
+        _pack(
+            parts,
+            [
+                b
+                for key, value in response.extensions.items()
+                if key in KNOWN_RESPONSE_EXTENSIONS
+                for b in (key.encode("ascii"), value if isinstance(value, bytes) else str(value).encode("ascii"))
+            ],
+        )
+        _pack(parts, [b for header in request.headers for b in header])
+        _pack(parts, [codec.encode("ascii")])
+
+        body = b"".join(parts)
+        return _PREFIX.pack(MAGIC, VERSION, len(body)) + body
+
+    def loads(self, data: Union[str, bytes]) -> Tuple[Response, Request, Metadata]:
+        data_b: bytes = data.encode("utf-8") if isinstance(data, str) else data
+        length = self.header_length(data_b)
+        if length is None:
+            return super().loads(data_b)
+
+        return self.loads_parts(data_b[:length], memoryview(data_b)[length:])
+
+    def loads_parts(self, header: bytes, body: Union[bytes, memoryview]) -> Tuple[Response, Request, Metadata]:
+        if header[: len(MAGIC)] != MAGIC:
+            return super().loads_parts(header, bytes(body))
+
+        _, version, _ = _PREFIX.unpack_from(header)
+        if version > VERSION:
+            raise ValueError(f"Unsupported cache entry version {version}, expected <= {VERSION}")
+
+        status, created_at, number_of_uses, port = _FIXED.unpack_from(header, _PREFIX.size)
+        pos = _PREFIX.size + _FIXED.size
+        (cache_key, method, scheme, host, target, request_extensions), pos = _unpack(header, pos)
+        response_headers, pos = _unpack(header, pos)
+        response_extensions, pos = _unpack(header, pos)
+        request_headers, pos = _unpack(header, pos)
+        codec = _unpack(header, pos)[0][0].decode("ascii") if version >= 2 else ""
+
+        content: Union[bytes, Iterable[Union[bytes, memoryview]]]
+        if codec:
+            content = decompress_stream(codec, body)
+        else:
+            # A memoryview isn't bytes, so it's passed as a single chunk stream
+            content = body if isinstance(body, bytes) else [body]
+
+        response = Response(
+            status=status,
+            headers=_pairs(response_headers),
+            content=content,  # pyright: ignore[reportArgumentType]
+            extensions={key.decode("ascii"): value for key, value in _pairs(response_extensions)},
+        )
+
+        request = Request(
+            method=method,
+            url=URL(scheme=scheme, host=host, port=port if port >= 0 else None, target=target),
+            headers=_pairs(request_headers),
+            extensions=json.loads(request_extensions) if request_extensions else {},
+        )
+
+        metadata = Metadata(
+            cache_key=cache_key.decode("utf-8"),
+            created_at=datetime.fromtimestamp(created_at, tz=timezone.utc),
+            number_of_uses=number_of_uses,
+        )
+
+        return response, request, metadata
+
+
+class CompressingSerializer(BinaryByteSerializer):
+    """CompressingSerializer is a BinaryByteSerializer that compresses bodies at rest, choosing the codec by
+    Content-Type. The codec is recorded in the header, and bodies are decompressed as a stream when loaded.
+
+    Bodies that are already compressed (a Content-Encoding, or an archive, image, audio or video media type),
+    small bodies, and bodies that don't compress well are stored uncompressed."""
+
+    def __init__(
+        self,
+        codecs: Optional[dict[str, Optional[str]]] = None,
+        default_codec: Optional[str] = DEFAULT_CODEC,
+        min_size: int = 1024,
+        min_ratio: float = 0.9,
+    ):
+        """
+        :param codecs: Media type prefix to codec name, or None to store uncompressed. For example: {"text/": "lzma"}
+        :param default_codec: Codec for all other media types, or None to only compress the media types in codecs
+        :param min_size: Bodies smaller than this many bytes are stored uncompressed
+        :param min_ratio: Compressed bodies are only kept if they're smaller than min_ratio * the original size
+        """
+        self.codecs = codecs or {}
+        self.default_codec = default_codec
+        self.min_size = min_size
+        self.min_ratio = min_ratio
+
+        for name in [*self.codecs.values(), default_codec]:
+            if name is not None:
+                get_codec(name)
+
+    def dumps_parts(self, response: Response, request: Request, metadata: Metadata) -> Tuple[bytes, bytes]:
+        body = response.content
+        headers = {key.lower(): value for key, value in response.headers}
+        content_type = headers.get(b"content-type")
+        content_encoding = headers.get(b"content-encoding")
+
+        codec = choose_codec(
+            content_type=content_type.decode(HEADERS_ENCODING) if content_type else None,
+            content_encoding=content_encoding.decode(HEADERS_ENCODING) if content_encoding else None,
+            size=len(body),
+            codecs=self.codecs,
+            default=self.default_codec,
+            min_size=self.min_size,
+        )
+
+        if codec is not None:
+            compressed = get_codec(codec).compress(body)
+            if len(compressed) < len(body) * self.min_ratio:
+                return self.dumps_header(response, request, metadata, codec=codec), compressed
+            logger.debug("Storing uncompressed: %s compressed %s to %s bytes", codec, len(body), len(compressed))
+
+        return self.dumps_header(response, request, metadata), body
@@ -0,0 +1,196 @@
+"""
+SQLite storage for small cache entries.
+
+Entries are rows in a single SQLite database in WAL mode, so reading one doesn't open or stat a file, and readers in
+other processes aren't blocked by writers. Each thread uses its own connection, which is closed when the thread
+exits.
+
+Writes are batched: puts and removes are held in memory (and served from there) until batch_size are pending or
+flush_interval has passed since the first of them, then written in a single transaction. Pending writes are also
+flushed at exit and by close(), and are only visible to other processes once flushed.
+
+Within a process, SQLiteStore.open returns a single store per database, so pending writes are shared.
+"""
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import ClassVar, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, stored_at REAL NOT NULL)"
+
+
+class _ThreadConnection:
+    """A thread's connection, held in a threading.local so it's finalized when the thread exits"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+def _close_connection(conn: sqlite3.Connection, connections: set[sqlite3.Connection], lock: threading.Lock):
+    with lock:
+        if conn not in connections:
+            return  # closed by close()
+        connections.discard(conn)
+    conn.close()
+
+
+class SQLiteStore:
+    """Key value store in the SQLite database at path"""
+
+    _stores: ClassVar[dict[Path, "SQLiteStore"]] = {}
+    _stores_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: set[sqlite3.Connection] = set()
+        self._pending: dict[str, Optional[tuple[bytes, float]]] = {}
+        """Writes not yet flushed: None for a remove"""
+        self._last_flush = time.monotonic()
+        self._timer: Optional[threading.Timer] = None
+        """Flushes pending writes flush_interval after the first of them"""
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(_SCHEMA)
+        atexit.register(self.flush)
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "SQLiteStore":
+        """Returns the store for path, shared by every caller in this process"""
+        path = Path(path).resolve()
+        with cls._stores_lock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path)
+            return store
+
+    def _connection(self) -> sqlite3.Connection:
+        held: Optional[_ThreadConnection] = getattr(self._local, "connection", None)
+        if held is None:
+            # Only used by this thread, but closed by close()
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            held = self._local.connection = _ThreadConnection(conn)
+            with self._lock:
+                self._connections.add(conn)
+            # At exit, flush still needs the main thread's connection
+            weakref.finalize(held, _close_connection, conn, self._connections, self._lock).atexit = False
+        return held.conn
+
+    def _pending_write(self, key: str) -> tuple[bool, Optional[tuple[bytes, float]]]:
+        with self._lock:
+            return key in self._pending, self._pending.get(key)
+
+    def _queue(self, key: str, value: Optional[tuple[bytes, float]]):
+        with self._lock:
+            self._pending[key] = value
+            due = len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def _flush_timer(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def put(self, key: str, value: bytes, stored_at: Optional[float] = None):
+        """Queues value for key. stored_at defaults to now."""
+        self._queue(key, (bytes(value), time.time() if stored_at is None else stored_at))
+
+    def get(self, key: str) -> Optional[tuple[bytes, float]]:
+        """Returns (value, stored_at), or None if key isn't stored"""
+        pending, write = self._pending_write(key)
+        if pending:
+            return write
+        row = self._connection().execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def stored_at(self, key: str) -> Optional[float]:
+        pending, write = self._pending_write(key)
+        if pending:
+            return write[1] if write is not None else None
+        row = self._connection().execute("SELECT stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def remove(self, key: str) -> bool:
+        """Queues the removal of key. Returns True if key was stored."""
+        stored = key in self
+        if stored:
+            self._queue(key, None)
+        return stored
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        pending, write = self._pending_write(key)
+        if pending:
+            return write is not None
+        return self._connection().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def flush(self):
+        """Writes pending puts and removes in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending = dict(self._pending)
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+
+            puts = [(key, value[0], value[1]) for key, value in pending.items() if value is not None]
+            removes = [(key,) for key, value in pending.items() if value is None]
+            with self._connection() as conn:
+                conn.executemany("INSERT OR REPLACE INTO entries (key, value, stored_at) VALUES (?, ?, ?)", puts)
+                conn.executemany("DELETE FROM entries WHERE key = ?", removes)
+
+            # Pending writes are served until they're committed, unless they've since been replaced
+            with self._lock:
+                for key, value in pending.items():
+                    if key in self._pending and self._pending[key] is value:
+                        del self._pending[key]
+        logger.debug("Flushed %s writes to %s", len(pending), self.path)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()  # drops the connections' holders, whose finalizers take _lock
+        with self._stores_lock:
+            if self._stores.get(self.path) is self:
+                del self._stores[self.path]
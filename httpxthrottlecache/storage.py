@@ -0,0 +1,915 @@
+"""
+Hishel storages for the Hishel-File and Hishel-S3 cache modes.
+
+Cache hits don't rewrite entries: see UseCounter.
+
+SegmentFileStorage (Hishel-Segment) stores small entries in a SegmentStore, so each is one record in a shared
+segment file rather than a file of its own. SQLiteFileStorage (Hishel-SQLite) stores them as rows in a SQLiteStore.
+Larger entries are stored as Hishel-File entries. A SegmentStore is written by a single process, so in any other
+process sharing the cache directory, SegmentFileStorage stores every entry as a Hishel-File entry.
+
+With a BlobStore, Hishel-File entries hold only the header, and the body is a separate <key>.body file that is a
+hardlink to a body shared by every entry with the same content.
+
+With a ShardedLayout, Hishel-File entries are stored in hash-prefixed subdirectories. Entries not found there are
+read from the flat layout. With StripedRoots, entries are spread across several root directories.
+
+Hishel's storages serialize each entry to a single bytes object: the header and the response body are concatenated
+when stored, and split apart again when loaded. For large bodies, each of those is a full copy of the body.
+
+These storages write the serialized header and the body separately, streaming the body to the file or S3 object
+rather than concatenating it. Entries are read back by reading the header, then reading the remaining body in a
+single read, so the body is never split or copied.
+
+retrieve_header reads only an entry's header, so checking an entry's freshness doesn't read its body.
+
+Entries are a serialized header, the serializer's separator (if any), then the body. The storages default to
+JSONByteSerializer; HttpxThrottleCache uses BinaryByteSerializer, whose length-prefixed header lets the body be read
+without searching for a separator.
+"""
+
+import datetime
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+from typing import Any, BinaryIO, NamedTuple, Optional, Sequence, Union
+
+import hishel
+from anyio import to_thread
+from hishel._serializers import Metadata
+from hishel._sync._storages import RemoveTypes
+from httpcore import Request, Response
+
+from .blobstore import BlobStore, BlobStores
+from .layout import NAME_MAX, ShardedLayout, StripedRoots
+from .segments import SegmentStore, SegmentStoreLockedError
+from .serializer import JSONByteSerializer
+from .sqlitestore import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+BODY_SUFFIX = ".body"
+"""Suffix of the body file of a deduplicated Hishel-File entry, a hardlink into the BlobStore"""
+
+HEADER_LENGTH = "header_length"
+"""S3 object metadata key recording the header length, so the body can be read without searching for the separator"""
+
+SEGMENT_DIR = ".segments"
+"""Directory of the SegmentStore of a Hishel-Segment cache"""
+
+SQLITE_PATH = ".sqlite/cache.db"
+"""Database of the SQLiteStore of a Hishel-SQLite cache. In a subdirectory, so Hishel's ttl doesn't remove it."""
+
+SMALL_ENTRY_SIZE = 16 * 1024
+"""Hishel-Segment and Hishel-SQLite entries up to this size are stored in the SegmentStore or SQLiteStore"""
+
+
+class _NoSmallEntries:
+    """Stands in for a SegmentStore held by another process. Nothing is stored in it, so every entry is a file."""
+
+    def get(self, key: str) -> None:
+        return None
+
+    def stored_at(self, key: str) -> None:
+        return None
+
+    def remove(self, key: str) -> bool:
+        return False
+
+    def __contains__(self, key: object) -> bool:
+        return False
+
+
+SmallEntries = Union[SegmentStore, SQLiteStore, _NoSmallEntries]
+
+_BLOCK_SIZE = 64 * 1024
+
+StoredResponse = tuple[Response, Request, Metadata]
+
+
+class _ConcatReader(io.RawIOBase):
+    """A readable stream over several buffers, without concatenating them"""
+
+    def __init__(self, *parts: bytes):
+        self._parts = [memoryview(p) for p in parts if p]
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        target = memoryview(b)
+        n = 0
+        while self._parts and n < len(target):
+            part = self._parts[0]
+            k = min(len(part), len(target) - n)
+            target[n : n + k] = part[:k]
+            n += k
+            if k == len(part):
+                self._parts.pop(0)
+            else:
+                self._parts[0] = part[k:]
+        return n
+
+
+def read_entry(
+    f: BinaryIO, serializer: JSONByteSerializer, header_length: Optional[int] = None
+) -> Optional[tuple[bytes, bytes]]:
+    """
+    Reads a (header, body) entry from f. Returns None if f is empty.
+
+    If header_length isn't known, it's taken from the entry's prefix when the serializer writes length-prefixed
+    headers, otherwise the header is read in blocks until the separator is found.
+    """
+    if header_length is not None:
+        header = f.read(header_length)
+        if not header:
+            return None
+        f.read(len(serializer.separator_for(header)))
+        return header, f.read()
+
+    block = f.read(_BLOCK_SIZE)
+    if not block:
+        return None
+
+    header_length = serializer.header_length(block)
+    if header_length is not None:
+        if f.seekable():
+            if len(block) >= header_length:
+                header = block[:header_length]
+            else:
+                header = block + f.read(header_length - len(block))
+            f.seek(header_length)
+            return header, f.read()
+        if len(block) < header_length:
+            block += f.read(header_length - len(block))
+        return block[:header_length], block[header_length:] + f.read()
+
+    separator = serializer.separator_for(block)
+    header, rest = _read_to_separator(f, block, separator)
+    if f.seekable():
+        f.seek(len(header) + len(separator))
+        return header, f.read()
+    else:
+        return header, rest + f.read()
+
+
+def read_header(f: BinaryIO, serializer: JSONByteSerializer) -> Optional[bytes]:
+    """Reads only the header of an entry from f, without reading its body. Returns None if f is empty."""
+    block = f.read(_BLOCK_SIZE)
+    if not block:
+        return None
+
+    header_length = serializer.header_length(block)
+    if header_length is not None:
+        return block[:header_length] if len(block) >= header_length else block + f.read(header_length - len(block))
+    return _read_to_separator(f, block, serializer.separator_for(block))[0]
+
+
+def _read_to_separator(f: BinaryIO, block: bytes, separator: bytes) -> tuple[bytes, bytes]:
+    """Reads f in blocks, starting with block, up to separator. Returns the header and the rest of the last block."""
+    parts: list[bytes] = []
+    while True:
+        idx = block.find(separator)
+        if idx >= 0:
+            parts.append(block[:idx])
+            return b"".join(parts), block[idx + len(separator) :]
+        parts.append(block)
+        block = f.read(_BLOCK_SIZE)
+        if not block:
+            raise ValueError("Corrupt cache entry: header separator not found")
+
+
+def entry_paths(key: str, roots: Sequence[Path], layout: Optional[ShardedLayout]) -> list[Path]:
+    """
+    Paths a Hishel-File entry may be stored at, on roots ranked for key: the first is where it's written. Entries
+    written before the sharded layout was enabled are stored in the flat layout, and entries written before a root was
+    added may be stored on another root.
+    """
+    paths = [root / key if layout is None else layout.path(root, key) for root in roots]
+    if layout is not None and len(key.encode("utf-8")) <= NAME_MAX:
+        paths.extend(root / key for root in roots)
+    return paths
+
+
+def _body_path(path: Path) -> Path:
+    return path.with_name(path.name + BODY_SUFFIX)
+
+
+def _write_file(
+    path: Path,
+    header: bytes,
+    separator: bytes,
+    body: bytes,
+    preserve_times: bool = False,
+    blobs: Optional[BlobStore] = None,
+    make_parents: bool = False,
+):
+    if make_parents:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    stat = path.stat() if preserve_times else None
+    if blobs is not None and body:
+        # The body is stored once, shared by every entry with the same body, and the entry holds only the header
+        blobs.store(body, _body_path(path))
+        body = b""
+    elif not body:
+        _body_path(path).unlink(missing_ok=True)
+
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(separator)
+        f.write(body)
+    if stat is not None:
+        # Restore the old atime and mtime (Hishel uses mtime to check the cache expiration time)
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+
+
+def _read_file(
+    path: Path, serializer: JSONByteSerializer, fallbacks: Sequence[Path] = ()
+) -> Optional[tuple[bytes, bytes]]:
+    candidates = [path, *fallbacks]
+    for i, candidate in enumerate(candidates):
+        try:
+            with open(candidate, "rb") as f:
+                entry = read_entry(f, serializer)
+        except FileNotFoundError:
+            continue
+
+        if entry is not None and not entry[1]:
+            # migrate moves a flat entry's body to the sharded layout ahead of the entry, and those paths come first
+            for body_path in [candidate, *candidates[:i]]:
+                try:
+                    return entry[0], _body_path(body_path).read_bytes()
+                except FileNotFoundError:
+                    pass
+        return entry
+    return None
+
+
+def _read_file_header(path: Path, serializer: JSONByteSerializer, fallbacks: Sequence[Path] = ()) -> Optional[bytes]:
+    for candidate in [path, *fallbacks]:
+        try:
+            with open(candidate, "rb") as f:
+                return read_header(f, serializer)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _remove_files(paths: Sequence[Path]):
+    """Removes an entry and its body from every path it may be stored at (Hishel's remove only handles flat entries)"""
+    for path in paths:
+        path.unlink(missing_ok=True)
+        _body_path(path).unlink(missing_ok=True)
+
+
+def _new_metadata(key: str) -> Metadata:
+    return Metadata(cache_key=key, created_at=datetime.datetime.now(datetime.timezone.utc), number_of_uses=0)
+
+
+class _Uses(NamedTuple):
+    headers: int
+    """Hash of the response headers when the entry was retrieved"""
+    stored: int
+    """number_of_uses of the stored entry"""
+    uses: int
+
+
+class UseCounter:
+    """
+    Tracks number_of_uses in memory.
+
+    Hishel calls update_metadata on every cache hit to increment number_of_uses, which would rewrite the whole
+    entry, body included. When the stored response is unchanged since it was retrieved, the new count is kept here
+    instead, and is persisted the next time the entry is written. Entries are still rewritten when the response
+    changes, such as when its headers are updated by a 304 revalidation, and once every flush_every uses, so at most
+    flush_every - 1 uses of an entry are lost at exit. Only the max_entries most recently used entries are tracked.
+    """
+
+    def __init__(self, max_entries: int = 10_000, flush_every: int = 100):
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Uses] = OrderedDict()
+
+    def _track(self, key: str, uses: _Uses):
+        with self._lock:
+            self._entries[key] = uses
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def retrieved(self, key: str, stored: StoredResponse) -> StoredResponse:
+        response, _, metadata = stored
+        tracked = self._entries.get(key)
+        uses = stored_uses = metadata["number_of_uses"]
+        if tracked is not None and tracked.uses > stored_uses:
+            uses = metadata["number_of_uses"] = tracked.uses
+        self._track(key, _Uses(hash(tuple(response.headers)), stored_uses, uses))
+        return stored
+
+    def updated(self, key: str, response: Response, metadata: Metadata) -> bool:
+        """Returns True if only the metadata changed, so the entry doesn't need to be rewritten"""
+        tracked = self._entries.get(key)
+        if tracked is None or tracked.headers != hash(tuple(response.headers)):
+            return False
+        if metadata["number_of_uses"] - tracked.stored >= self.flush_every:
+            return False  # rewritten to persist the count
+        self._track(key, tracked._replace(uses=metadata["number_of_uses"]))
+        return True
+
+    def stored(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class StreamingFileStorage(hishel.FileStorage):
+    _serializer: JSONByteSerializer
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+    ) -> None:
+        super().__init__(
+            serializer=serializer or JSONByteSerializer(),
+            base_path=Path(base_path) if base_path is not None else None,
+            ttl=ttl,
+            check_ttl_every=check_ttl_every,
+        )
+        self._uses = UseCounter()
+        self._blobs = blobs
+        self._layout = layout
+        self._roots = roots
+
+    def _path(self, key: str, root: Optional[Path] = None) -> Path:
+        if root is None:
+            root = self._base_path if self._roots is None else self._roots.root_for(key)
+        return root / key if self._layout is None else self._layout.path(root, key)
+
+    def _fallback_paths(self, key: str) -> list[Path]:
+        roots = [self._base_path] if self._roots is None else self._roots.ranked(key)
+        return entry_paths(key, roots, self._layout)[1:]
+
+    def _blobs_for(self, key: str) -> Optional[BlobStore]:
+        return self._blobs.for_path(self._path(key)) if self._blobs is not None else None
+
+    def _write(self, key: str, response: Response, request: Request, metadata: Metadata, preserve_times: bool):
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        _write_file(
+            self._path(key),
+            header,
+            self._serializer.separator,
+            body,
+            preserve_times,
+            self._blobs_for(key),
+            make_parents=self._layout is not None,
+        )
+
+    def remove(self, key: RemoveTypes) -> None:
+        if isinstance(key, Response):  # pragma: no cover
+            key = key.extensions["cache_metadata"]["cache_key"]
+        super().remove(key)
+        _remove_files([self._path(key), *self._fallback_paths(key)])
+
+    def store(self, key: str, response: Response, request: Request, metadata: Optional[Metadata] = None) -> None:
+        with self._lock:
+            self._write(key, response, request, metadata or _new_metadata(key), preserve_times=False)
+            self._uses.stored(key)
+        self._remove_expired_caches(self._path(key))
+
+    def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        with self._lock:
+            if self._path(key).exists():
+                self._write(key, response, request, metadata, preserve_times=True)
+                self._uses.stored(key)
+                return
+
+        return self.store(key, response, request, metadata)  # pragma: no cover
+
+    def retrieve(self, key: str) -> Optional[StoredResponse]:
+        response_path = self._path(key)
+
+        self._remove_expired_caches(response_path)
+        with self._lock:
+            entry = _read_file(response_path, self._serializer, self._fallback_paths(key))
+
+        if entry is None:
+            return None
+        return self._uses.retrieved(key, self._serializer.loads_parts(*entry))
+
+    def retrieve_header(self, key: str) -> Optional[StoredResponse]:
+        """Like retrieve, but the response has an empty body: the body isn't read, so checking freshness is cheap"""
+        response_path = self._path(key)
+
+        self._remove_expired_caches(response_path)
+        with self._lock:
+            header = _read_file_header(response_path, self._serializer, self._fallback_paths(key))
+
+        if header is None:
+            return None
+        return self._serializer.loads_parts(header, b"")
+
+
+class AsyncStreamingFileStorage(hishel.AsyncFileStorage):
+    _serializer: JSONByteSerializer
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+    ) -> None:
+        super().__init__(
+            serializer=serializer or JSONByteSerializer(),
+            base_path=Path(base_path) if base_path is not None else None,
+            ttl=ttl,
+            check_ttl_every=check_ttl_every,
+        )
+        self._uses = UseCounter()
+        self._blobs = blobs
+        self._layout = layout
+        self._roots = roots
+
+    def _path(self, key: str, root: Optional[Path] = None) -> Path:
+        if root is None:
+            root = self._base_path if self._roots is None else self._roots.root_for(key)
+        return root / key if self._layout is None else self._layout.path(root, key)
+
+    def _fallback_paths(self, key: str) -> list[Path]:
+        roots = [self._base_path] if self._roots is None else self._roots.ranked(key)
+        return entry_paths(key, roots, self._layout)[1:]
+
+    def _blobs_for(self, key: str) -> Optional[BlobStore]:
+        return self._blobs.for_path(self._path(key)) if self._blobs is not None else None
+
+    async def _write(self, key: str, response: Response, request: Request, metadata: Metadata, preserve_times: bool):
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        await to_thread.run_sync(
+            partial(
+                _write_file,
+                self._path(key),
+                header,
+                self._serializer.separator,
+                body,
+                preserve_times,
+                self._blobs_for(key),
+                make_parents=self._layout is not None,
+            )
+        )
+
+    async def remove(self, key: RemoveTypes) -> None:
+        if isinstance(key, Response):  # pragma: no cover
+            key = key.extensions["cache_metadata"]["cache_key"]
+        await super().remove(key)
+        await to_thread.run_sync(_remove_files, [self._path(key), *self._fallback_paths(key)])
+
+    async def store(self, key: str, response: Response, request: Request, metadata: Optional[Metadata] = None) -> None:
+        async with self._lock:
+            await self._write(key, response, request, metadata or _new_metadata(key), preserve_times=False)
+            self._uses.stored(key)
+        await self._remove_expired_caches(self._path(key))
+
+    async def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        async with self._lock:
+            if self._path(key).exists():
+                await self._write(key, response, request, metadata, preserve_times=True)
+                self._uses.stored(key)
+                return
+
+        return await self.store(key, response, request, metadata)  # pragma: no cover
+
+    async def retrieve(self, key: str) -> Optional[StoredResponse]:
+        response_path = self._path(key)
+
+        await self._remove_expired_caches(response_path)
+        async with self._lock:
+            entry = await to_thread.run_sync(_read_file, response_path, self._serializer, self._fallback_paths(key))
+
+        if entry is None:
+            return None
+        return self._uses.retrieved(key, self._serializer.loads_parts(*entry))
+
+
+def _stored_at(small: SmallEntries, key: str, path: Path) -> Optional[float]:
+    stored_at = small.stored_at(key)
+    if stored_at is None:
+        try:
+            stored_at = path.stat().st_mtime
+        except FileNotFoundError:
+            pass
+    return stored_at
+
+
+def _open_segments(base_path: Path) -> Union[SegmentStore, _NoSmallEntries]:
+    """Returns the SegmentStore of base_path, or _NoSmallEntries if another process holds it"""
+    try:
+        return SegmentStore.open(base_path / SEGMENT_DIR)
+    except SegmentStoreLockedError:
+        logger.warning("%s is held by another process, storing entries as Hishel-File", base_path / SEGMENT_DIR)
+        return _NoSmallEntries()
+
+
+def _write_small_entry(
+    small: SmallEntries,
+    key: str,
+    path: Path,
+    parts: tuple[bytes, bytes, bytes],
+    max_small_size: int,
+    preserve_times: bool,
+    blobs: Optional[BlobStore],
+    make_parents: bool,
+):
+    """Writes a small entry to small, and a larger entry to path, removing any copy stored in the other"""
+    stored_at = _stored_at(small, key, path) if preserve_times else None
+    if not isinstance(small, _NoSmallEntries) and sum(len(p) for p in parts) <= max_small_size:
+        small.put(key, b"".join(parts), stored_at)
+        _remove_files([path])
+        return
+
+    _write_file(path, *parts, blobs=blobs, make_parents=make_parents)
+    small.remove(key)
+    if stored_at is not None:
+        # Hishel uses mtime to check the cache expiration time
+        os.utime(path, (stored_at, stored_at))
+
+
+class SegmentFileStorage(StreamingFileStorage):
+    """
+    Hishel-Segment: entries up to max_small_size are appended to a SegmentStore in base_path, so reading one is a single
+    pread. Larger entries are stored as Hishel-File entries. small_entries replaces the SegmentStore.
+    """
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+        max_small_size: int = SMALL_ENTRY_SIZE,
+        small_entries: Optional[SmallEntries] = None,
+    ) -> None:
+        super().__init__(serializer, base_path, ttl, check_ttl_every, blobs, layout, roots)
+        self._small = small_entries if small_entries is not None else _open_segments(self._base_path)
+        self._max_small_size = max_small_size
+
+    def _write(self, key: str, response: Response, request: Request, metadata: Metadata, preserve_times: bool):
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        _write_small_entry(
+            self._small,
+            key,
+            self._path(key),
+            (header, self._serializer.separator, body),
+            self._max_small_size,
+            preserve_times,
+            self._blobs_for(key),
+            make_parents=self._layout is not None,
+        )
+
+    def remove(self, key: RemoveTypes) -> None:
+        if isinstance(key, Response):  # pragma: no cover
+            key = key.extensions["cache_metadata"]["cache_key"]
+        super().remove(key)
+        self._small.remove(key)
+
+    def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        with self._lock:
+            if key in self._small or self._path(key).exists():
+                self._write(key, response, request, metadata, preserve_times=True)
+                self._uses.stored(key)
+                return
+
+        return self.store(key, response, request, metadata)  # pragma: no cover
+
+    def retrieve(self, key: str) -> Optional[StoredResponse]:
+        stored = self._small.get(key)
+        if stored is None:
+            return super().retrieve(key)
+
+        value, stored_at = stored
+        if self._ttl is not None and time.time() - stored_at > self._ttl:
+            self._small.remove(key)
+            return None
+        return self._uses.retrieved(key, self._serializer.loads(value))
+
+    def retrieve_header(self, key: str) -> Optional[StoredResponse]:
+        # A small entry is a single record, read whole: it's at most max_small_size
+        stored = self._small.get(key)
+        if stored is None:
+            return super().retrieve_header(key)
+
+        value, stored_at = stored
+        if self._ttl is not None and time.time() - stored_at > self._ttl:
+            return None
+        return self._serializer.loads(value)
+
+
+class AsyncSegmentFileStorage(AsyncStreamingFileStorage):
+    """
+    Async Hishel-Segment: see SegmentFileStorage. Small entry reads and removes run in a worker thread too: a SQLite
+    remove may flush a batch of writes, waiting on another process's transaction.
+    """
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+        max_small_size: int = SMALL_ENTRY_SIZE,
+        small_entries: Optional[SmallEntries] = None,
+    ) -> None:
+        super().__init__(serializer, base_path, ttl, check_ttl_every, blobs, layout, roots)
+        self._small = small_entries if small_entries is not None else _open_segments(self._base_path)
+        self._max_small_size = max_small_size
+
+    async def _write(self, key: str, response: Response, request: Request, metadata: Metadata, preserve_times: bool):
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        await to_thread.run_sync(
+            partial(
+                _write_small_entry,
+                self._small,
+                key,
+                self._path(key),
+                (header, self._serializer.separator, body),
+                self._max_small_size,
+                preserve_times,
+                self._blobs_for(key),
+                make_parents=self._layout is not None,
+            )
+        )
+
+    async def remove(self, key: RemoveTypes) -> None:
+        if isinstance(key, Response):  # pragma: no cover
+            key = key.extensions["cache_metadata"]["cache_key"]
+        await super().remove(key)
+        await to_thread.run_sync(self._small.remove, key)
+
+    async def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        async with self._lock:
+            if await to_thread.run_sync(self._small.__contains__, key) or self._path(key).exists():
+                await self._write(key, response, request, metadata, preserve_times=True)
+                self._uses.stored(key)
+                return
+
+        return await self.store(key, response, request, metadata)  # pragma: no cover
+
+    async def retrieve(self, key: str) -> Optional[StoredResponse]:
+        stored = await to_thread.run_sync(self._small.get, key)
+        if stored is None:
+            return await super().retrieve(key)
+
+        value, stored_at = stored
+        if self._ttl is not None and time.time() - stored_at > self._ttl:
+            await to_thread.run_sync(self._small.remove, key)
+            return None
+        return self._uses.retrieved(key, self._serializer.loads(value))
+
+
+class SQLiteFileStorage(SegmentFileStorage):
+    """Hishel-SQLite: entries up to max_small_size are rows in a SQLiteStore in base_path. See SegmentFileStorage."""
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+        max_small_size: int = SMALL_ENTRY_SIZE,
+    ) -> None:
+        base = Path(base_path) if base_path is not None else Path(".cache/hishel")
+        small_entries = SQLiteStore.open(base / SQLITE_PATH)
+        super().__init__(serializer, base, ttl, check_ttl_every, blobs, layout, roots, max_small_size, small_entries)
+
+
+class AsyncSQLiteFileStorage(AsyncSegmentFileStorage):
+    """Async Hishel-SQLite: see SQLiteFileStorage"""
+
+    def __init__(
+        self,
+        serializer: Optional[JSONByteSerializer] = None,
+        base_path: Optional[Union[str, Path]] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        blobs: Optional[BlobStores] = None,
+        layout: Optional[ShardedLayout] = None,
+        roots: Optional[StripedRoots] = None,
+        max_small_size: int = SMALL_ENTRY_SIZE,
+    ) -> None:
+        base = Path(base_path) if base_path is not None else Path(".cache/hishel")
+        small_entries = SQLiteStore.open(base / SQLITE_PATH)
+        super().__init__(serializer, base, ttl, check_ttl_every, blobs, layout, roots, max_small_size, small_entries)
+
+
+class S3Entries:
+    """Reads and writes (header, body) entries as S3 objects, streaming the body with upload_fileobj"""
+
+    def __init__(self, client: Any, bucket_name: str, path_prefix: str, serializer: JSONByteSerializer):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.path_prefix = path_prefix
+        self.serializer = serializer
+
+    def created_at(self, key: str) -> Optional[str]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=self.path_prefix + key)
+            return head["Metadata"]["created_at"]
+        except Exception:  # matches Hishel: a missing object or metadata means a new created_at
+            return None
+
+    def write(self, key: str, header: bytes, body: bytes, created_at: Optional[str] = None):
+        metadata = {"created_at": created_at or str(time.time() * 1000), HEADER_LENGTH: str(len(header))}
+        self.client.upload_fileobj(
+            Fileobj=_ConcatReader(header, self.serializer.separator, body),
+            Bucket=self.bucket_name,
+            Key=self.path_prefix + key,
+            ExtraArgs={"Metadata": metadata},
+        )
+
+    def read(self, key: str) -> Optional[tuple[bytes, bytes]]:
+        response = self.client.get_object(Bucket=self.bucket_name, Key=self.path_prefix + key)
+        header_length = response.get("Metadata", {}).get(HEADER_LENGTH)
+        return read_entry(response["Body"], self.serializer, int(header_length) if header_length is not None else None)
+
+    def read_header(self, key: str) -> Optional[bytes]:
+        """Reads the header with a range request, unless it's longer than the range, when the whole entry is read"""
+        response = self.client.get_object(
+            Bucket=self.bucket_name, Key=self.path_prefix + key, Range=f"bytes=0-{_BLOCK_SIZE - 1}"
+        )
+        block = response["Body"].read()
+        header_length = response.get("Metadata", {}).get(HEADER_LENGTH)
+        header_length = int(header_length) if header_length is not None else self.serializer.header_length(block)
+        if header_length is None:
+            idx = block.find(self.serializer.separator_for(block))
+            header_length = idx if idx >= 0 else None
+        if header_length is not None and header_length <= len(block):
+            return block[:header_length]
+
+        entry = self.read(key)
+        return entry[0] if entry is not None else None
+
+
+class StreamingS3Storage(hishel.S3Storage):
+    _serializer: JSONByteSerializer
+
+    def __init__(
+        self,
+        bucket_name: str,
+        serializer: Optional[JSONByteSerializer] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        client: Optional[Any] = None,
+        path_prefix: str = "hishel-",
+    ) -> None:
+        super().__init__(
+            bucket_name=bucket_name,
+            serializer=serializer or JSONByteSerializer(),
+            ttl=ttl,
+            check_ttl_every=check_ttl_every,
+            client=client,
+            path_prefix=path_prefix,
+        )
+        self._entries = S3Entries(
+            self._s3_manager._client,  # pyright: ignore[reportPrivateUsage]
+            bucket_name,
+            path_prefix,
+            self._serializer,
+        )
+        self._uses = UseCounter()
+
+    def store(self, key: str, response: Response, request: Request, metadata: Optional[Metadata] = None) -> None:
+        header, body = self._serializer.dumps_parts(
+            response=response, request=request, metadata=metadata or _new_metadata(key)
+        )
+        with self._lock:
+            self._entries.write(key, header, body)
+            self._uses.stored(key)
+        self._remove_expired_caches(key)
+
+    def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        with self._lock:
+            self._entries.write(key, header, body, created_at=self._entries.created_at(key))
+            self._uses.stored(key)
+
+    def retrieve(self, key: str) -> Optional[StoredResponse]:
+        self._remove_expired_caches(key)
+        with self._lock:
+            try:
+                entry = self._entries.read(key)
+            except Exception:  # matches Hishel: any failure to read is a cache miss
+                return None
+
+        if entry is None:
+            return None
+        return self._uses.retrieved(key, self._serializer.loads_parts(*entry))
+
+    def retrieve_header(self, key: str) -> Optional[StoredResponse]:
+        """Like retrieve, with an empty body: see S3Entries.read_header"""
+        self._remove_expired_caches(key)
+        with self._lock:
+            try:
+                header = self._entries.read_header(key)
+            except Exception:  # matches Hishel: any failure to read is a cache miss
+                return None
+
+        if header is None:
+            return None
+        return self._serializer.loads_parts(header, b"")
+
+
+class AsyncStreamingS3Storage(hishel.AsyncS3Storage):
+    _serializer: JSONByteSerializer
+
+    def __init__(
+        self,
+        bucket_name: str,
+        serializer: Optional[JSONByteSerializer] = None,
+        ttl: Optional[Union[int, float]] = None,
+        check_ttl_every: Union[int, float] = 60,
+        client: Optional[Any] = None,
+        path_prefix: str = "hishel-",
+    ) -> None:
+        super().__init__(
+            bucket_name=bucket_name,
+            serializer=serializer or JSONByteSerializer(),
+            ttl=ttl,
+            check_ttl_every=check_ttl_every,
+            client=client,
+            path_prefix=path_prefix,
+        )
+        self._entries = S3Entries(
+            self._s3_manager._sync_manager._client,  # pyright: ignore[reportPrivateUsage]
+            bucket_name,
+            path_prefix,
+            self._serializer,
+        )
+        self._uses = UseCounter()
+
+    async def store(self, key: str, response: Response, request: Request, metadata: Optional[Metadata] = None) -> None:
+        header, body = self._serializer.dumps_parts(
+            response=response, request=request, metadata=metadata or _new_metadata(key)
+        )
+        async with self._lock:
+            await to_thread.run_sync(self._entries.write, key, header, body)
+            self._uses.stored(key)
+        await self._remove_expired_caches(key)
+
+    async def update_metadata(self, key: str, response: Response, request: Request, metadata: Metadata) -> None:
+        if self._uses.updated(key, response, metadata):
+            return
+
+        header, body = self._serializer.dumps_parts(response=response, request=request, metadata=metadata)
+        async with self._lock:
+            created_at = await to_thread.run_sync(self._entries.created_at, key)
+            await to_thread.run_sync(self._entries.write, key, header, body, created_at)
+            self._uses.stored(key)
+
+    async def retrieve(self, key: str) -> Optional[StoredResponse]:
+        await self._remove_expired_caches(key)
+        async with self._lock:
+            try:
+                entry = await to_thread.run_sync(self._entries.read, key)
+            except Exception:  # matches Hishel: any failure to read is a cache miss
+                return None
+
+        if entry is None:
+            return None
+        return self._uses.retrieved(key, self._serializer.loads_parts(*entry))
@@ -1,3 +1,5 @@
+import asyncio
+import email.utils
 import pytest
 import os
 from httpxthrottlecache import HttpxThrottleCache, EDGAR_CACHE_RULES
@@ -5,6 +7,8 @@ import logging
 import httpx
 import httpxthrottlecache
 import hishel
+import time
+from typing import Callable, Optional, Union
 
 logger = logging.getLogger(__name__ )
 logging.basicConfig(
@@ -28,7 +32,75 @@ def manager_nocache():
     return mgr
 
 
-def mock_client(client):
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class Chunks(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    A streamed body. A Response built with content= is already read, so the caches have no raw stream to tee. An
+    exception among the chunks is raised when reached, as a connection dropped mid-body. Each chunk waits delay seconds,
+    to hold a response open while others race it.
+    """
+
+    def __init__(self, *chunks: Union[bytes, Exception], delay: float = 0):
+        self.chunks, self.delay = chunks, delay
+
+    def _next(self, chunk):
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.delay:
+                time.sleep(self.delay)
+            yield self._next(chunk)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield self._next(chunk)
+
+
+Body = Union[bytes, list[Union[bytes, Exception]]]
+
+
+class MockOrigin:
+    """
+    An origin serving body, or body(request), streamed with the Last-Modified and Date headers the caches revalidate
+    with, and recording the requests it receives. Subclasses override respond for other behaviour.
+    """
+
+    def __init__(self, body: Union[Body, Callable[[httpx.Request], Body]] = b"abc", status: int = 200, headers: Optional[dict[str, str]] = None, delay: float = 0):
+        self.body, self.status, self.delay = body, status, delay
+        self.headers = {"Last-Modified": LAST_MODIFIED, **(headers or {})}
+        self.requests: list[httpx.Request] = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.requests)
+
+    def __call__(self, req: httpx.Request) -> httpx.Response:
+        self.requests.append(req)
+        return self.respond(req)
+
+    def respond(self, req: httpx.Request) -> httpx.Response:
+        return self.response(req, self.body(req) if callable(self.body) else self.body, self.status)
+
+    def response(self, req: httpx.Request, body: Body, status: int = 200, headers: Optional[dict[str, str]] = None) -> httpx.Response:
+        headers = {"Date": email.utils.formatdate(usegmt=True), **self.headers, **(headers or {})}
+        chunks = body if isinstance(body, list) else [body]
+        return httpx.Response(status, headers=headers, stream=Chunks(*chunks, delay=self.delay), request=req)
+
+
+@pytest.fixture
+def origin():
+    return MockOrigin()
+
+
+def mock_client(client, handler=None):
+    """Replaces the network below client's cache and rate limiter with handler, by default one serving ok"""
 
     class _MockAsyncStream(httpx.AsyncByteStream):
         async def __aiter__(self): yield b"ok"
@@ -37,7 +109,7 @@ def mock_client(client):
     async def _handler(req): 
         return httpx.Response(200, headers={"date":"Mon, 01 Jan 2024 00:00:00 GMT"}, request=req, stream=_MockAsyncStream())
 
-    next_transport = httpx.MockTransport(_handler)
+    next_transport = httpx.MockTransport(handler or _handler)
 
     if isinstance(client._transport, httpxthrottlecache.filecache.transport.CachingTransport):
         client._transport.transport = next_transport
@@ -1,4 +1,11 @@
-from conftest import mock_client
+import os
+
+from conftest import Chunks, MockOrigin, mock_client
+import httpx
+import pytest
+
+from httpxthrottlecache import SpilledBody
+from httpxthrottlecache.batch import MemoryBudget, read_bounded
 
 def test_batch(manager_cache):
     url = "https://example.com/file.bin"
@@ -17,4 +24,68 @@ def test_batch_downloads(manager_cache, tmp_path):
 
     for path, expected in zip(results, url_to_path.values()):
         assert path == expected
-        assert path.exists() and path.stat().st_size > 0
\ No newline at end of file
+        assert path.exists() and path.stat().st_size > 0
+
+def test_batch_max_in_memory(manager_cache, tmp_path):
+    manager_cache.cache_rules = {"example.com": {"/file.bin": 5}}
+    urls = [f"https://example.com/file.bin?i={i}" for i in range(10)]
+
+    results = manager_cache.get_batch(urls=urls, max_in_memory=6, spill_dir=tmp_path, _client_mocker=mock_client)
+
+    in_memory = [r for r in results if isinstance(r, bytearray)]
+    spilled = [r for r in results if isinstance(r, SpilledBody)]
+    assert len(in_memory) == 3 and len(spilled) == 7
+    assert all(r == b"ok" for r in in_memory)
+    assert all(r.read() == b"ok" and len(r) == 2 for r in spilled)
+
+    path = spilled[0].path
+    assert path.parent == tmp_path and path.exists()
+    spilled[0].close()
+    assert not path.exists()
+
+
+@pytest.mark.asyncio
+async def test_read_bounded_content_length(tmp_path):
+    budget = MemoryBudget(10)
+    r = httpx.Response(200, headers={"Content-Length": "6"}, stream=Chunks(b"abc", b"def"), request=httpx.Request("GET", "https://example.com/file.bin"))
+    assert await read_bounded(r, budget) == b"abcdef"
+    assert budget.held == 6
+
+    # Known to be too large: spilled without buffering
+    r = httpx.Response(200, headers={"Content-Length": "6"}, stream=Chunks(b"abc", b"def"), request=httpx.Request("GET", "https://example.com/file.bin"))
+    spilled = await read_bounded(r, budget, tmp_path)
+    assert isinstance(spilled, SpilledBody) and spilled.read() == b"abcdef"
+    assert budget.held == 6
+
+
+def _mock_sync_client(client):
+    mock_client(client, MockOrigin(b"ok"))
+
+
+def test_batch_threaded(manager_cache, tmp_path):
+    manager_cache.cache_rules = {"example.com": {"/file.bin": 5}}
+    urls = [f"https://example.com/file.bin?i={i}" for i in range(10)]
+
+    results = manager_cache.get_batch_threaded(urls=urls, max_workers=4, _client_mocker=_mock_sync_client)
+    assert results == [b"ok"] * 10
+
+    # Uses the shared client
+    with manager_cache.http_client() as client:
+        assert client is manager_cache._client
+
+    url_to_path = {url: tmp_path / f"file_{i}.bin" for i, url in enumerate(urls)}
+    completed = dict(manager_cache.get_batch_threaded(urls=url_to_path, as_completed=True))
+    assert completed == url_to_path
+    assert all(p.read_bytes() == b"ok" for p in completed.values())
+
+
+def test_batch_pipeline(manager_cache, tmp_path):
+    manager_cache.cache_rules = {"example.com": {"/file.bin": 5}}
+    urls = [f"https://example.com/file.bin?i={i}" for i in range(10)]
+
+    results = dict(manager_cache.get_batch_pipeline(urls=urls, func=len, process_workers=2, _client_mocker=_mock_sync_client))
+    assert results == {url: 2 for url in urls}
+
+    url_to_path = {url: tmp_path / f"file_{i}.bin" for i, url in enumerate(urls)}
+    results = dict(manager_cache.get_batch_pipeline(urls=url_to_path, func=os.path.getsize, process_workers=2))
+    assert results == {url: 2 for url in urls}
@@ -0,0 +1,77 @@
+import pytest
+from conftest import mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.key_generator import (
+    KeyCanonicalizer,
+    canonical_key_generator,
+    file_key_generator,
+    request_for_url,
+)
+
+
+@pytest.mark.parametrize(
+    "parts,expected",
+    [
+        (("Example.COM.", "/a", "b=2&a=1"), ("example.com", "/a", "a=1&b=2")),
+        (("example.com", "/a", "b=2&a=1&b=1"), ("example.com", "/a", "a=1&b=2&b=1")),
+        (("example.com", "/%7euser/%2f", "q=%2a&q2=%7E"), ("example.com", "/~user/%2F", "q=%2A&q2=~")),
+        (("example.com", "/a", "utm_source=x&a=1&&utm_medium=y"), ("example.com", "/a", "a=1")),
+        (("example.com", "/a", "flag&a="), ("example.com", "/a", "a=&flag")),
+        (("other.com", "/a", "utm_source=x"), ("other.com", "/a", "utm_source=x")),
+        (("example.com", "/a", ""), ("example.com", "/a", "")),
+    ],
+)
+def test_canonicalizer(parts, expected):
+    canonicalizer = KeyCanonicalizer(ignored_query_params={"example.com": ["utm_.*"]})
+    assert canonicalizer(*parts) == expected
+    assert canonicalizer(*expected) == expected
+
+
+def test_canonical_key_generator():
+    canonicalizer = KeyCanonicalizer(ignored_query_params={".*": ["_"]})
+    key_generator = canonical_key_generator(canonicalizer)
+
+    def key(url):
+        return key_generator(request_for_url(url), b"")
+
+    assert key("https://example.com/a?b=2&a=1") == key("https://example.com/a?a=1&b=2&_=123")
+    assert key("https://example.com/a?b=2&a=1") != key("https://example.com/a?a=2&b=1")
+
+    # Already canonical URLs keep their existing keys
+    url = "https://example.com/a/b?a=1&b=2"
+    assert key(url) == file_key_generator(request_for_url(url), b"")
+
+
+def test_canonical_keys_manager(manager_cache: HttpxThrottleCache, origin):
+    manager_cache.cache_rules = {"example.com": {".*": True}}
+    manager_cache.canonical_keys = True
+    manager_cache.ignored_query_params = {"example.com": ["utm_.*"]}
+
+    urls = ["https://example.com/a?x=1&y=2", "https://example.com/a?y=2&x=1", "https://example.com/a?x=1&utm_id=3&y=2"]
+    with manager_cache.http_client() as client:
+        mock_client(client, origin)
+        assert [client.get(url).read() for url in urls] == [b"abc"] * 3
+
+    assert origin.calls == 1
+    assert all(manager_cache.contains(url) for url in urls)
+    assert manager_cache.plan(urls).fresh == 3
+
+
+def test_canonical_keys_legacy_filecache(tmp_path, origin):
+    url = "https://example.com/a?y=2&x=1"
+    cache_rules = {"example.com": {".*": True}}
+
+    legacy = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules=cache_rules)
+    with legacy.http_client() as client:
+        mock_client(client, origin)
+        client.get(url).read()
+
+    # Written under the raw URL, still found once canonicalization is enabled
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules=cache_rules, canonical_keys=True)
+    assert manager.get_cached(url) == b"abc"
+
+
+def test_ignored_query_params_requires_canonical_keys(tmp_path):
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_dir=tmp_path, ignored_query_params={".*": ["utm_.*"]})
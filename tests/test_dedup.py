@@ -0,0 +1,133 @@
+import os
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.blobstore import BlobStore
+from httpxthrottlecache.storage import BODY_SUFFIX
+
+
+def _body(req):
+    return b"same document" * 1000 if req.url.path.startswith("/same") else req.url.path.encode() * 1000
+
+
+def _get(manager: HttpxThrottleCache, urls: list[str]):
+    with manager.http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        return [client.get(url).read() for url in urls]
+
+
+def _blobs(cache_dir):
+    return [p for p in (cache_dir / ".blobs").rglob("*") if p.is_file()]
+
+
+def test_blob_store(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+
+    digest = blobs.store(b"abc", tmp_path / "a")
+    assert blobs.store(b"abc", tmp_path / "b") == digest
+    assert blobs.store(b"abc", tmp_path / "b") == digest  # already linked
+    blobs.store(b"def", tmp_path / "c")
+
+    assert os.path.samefile(tmp_path / "a", tmp_path / "b")
+    assert (tmp_path / "a").stat().st_nlink == 3
+    assert blobs.gc() == (0, 0)
+
+    (tmp_path / "a").unlink()
+    (tmp_path / "b").unlink()
+    assert blobs.gc() == (1, 3)
+    assert (tmp_path / "c").read_bytes() == b"def"
+
+
+def test_blob_store_publish_during_gc(tmp_path, monkeypatch):
+    blobs = BlobStore(tmp_path / "blobs")
+    digest = blobs.store(b"abc", tmp_path / "a")
+    (tmp_path / "a").unlink()
+
+    link = blobs._link
+
+    def gc_then_link(blob, path):
+        # The unreferenced blob is removed by gc() after publish found it
+        monkeypatch.setattr(blobs, "_link", link)
+        assert blobs.gc() == (1, 3)
+        return link(blob, path)
+
+    monkeypatch.setattr(blobs, "_link", gc_then_link)
+    (tmp_path / "b.tmp").write_bytes(b"abc")
+    blobs.publish(tmp_path / "b.tmp", tmp_path / "b", digest)
+
+    assert (tmp_path / "b").read_bytes() == b"abc" and not (tmp_path / "b.tmp").exists()
+    assert os.path.samefile(tmp_path / "b", blobs.blob_path(digest))
+
+
+def test_dedup_filecache(tmp_path):
+    manager = HttpxThrottleCache(
+        cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_dedup=True
+    )
+    urls = ["https://www.sec.gov/same/1.htm", "https://sec.gov/same/1.htm", "https://sec.gov/other.htm"]
+
+    assert _get(manager, urls)[0] == b"same document" * 1000
+    paths = [manager.get_cached_path(url) for url in urls]
+    assert os.path.samefile(paths[0], paths[1])
+    assert not os.path.samefile(paths[0], paths[2])
+    assert len(_blobs(tmp_path)) == 2
+
+    # Hits are served from the shared body
+    assert _get(manager, urls[:2]) == [b"same document" * 1000] * 2
+
+    paths[0].unlink()
+    assert manager.gc_blobs() == (0, 0)
+    paths[1].unlink()
+    assert manager.gc_blobs() == (1, len(b"same document") * 1000)
+    assert paths[2].read_bytes() == b"/other.htm" * 1000
+
+
+@pytest.mark.asyncio
+async def test_dedup_filecache_async(tmp_path):
+    manager = HttpxThrottleCache(
+        cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_dedup=True
+    )
+
+    async with manager.async_http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        for url in ["https://www.sec.gov/same/1.htm", "https://sec.gov/same/2.htm"]:
+            r = await client.get(url)
+            await r.aread()
+
+    assert os.path.samefile(
+        manager.get_cached_path("https://www.sec.gov/same/1.htm"), manager.get_cached_path("https://sec.gov/same/2.htm")
+    )
+
+
+def test_dedup_hishel(tmp_path):
+    manager = HttpxThrottleCache(
+        cache_mode="Hishel-File", cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_dedup=True
+    )
+    urls = ["https://www.sec.gov/same/1.htm", "https://sec.gov/same/1.htm"]
+
+    _get(manager, urls)
+    bodies = sorted(tmp_path.glob("*" + BODY_SUFFIX))
+    assert len(bodies) == 2 and os.path.samefile(*bodies)
+    assert len(_blobs(tmp_path)) == 1
+
+    # Entries hold only the header
+    entries = [p.with_name(p.name.removesuffix(BODY_SUFFIX)) for p in bodies]
+    assert all(p.stat().st_size < 2000 for p in entries)
+
+    assert [manager.get_cached(url) for url in urls] == [b"same document" * 1000] * 2
+    assert _get(manager, urls) == [b"same document" * 1000] * 2
+
+    storage = manager._get_storage()
+    for p in entries:
+        storage.remove(p.name)
+    assert not list(tmp_path.glob("*" + BODY_SUFFIX))
+    assert manager.gc_blobs() == (1, len(b"same document") * 1000)
+
+
+def test_dedup_config(tmp_path):
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="bucket", cache_dedup=True)
+
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path).gc_blobs()
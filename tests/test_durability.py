@@ -0,0 +1,163 @@
+import json
+import os
+import time
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.durability import Syncer
+
+
+def _origin():
+    return MockOrigin([b"abc"] * 100)
+
+
+def _manager(tmp_path, durability="fsync"):
+    return HttpxThrottleCache(
+        cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_durability=durability
+    )
+
+
+@pytest.mark.parametrize("durability", ["none", "batch", "fsync"])
+def test_truncated_entry_refetched(tmp_path, durability):
+    origin, url = _origin(), "https://example.com/file.htm"
+    mgr = _manager(tmp_path, durability)
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        assert client.get(url).headers["x-cache"] == "MISS"
+
+        entry = tmp_path / "example.com" / "file.htm"
+        entry.write_bytes(entry.read_bytes()[:-10])  # torn by a crash
+        # ... before its .meta was written
+        changed = max(entry.stat().st_mtime_ns, entry.stat().st_ctime_ns) + 10**9
+        os.utime(entry.with_suffix(".htm.meta"), ns=(changed, changed))
+
+        assert client._transport._cache.get_if_fresh("example.com", "/file.htm", "", mgr.cache_rules) == (False, None)
+        assert not entry.exists()
+
+        r = client.get(url)
+        assert r.headers["x-cache"] == "MISS" and r.content == b"abc" * 100
+        assert origin.calls == 2
+        assert client.get(url).headers["x-cache"] == "HIT"
+
+
+def test_entry_read_while_published(tmp_path, monkeypatch):
+    from httpxthrottlecache.filecache import transport
+
+    origin, url = _origin(), "https://example.com/file.htm"
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": 60}})
+    entry, write = tmp_path / "example.com" / "file.htm", transport._write_meta
+    seen = []
+
+    def write_meta(meta_path, meta, syncer=None):
+        # A reader between the body's rename and its .meta's sees the new body with the old .meta
+        seen.append(cache.get_if_fresh("example.com", "/file.htm", "", mgr.cache_rules))
+        seen.append(entry.read_bytes())
+        write(meta_path, meta, syncer)
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        cache = client._transport._cache
+        client.get(url)
+
+        meta = entry.with_suffix(".htm.meta")
+        meta.write_text(json.dumps({**json.loads(meta.read_text()), "fetched": 0}))  # expired
+        origin.body = [b"abcdef"] * 100
+        monkeypatch.setattr(transport, "_write_meta", write_meta)
+        assert client.get(url).content == b"abcdef" * 100
+
+        assert seen == [(False, None), b"abcdef" * 100]
+        assert client.get(url).headers["x-cache"] == "HIT"
+
+
+def test_incomplete_response_not_published(tmp_path):
+    origin, url = _origin(), "https://example.com/file.htm"
+
+    with _manager(tmp_path).http_client() as client:
+        mock_client(client, origin)
+        with client.stream("GET", url) as r:
+            next(r.iter_raw())
+
+    # Kept to be resumed (see test_resume), but not published
+    entries = {p.name for p in (tmp_path / "example.com").iterdir()}
+    assert entries == {"file.htm.lock", "file.htm.part", "file.htm.part.meta"}
+
+
+@pytest.mark.asyncio
+async def test_incomplete_response_not_published_async(tmp_path):
+    origin, url = _origin(), "https://example.com/file.htm"
+
+    async with _manager(tmp_path).async_http_client() as client:
+        mock_client(client, origin)
+        async with client.stream("GET", url) as r:
+            async for _ in r.aiter_raw():
+                break
+
+        r = await client.get(url)
+        assert r.headers["x-cache"] == "MISS" and r.content == b"abc" * 100
+        assert (await client.get(url)).headers["x-cache"] == "HIT"
+
+    assert not list((tmp_path / "example.com").glob("*.tmp"))
+
+
+def test_batch_syncer(tmp_path):
+    syncer = Syncer("batch", interval=60)
+    path = tmp_path / "a"
+    path.write_bytes(b"abc")
+
+    syncer.published(path, tmp_path / "removed")
+    assert syncer._pending == {path, tmp_path / "removed"}
+    syncer.sync()
+    assert not syncer._pending
+
+    # Synced by its timer, without a later write
+    syncer = Syncer("batch", interval=0.1)
+    syncer.published(path)
+    assert syncer._pending == {path}
+    time.sleep(0.5)
+    assert not syncer._pending
+
+    with pytest.raises(ValueError):
+        Syncer("always")  # type: ignore[arg-type]
+
+
+@pytest.mark.asyncio
+async def test_async_writes_coalesced(tmp_path, monkeypatch):
+    from httpxthrottlecache.filecache import transport
+
+    writes = []
+    open_ = transport.aiofiles.open
+
+    def spy(*args, **kwargs):
+        ctx = open_(*args, **kwargs)
+
+        class _Spy:
+            async def __aenter__(self):
+                f = await ctx.__aenter__()
+                write = f.write
+
+                async def counted(b):
+                    writes.append(len(b))
+                    return await write(b)
+
+                f.write = counted
+                return f
+
+            async def __aexit__(self, *exc):
+                return await ctx.__aexit__(*exc)
+
+        return _Spy()
+
+    monkeypatch.setattr(transport.aiofiles, "open", spy)
+    monkeypatch.setattr(transport, "WRITE_BUFFER_SIZE", 100)
+    origin, url = _origin(), "https://example.com/file.htm"
+
+    async with _manager(tmp_path).async_http_client() as client:
+        mock_client(client, origin)
+        assert (await client.get(url)).content == b"abc" * 100
+
+    # 100 network chunks of 3 bytes are written in blocks of at least 100 bytes
+    assert writes == [102, 102, 96]
+    assert (tmp_path / "example.com" / "file.htm").read_bytes() == b"abc" * 100
@@ -0,0 +1,90 @@
+import gzip
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.filecache.transport import ACCEPT_ENCODING, accepts
+
+BODY = b"<html>" + b"filing text " * 1000 + b"</html>"
+
+
+class _Origin(MockOrigin):
+    def __init__(self):
+        super().__init__(BODY, headers={"Content-Type": "text/html"})
+        self.accept_encodings = []
+
+    def respond(self, req):
+        self.accept_encodings.append(req.headers.get("Accept-Encoding"))
+        headers = {}
+        status, body = (404, b"not found") if "missing" in req.url.path else (200, BODY)
+        if "gzip" in req.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = gzip.compress(body)
+        if "Range" in req.headers:
+            start, end = map(int, req.headers["Range"][len("bytes=") :].split("-"))
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            status, body = 206, body[start : end + 1]
+        return self.response(req, body, status, headers)
+
+
+def test_accepts():
+    assert accepts(None, "gzip") and accepts("gzip, deflate", "gzip") and accepts("*", "br")
+    assert accepts("gzip;q=0.5", "gzip") and not accepts("gzip;q=0", "gzip")
+    assert not accepts("identity", "gzip") and not accepts("deflate", "gzip")
+
+
+def test_compressed_at_rest(tmp_path):
+    origin, url = _Origin(), "https://example.com/filing.htm"
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+
+        # Negotiated, even though this caller only accepts identity: it gets the decoded body
+        r = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert origin.accept_encodings == [ACCEPT_ENCODING]
+        assert "content-encoding" not in r.headers and r.content == BODY
+        assert (tmp_path / "example.com" / "filing.htm").read_bytes() == gzip.compress(BODY)
+
+        # A caller that accepts gzip gets the stored bytes as is
+        client._transport.streaming_cutoff = 0
+        with client.stream("GET", url) as r:
+            assert r.headers["x-cache"] == "HIT" and r.headers["content-encoding"] == "gzip"
+            assert b"".join(r.iter_raw()) == gzip.compress(BODY)
+        assert client.get(url).content == BODY
+
+        with client.stream("GET", url, headers={"Accept-Encoding": "identity"}) as r:
+            assert r.headers["x-cache"] == "HIT" and "content-encoding" not in r.headers
+            assert b"".join(r.iter_raw()) == BODY
+
+
+def test_pass_through_encoding(tmp_path):
+    origin = _Origin()
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+
+        # A Range is of the body as the caller accepts it, so its Accept-Encoding is sent as is
+        r = client.get("https://example.com/filing.htm", headers={"Accept-Encoding": "identity", "Range": "bytes=0-5"})
+        assert origin.accept_encodings == ["identity"]
+        assert r.status_code == 206 and r.content == BODY[:6]
+
+        # A response that isn't cached is decoded if the caller doesn't accept its coding
+        with client.stream("GET", "https://example.com/missing.htm", headers={"Accept-Encoding": "identity"}) as r:
+            assert r.status_code == 404 and "content-encoding" not in r.headers
+            assert b"".join(r.iter_raw()) == b"not found"
+
+
+@pytest.mark.asyncio
+async def test_compressed_at_rest_async(tmp_path):
+    origin, url = _Origin(), "https://example.com/filing.htm"
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    async with mgr.async_http_client() as client:
+        mock_client(client, origin)
+        for _ in range(2):
+            r = await client.get(url, headers={"Accept-Encoding": "identity"})
+            assert "content-encoding" not in r.headers and r.content == BODY
+        assert r.headers["x-cache"] == "HIT"
@@ -0,0 +1,143 @@
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.layout import ShardedLayout, StripedRoots
+
+
+def _get(manager: HttpxThrottleCache, url: str) -> bytes:
+    with manager.http_client() as client:
+        mock_client(client, MockOrigin())
+        return client.get(url).read()
+
+
+def _files(tmp_path):
+    return sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob("*") if p.is_file() and p.name != ".gitignore")
+
+
+def test_sharded_layout():
+    layout = ShardedLayout()
+
+    relative = layout.relative("file.htm")
+    assert relative == layout.relative("file.htm")
+    shard1, shard2, name = relative.split("/")
+    assert len(shard1) == len(shard2) == 2 and name == "file.htm"
+
+    long_name = "x" * 1000
+    name = layout.relative(long_name).split("/")[-1]
+    assert len(name) <= 200 and name != layout.relative("x" * 999).split("/")[-1]
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_sharded_manager(tmp_path, cache_mode):
+    manager = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_layout="sharded"
+    )
+    url = "https://example.com/a?" + "&".join(f"param{i}=value{i}" for i in range(100))
+
+    assert _get(manager, url) == b"abc"
+    # Stored two directory levels below the site (FileCache) or cache_dir (Hishel-File), despite the long name
+    depth = 4 if cache_mode == "FileCache" else 3
+    assert {len(f.split("/")) for f in _files(tmp_path)} == {depth}
+
+    assert manager.get_cached(url) == b"abc"
+    assert manager.plan([url]).fresh == 1
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_migrate_layout(tmp_path, cache_mode):
+    urls = ["https://example.com/a", "https://example.com/b?c=d"]
+    cache_rules = {".*": {".*": True}}
+
+    flat = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=cache_rules, cache_dedup=True)
+    for url in urls:
+        _get(flat, url)
+    flat_files = _files(tmp_path)
+
+    sharded = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=cache_rules, cache_layout="sharded", cache_dedup=True
+    )
+    # Flat entries are still found before migrating
+    assert [sharded.get_cached(url) for url in urls] == [b"abc", b"abc"]
+
+    moved = sharded.migrate_layout()
+    assert moved > 0
+    assert _files(tmp_path) != flat_files and len(_files(tmp_path)) == len(flat_files)
+    assert [sharded.get_cached(url) for url in urls] == [b"abc", b"abc"]
+    assert sharded.migrate_layout() == 0
+
+    # Hardlinks survive the move
+    assert sharded.gc_blobs() == (0, 0)
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_migrate_in_use(tmp_path, cache_mode):
+    url, cache_rules = "https://example.com/a", {".*": {".*": True}}
+    flat = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=cache_rules, cache_dedup=True)
+    _get(flat, url)
+
+    # Caught mid-move: the entry's companions are moved first
+    directory = tmp_path / "example.com" if cache_mode == "FileCache" else tmp_path
+    for companion in [*directory.glob("*.meta"), *directory.glob("*.body")]:
+        target = ShardedLayout().path(directory, companion.stem).with_name(companion.name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        companion.rename(target)
+
+    sharded = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=cache_rules, cache_layout="sharded", cache_dedup=True
+    )
+    # Refetched by FileCache, whose .meta is gone, and read with its moved body by Hishel-File
+    assert _get(sharded, url) == b"abc"
+    sharded.migrate_layout()
+    assert sharded.get_cached(url) == b"abc"
+
+
+def test_layout_config(tmp_path):
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="bucket", cache_layout="sharded")
+
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path).migrate_layout()
+
+
+def test_striped_roots(tmp_path):
+    roots = StripedRoots([tmp_path / "a", tmp_path / "b", tmp_path / "c"])
+    names = [f"example.com/file{i}.htm" for i in range(3000)]
+
+    placement = {name: roots.root_for(name) for name in names}
+    assert all(roots.ranked(name)[0] == root for name, root in placement.items())
+    counts = {root: list(placement.values()).count(root) for root in roots.roots}
+    assert all(800 < count < 1200 for count in counts.values())
+
+    # Adding a root only moves entries to the new root
+    added = StripedRoots([*roots.roots, tmp_path / "d"])
+    moved = [name for name in names if added.root_for(name) != placement[name]]
+    assert all(added.root_for(name) == tmp_path / "d" for name in moved)
+    assert 600 < len(moved) < 900
+
+    weighted = StripedRoots([tmp_path / "a", tmp_path / "b"], weights=[3, 1])
+    assert 2000 < sum(weighted.root_for(name) == tmp_path / "a" for name in names) < 2500
+
+    with pytest.raises(ValueError):
+        StripedRoots([tmp_path / "a"], weights=[1, 2])
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_striped_manager(tmp_path, cache_mode):
+    roots = [tmp_path / "a", tmp_path / "b"]
+    manager = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=roots, cache_rules={".*": {".*": True}}, cache_dedup=True
+    )
+    urls = [f"https://example.com/file{i}.htm" for i in range(20)]
+
+    for url in urls:
+        _get(manager, url)
+    assert all(_files(root) for root in roots)
+    assert [manager.get_cached(url) for url in urls] == [b"abc"] * len(urls)
+    assert manager.plan(urls).fresh == len(urls)
+
+    # Entries written before a root was added are still found
+    added = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=[*roots, tmp_path / "c"], cache_rules={".*": {".*": True}}
+    )
+    assert [added.get_cached(url) for url in urls] == [b"abc"] * len(urls)
@@ -0,0 +1,126 @@
+import time
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache, storage
+
+
+def _prime(manager: HttpxThrottleCache, url: str, body: bytes):
+    origin = MockOrigin(body, headers={"Content-Length": str(len(body))})
+    with manager.http_client() as client:
+        mock_client(client, origin)
+        assert client.get(url).read() == body
+
+    return origin.calls
+
+
+def test_get_cached(manager_cache: HttpxThrottleCache):
+    url = "https://example.com/file.bin?a=1"
+    manager_cache.cache_rules = {"example.com": {"/file.bin": True}}
+
+    assert not manager_cache.contains(url)
+    assert manager_cache.get_cached(url) is None
+
+    assert _prime(manager_cache, url, b"abc") == 1
+
+    assert manager_cache.contains(url)
+    assert manager_cache.get_cached(url) == b"abc"
+    assert not manager_cache.contains("https://example.com/file.bin?a=2")
+
+
+@pytest.mark.parametrize("cache_mode", ["Hishel-File", "Hishel-Segment", "Hishel-SQLite"])
+def test_contains_reads_header(tmp_path, monkeypatch, cache_mode):
+    url, body = "https://example.com/file.bin", b"abc" * 10_000
+    manager = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules={"example.com": {".*": True}})
+    _prime(manager, url, body)
+
+    # Only get_cached reads the body
+    with monkeypatch.context() as m:
+        m.setattr(storage.StreamingFileStorage, "retrieve", None)
+        assert manager.contains(url)
+        assert not manager.contains("https://example.com/other.bin")
+    assert manager.get_cached(url) == body
+
+
+def test_get_cached_not_cacheable(manager_cache: HttpxThrottleCache):
+    url = "https://example.com/file.bin"
+    manager_cache.cache_rules = {"example.com": {"/file.bin": False}}
+
+    _prime(manager_cache, url, b"abc")
+
+    assert not manager_cache.contains(url)
+    assert manager_cache.get_cached(url) is None
+
+
+def test_get_cached_path(tmp_path):
+    url = "https://example.com/file.bin"
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={"example.com": {".*": True}})
+
+    assert manager.get_cached_path(url) is None
+    _prime(manager, url, b"abc")
+
+    path = manager.get_cached_path(url)
+    assert path is not None and path.read_bytes() == b"abc"
+
+
+def test_get_cached_path_hishel(tmp_path):
+    manager = HttpxThrottleCache(cache_mode="Hishel-File", cache_dir=tmp_path)
+
+    with pytest.raises(ValueError):
+        manager.get_cached_path("https://example.com/file.bin")
+
+
+def test_get_cached_disabled(manager_nocache: HttpxThrottleCache):
+    assert not manager_nocache.contains("https://example.com/file.bin")
+    assert manager_nocache.get_cached("https://example.com/file.bin") is None
+
+
+def test_plan(manager_cache: HttpxThrottleCache, monkeypatch):
+    manager_cache.cache_rules = {"example.com": {"/fresh": True, "/stale": 10, "/nocache": False}}
+
+    _prime(manager_cache, "https://example.com/fresh/1", b"abc")
+    _prime(manager_cache, "https://example.com/stale/1", b"abcd")
+
+    urls = [
+        "https://example.com/fresh/1",
+        "https://example.com/fresh/2",
+        "https://example.com/stale/1",
+        "https://example.com/nocache/1",
+    ]
+
+    p = manager_cache.plan(urls)
+    assert (p.fresh, p.stale, p.missing, p.uncacheable) == (2, 0, 1, 1)
+    assert p.fresh_bytes > 0
+    assert p.to_fetch == ["https://example.com/nocache/1", "https://example.com/fresh/2"]
+    assert p.estimated_fetch_seconds == 2 / manager_cache.request_per_sec_limit
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+    p = manager_cache.plan(urls)
+    assert (p.fresh, p.stale, p.missing, p.uncacheable) == (1, 1, 1, 1)
+    assert p.total == len(urls)
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_plan_fallback_paths(tmp_path, cache_mode):
+    rules = {"example.com": {".*": True}}
+    urls = [f"https://example.com/file{i}.bin" for i in range(3)]
+    for url in urls[:2]:
+        _prime(HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=rules), url, b"abc")
+
+    # Switched to the sharded layout and another root: the flat entries on the first root are still found
+    manager = HttpxThrottleCache(
+        cache_mode=cache_mode, cache_dir=[tmp_path / "new", tmp_path], cache_rules=rules, cache_layout="sharded"
+    )
+    p = manager.plan(urls)
+    assert (p.fresh, p.stale, p.missing) == (2, 0, 1)
+    assert p.to_fetch == urls[2:]
+    assert all(manager.contains(url) for url in urls[:2])
+
+
+def test_plan_s3():
+    manager = HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="foo")
+
+    with pytest.raises(ValueError):
+        manager.plan(["https://example.com/file.bin"])
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.controller import get_negative_ttl, get_rule_for_request, negative_status_codes
+
+RULES = {
+    "example.com": {
+        "/missing.*": {"ttl": 3600, "status": {404: 300, "410": True}},
+        ".*": 3600,
+    }
+}
+
+
+def test_rules():
+    assert get_rule_for_request("example.com", "/missing/a", RULES) == 3600
+    assert get_rule_for_request("example.com", "/other", RULES) == 3600
+    assert get_negative_ttl("example.com", "/missing/a", RULES, 404) == 300
+    assert get_negative_ttl("example.com", "/missing/a", RULES, 410) is True
+    assert get_negative_ttl("example.com", "/missing/a", RULES, 500) is None
+    assert get_negative_ttl("example.com", "/other", RULES, 404) is None
+    assert negative_status_codes(RULES) == [404, 410]
+
+
+@pytest.mark.parametrize("cache_mode", ["FileCache", "Hishel-File"])
+def test_negative_cache(tmp_path, monkeypatch, cache_mode):
+    origin = MockOrigin(b"Not Found", status=404)
+    mgr = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules=RULES)
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        assert client.get("https://example.com/missing/a").status_code == 404
+        assert client.get("https://example.com/missing/a").status_code == 404
+        assert origin.calls == 1
+
+        # A negative entry isn't a cached copy
+        assert not mgr.contains("https://example.com/missing/a")
+        assert mgr.get_cached("https://example.com/missing/a") is None
+
+        # Not in a negative rule
+        client.get("https://example.com/other")
+        client.get("https://example.com/other")
+        assert origin.calls == 3
+
+        # Expired
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 301)
+        origin.status, origin.body = 200, b"found"
+        r = client.get("https://example.com/missing/a")
+        assert r.status_code == 200 and origin.calls == 4
+
+
+def test_negative_cache_no_body(tmp_path):
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules=RULES)
+
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(b"Not Found", status=410))
+        client.get("https://example.com/missing/b")
+        r = client.get("https://example.com/missing/b")
+        assert r.status_code == 410 and r.headers["x-cache"] == "HIT" and r.content == b""
+
+    assert {p.name for p in (tmp_path / "example.com").iterdir()} == {"missing-b.neg", "missing-b.lock"}
+    assert not mgr.contains("https://example.com/missing/b")
+
+
+@pytest.mark.asyncio
+async def test_negative_cache_async(tmp_path):
+    origin = MockOrigin(b"Not Found", status=404)
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules=RULES)
+
+    async with mgr.async_http_client() as client:
+        mock_client(client, origin)
+        for _ in range(3):
+            assert (await client.get("https://example.com/missing/a")).status_code == 404
+    assert origin.calls == 1
@@ -0,0 +1,69 @@
+import pytest
+from conftest import LAST_MODIFIED, MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.filecache.transport import parse_range
+
+BODY = bytes(range(256)) * 40
+
+
+def _multipart(r):
+    boundary = r.headers["content-type"].split("boundary=")[1]
+    parts = r.content.split(f"--{boundary}".encode())[1:-1]
+    return [part.split(b"\r\n\r\n", 1) for part in parts]
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == [(0, 9)]
+    assert parse_range("bytes=90-", 100) == [(90, 99)]
+    assert parse_range("bytes=-10", 100) == [(90, 99)]
+    assert parse_range("bytes=95-200", 100) == [(95, 99)]
+    assert parse_range("bytes=0-0, 10-19", 100) == [(0, 0), (10, 19)]
+    assert parse_range("bytes=100-", 100) == []
+    assert parse_range("bytes=9-0", 100) is None
+    assert parse_range("items=0-9", 100) is None
+    assert parse_range("bytes=a-b", 100) is None
+
+
+def test_range_hits(tmp_path):
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+    url = "https://example.com/bulk.zip"
+
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(BODY, headers={"Content-Type": "application/zip"}))
+        assert client.get(url).content == BODY
+
+        r = client.get(url, headers={"Range": "bytes=100-199"})
+        assert r.status_code == 206 and r.headers["x-cache"] == "HIT"
+        assert r.content == BODY[100:200] and r.headers["content-range"] == f"bytes 100-199/{len(BODY)}"
+        assert r.headers["content-type"] == "application/zip"
+
+        r = client.get(url, headers={"Range": "bytes=0-9,-22"})
+        assert r.status_code == 206 and r.headers["content-type"].startswith("multipart/byteranges")
+        assert int(r.headers["content-length"]) == len(r.content)
+        (h1, b1), (h2, b2) = _multipart(r)
+        assert b1 == BODY[:10] + b"\r\n" and b2 == BODY[-22:] + b"\r\n"
+        assert b"Content-Range: bytes 0-9/" in h1 and f"bytes {len(BODY) - 22}-".encode() in h2
+
+        r = client.get(url, headers={"Range": f"bytes={len(BODY)}-"})
+        assert r.status_code == 416 and r.headers["content-range"] == f"bytes */{len(BODY)}"
+
+        # A changed If-Range, or an invalid Range, gets the whole body
+        r = client.get(url, headers={"Range": "bytes=0-9", "If-Range": "Tue, 02 Jan 2024 00:00:00 GMT"})
+        assert r.status_code == 200 and r.content == BODY
+        r = client.get(url, headers={"Range": "bytes=0-9", "If-Range": LAST_MODIFIED})
+        assert r.status_code == 206 and r.content == BODY[:10]
+        assert client.get(url, headers={"Range": "lines=1-2"}).content == BODY
+
+
+@pytest.mark.asyncio
+async def test_range_hits_async(tmp_path):
+    mgr = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+    url = "https://example.com/bulk.zip"
+
+    async with mgr.async_http_client() as client:
+        mock_client(client, MockOrigin(BODY, headers={"Content-Type": "application/zip"}))
+        await client.get(url)
+
+        r = await client.get(url, headers={"Range": "bytes=-1000"})
+        assert r.status_code == 206 and r.content == BODY[-1000:]
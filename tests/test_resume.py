@@ -0,0 +1,93 @@
+
+import httpx
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+
+BODY = bytes(range(256)) * 400
+ETAG = '"v1"'
+
+
+class _Origin(MockOrigin):
+    def __init__(self, etag=ETAG, fail_after=None):
+        super().__init__(BODY, headers={"Content-Type": "application/zip"})
+        self.etag, self.fail_after = etag, fail_after
+        self.ranges = []
+
+    def respond(self, req):
+        self.headers["ETag"] = self.etag
+        fail_after, self.fail_after = self.fail_after, None
+        self.ranges.append(req.headers.get("Range"))
+
+        if "Range" in req.headers and req.headers.get("If-Range") == self.etag:
+            start = int(req.headers["Range"][len("bytes=") : -1])
+            headers = {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"}
+            return self.response(req, _chunked(BODY[start:]), 206, headers)
+        return self.response(req, _chunked(BODY, fail_after))
+
+
+def _chunked(body, fail_after=None):
+    """body in 1000 byte chunks, the connection dropping after fail_after bytes"""
+    chunks = [body[i : i + 1000] for i in range(0, len(body), 1000)]
+    if fail_after is not None:
+        chunks[fail_after // 1000 :] = [httpx.ReadError("connection reset")]
+    return chunks
+
+
+def _manager(tmp_path):
+    return HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+
+def test_resume(tmp_path):
+    origin, url = _Origin(fail_after=40_000), "https://example.com/bulk.zip"
+
+    with _manager(tmp_path).http_client() as client:
+        mock_client(client, origin)
+        with pytest.raises(httpx.ReadError):
+            client.get(url)
+        assert (tmp_path / "example.com" / "bulk.zip.part").stat().st_size == 40_000
+
+        r = client.get(url)
+        assert r.status_code == 200 and r.headers["x-cache"] == "MISS"
+        assert r.headers["content-length"] == str(len(BODY)) and "content-range" not in r.headers
+        assert r.content == BODY
+        assert origin.ranges == [None, "bytes=40000-"]
+
+        assert client.get(url).headers["x-cache"] == "HIT"
+
+    assert (tmp_path / "example.com" / "bulk.zip").read_bytes() == BODY
+    assert not list((tmp_path / "example.com").glob("*.part*"))
+
+
+def test_resume_changed(tmp_path):
+    origin, url = _Origin(fail_after=40_000), "https://example.com/bulk.zip"
+
+    with _manager(tmp_path).http_client() as client:
+        mock_client(client, origin)
+        with pytest.raises(httpx.ReadError):
+            client.get(url)
+
+        # If-Range doesn't match, so the whole body is sent
+        origin.etag = '"v2"'
+        r = client.get(url)
+        assert r.status_code == 200 and r.content == BODY
+        assert origin.ranges == [None, "bytes=40000-"]
+
+
+@pytest.mark.asyncio
+async def test_resume_async(tmp_path):
+    origin, url = _Origin(fail_after=40_000), "https://example.com/bulk.zip"
+
+    async with _manager(tmp_path).async_http_client() as client:
+        mock_client(client, origin)
+        with pytest.raises(httpx.ReadError):
+            await client.get(url)
+        assert (tmp_path / "example.com" / "bulk.zip.part").exists()
+
+        r = await client.get(url)
+        assert r.status_code == 200 and r.content == BODY
+        assert origin.ranges == [None, "bytes=40000-"]
+        assert (await client.get(url)).headers["x-cache"] == "HIT"
+
+    assert (tmp_path / "example.com" / "bulk.zip").read_bytes() == BODY
@@ -24,9 +24,13 @@ class s3_mock:
         ...
     def put_object(self, Bucket, Key, Body, Metadata): 
         self.store[(Bucket,Key)]={"Body":Body if isinstance(Body,bytes) else Body.encode(),"Metadata":Metadata}
-    def get_object(self, Bucket, Key): 
+    def get_object(self, Bucket, Key, Range=None): 
         o=self.store[(Bucket,Key)]
-        return {"Body": io.BytesIO(o["Body"]), "Metadata": o["Metadata"]}
+        body = o["Body"]
+        if Range is not None:
+            start, end = map(int, Range[len("bytes="):].split("-"))
+            body = body[start:end + 1]
+        return {"Body": io.BytesIO(body), "Metadata": o["Metadata"]}
     def head_object(self, Bucket, Key): 
         return {"Metadata": self.store[(Bucket,Key)]["Metadata"]}
     def list_objects(self, Bucket): 
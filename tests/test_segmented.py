@@ -0,0 +1,100 @@
+import functools
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+
+BODY = bytes(range(256)) * 1000
+
+
+class _Origin(MockOrigin):
+    def __init__(self, ranges=True):
+        super().__init__(BODY, headers={"ETag": '"v1"', "Content-Type": "application/zip"})
+        if ranges:
+            self.headers["Accept-Ranges"] = "bytes"
+        self.ranges = ranges
+
+    @property
+    def sent(self):
+        return [(req.method, req.headers.get("Range")) for req in self.requests]
+
+    def respond(self, req):
+        if req.method == "HEAD":
+            return self.response(req, b"", headers={"Content-Length": str(len(BODY))})
+
+        if self.ranges and "Range" in req.headers and req.headers.get("If-Range") == '"v1"':
+            start, end = map(int, req.headers["Range"][len("bytes=") :].split("-"))
+            headers = {"Content-Range": f"bytes {start}-{end}/{len(BODY)}"}
+            return self.response(req, _chunked(BODY[start : end + 1]), 206, headers)
+        return self.response(req, _chunked(BODY))
+
+
+def _chunked(body):
+    return [body[i : i + 10_000] for i in range(0, len(body), 10_000)]
+
+
+def _mocker(origin):
+    return functools.partial(mock_client, handler=origin)
+
+
+def _manager(tmp_path, cache_mode="FileCache", **kwargs):
+    return HttpxThrottleCache(
+        cache_mode=cache_mode,
+        cache_dir=tmp_path / "cache",
+        cache_rules={".*": {".*": True}},
+        segmented_download_size=100_000,
+        **kwargs,
+    )
+
+
+def test_segmented_into_filecache(tmp_path):
+    origin, url = _Origin(), "https://example.com/bulk.zip"
+    mgr = _manager(tmp_path, segmented_connections=3)
+
+    assert mgr.get_batch(urls=[url], _client_mocker=_mocker(origin)) == [BODY]
+    assert sorted(r for m, r in origin.sent if m == "GET") == ["bytes=0-85333", "bytes=170668-255999", "bytes=85334-170667"]
+    assert mgr.get_cached(url) == BODY
+
+    # Served from the cache
+    origin.requests.clear()
+    assert mgr.get_batch(urls={url: tmp_path / "out.zip"}, _client_mocker=_mocker(origin)) == [tmp_path / "out.zip"]
+    assert (tmp_path / "out.zip").read_bytes() == BODY and origin.sent == []
+
+
+@pytest.mark.parametrize("ranges", [True, False])
+def test_segmented_to_path(tmp_path, ranges):
+    origin, url = _Origin(ranges), "https://example.com/bulk.zip"
+    mgr = _manager(tmp_path, cache_mode="Disabled")
+
+    assert mgr.get_batch(urls={url: tmp_path / "out.zip"}, _client_mocker=_mocker(origin)) == [tmp_path / "out.zip"]
+    assert (tmp_path / "out.zip").read_bytes() == BODY
+    gets = [r for m, r in origin.sent if m == "GET"]
+    assert len(gets) == (4 if ranges else 1)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_segmented_small(tmp_path):
+    origin, url = _Origin(), "https://example.com/bulk.zip"
+    mgr = _manager(tmp_path, cache_mode="Disabled")
+    mgr.segmented_download_size = len(BODY) + 1
+
+    mgr.get_batch(urls={url: tmp_path / "out.zip"}, _client_mocker=_mocker(origin))
+    assert (tmp_path / "out.zip").read_bytes() == BODY
+    assert origin.sent == [("HEAD", None), ("GET", None)]
+
+
+def test_segmented_uncached(tmp_path):
+    origin, url = _Origin(), "https://example.com/bulk.zip"
+    mgr = _manager(tmp_path)
+    mgr.cache_rules = {"other.com": {".*": True}}
+
+    # Not cached, so not downloaded into the FileCache: to memory, it's a single GET without a HEAD
+    assert mgr.get_batch(urls=[url], _client_mocker=_mocker(origin)) == [BODY]
+    assert origin.sent == [("GET", None)]
+
+    # To a path, it's downloaded as ranges
+    origin.requests.clear()
+    assert mgr.get_batch(urls={url: tmp_path / "out.zip"}, _client_mocker=_mocker(origin)) == [tmp_path / "out.zip"]
+    assert (tmp_path / "out.zip").read_bytes() == BODY
+    assert len([r for m, r in origin.sent if m == "GET"]) == 4
@@ -0,0 +1,227 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+from conftest import MockOrigin, mock_client
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.segments import SegmentStore
+from httpxthrottlecache.sqlitestore import SQLiteStore
+from httpxthrottlecache.storage import SEGMENT_DIR, SQLITE_PATH
+
+
+def _body(req):
+    return b"x" * 100_000 if "large" in req.url.path else b"small " + req.url.path.encode()
+
+
+def _entries(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir() if not p.name.startswith("."))
+
+
+def test_segment_store(tmp_path):
+    store = SegmentStore(tmp_path, max_segment_size=1000)
+    for i in range(20):
+        store.put(f"k{i}", b"v" * 100)
+    store.put("k0", b"new")
+    assert store.remove("k1") and not store.remove("k1")
+
+    assert len(list(tmp_path.iterdir())) > 1
+    assert store.get("k0")[0] == b"new" and store.get("k1") is None and store.get("k2")[0] == b"v" * 100
+    assert len(store) == 19
+
+    # The index is rebuilt from the segments
+    store.close()
+    reopened = SegmentStore(tmp_path, max_segment_size=1000)
+    assert reopened.get("k0")[0] == b"new" and reopened.get("k1") is None and len(reopened) == 19
+
+
+def test_segment_store_torn_record(tmp_path):
+    store = SegmentStore(tmp_path)
+    store.put("a", b"abc")
+    store.put("b", b"def")
+    store.close()
+
+    segment = next(tmp_path.glob("*.seg"))
+    segment.write_bytes(segment.read_bytes()[:-2])
+
+    reopened = SegmentStore(tmp_path)
+    assert reopened.get("a")[0] == b"abc" and reopened.get("b") is None
+    reopened.put("c", b"ghi")
+    assert reopened.get("c")[0] == b"ghi"
+
+
+def test_segment_store_compact(tmp_path):
+    store = SegmentStore(tmp_path, max_segment_size=1000)
+    for i in range(10):
+        store.put(f"k{i}", b"v" * 100)
+    for i in range(9):
+        store.put(f"k{i}", b"w" * 100)
+    store.remove("k9")
+    segments = len(list(tmp_path.iterdir()))
+
+    removed, freed = store.compact()
+    assert removed > 0 and freed > 0
+    assert len(list(tmp_path.iterdir())) < segments
+    assert [store.get(f"k{i}")[0] for i in range(9)] == [b"w" * 100] * 9
+
+    store.close()
+    reopened = SegmentStore(tmp_path, max_segment_size=1000)
+    assert reopened.get("k9") is None and len(reopened) == 9
+
+
+def test_segment_manager(tmp_path):
+    mgr = HttpxThrottleCache(cache_mode="Hishel-Segment", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        for url in ["https://example.com/a.htm", "https://example.com/b.htm", "https://example.com/large.htm"]:
+            r1 = client.get(url)
+            r2 = client.get(url)
+            assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+            assert r1.content == r2.content
+
+    # Only the large entry is a file of its own
+    assert len(_entries(tmp_path)) == 1
+    assert len(SegmentStore.open(tmp_path / SEGMENT_DIR)) == 2
+    assert mgr.get_cached("https://example.com/a.htm") == b"small /a.htm"
+    assert mgr.get_cached("https://example.com/large.htm") == b"x" * 100_000
+
+    assert mgr.compact_segments() == (0, 0)
+    with pytest.raises(ValueError):
+        HttpxThrottleCache(cache_mode="Hishel-File", cache_dir=tmp_path).compact_segments()
+
+
+def _store_entries(cache_dir, start, barrier):
+    mgr = HttpxThrottleCache(cache_mode="Hishel-Segment", cache_dir=cache_dir, cache_rules={".*": {".*": True}})
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        barrier.wait()  # both processes have opened the cache
+        for i in range(start, start + 200):
+            assert client.get(f"https://example.com/{i}.htm").status_code == 200
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_segment_multiprocess(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(2)
+    processes = [ctx.Process(target=_store_entries, args=(tmp_path, start, barrier)) for start in (0, 200)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert [p.exitcode for p in processes] == [0, 0]
+
+    # One process held the segments, the other stored files
+    assert 0 < len(_entries(tmp_path)) < 400
+    mgr = HttpxThrottleCache(cache_mode="Hishel-Segment", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+    for i in range(400):
+        assert mgr.get_cached(f"https://example.com/{i}.htm") == f"small /{i}.htm".encode()
+
+
+def test_sqlite_store(tmp_path):
+    store = SQLiteStore(tmp_path / "cache.db", batch_size=3, flush_interval=60)
+    other = SQLiteStore(tmp_path / "cache.db")  # as another process would see it
+
+    store.put("a", b"abc")
+    store.put("b", b"def")
+    assert store.get("a")[0] == b"abc" and other.get("a") is None
+
+    assert store.remove("b") and store.get("b") is None
+    store.put("c", b"ghi")
+    assert other.get("a")[0] == b"abc" and other.get("b") is None  # batch of 3 written
+
+    def worker(i):
+        store.put(f"t{i}", b"x" * i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    store.close()
+    assert len(other) == 12 and other.get("t9")[0] == b"x" * 9 and "b" not in other
+
+
+def test_sqlite_store_flush_timer(tmp_path):
+    store = SQLiteStore(tmp_path / "cache.db", flush_interval=0.1)
+    other = SQLiteStore(tmp_path / "cache.db")
+
+    # Pending writes are flushed without a later write, by the timer's thread
+    store.put("a", b"abc")
+    assert other.get("a") is None
+    time.sleep(0.5)
+    assert other.get("a")[0] == b"abc"
+
+    # A thread's connection is closed when it exits
+    thread = threading.Thread(target=store.get, args=("b",))
+    thread.start()
+    thread.join()
+    assert len(store._connections) == 1
+    store.close()
+
+
+@pytest.mark.parametrize("cache_mode", ["Hishel-Segment", "Hishel-SQLite"])
+def test_small_entry_manager(tmp_path, cache_mode):
+    mgr = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        for url in ["https://example.com/a.htm", "https://example.com/large.htm"]:
+            r1 = client.get(url)
+            r2 = client.get(url)
+            assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+            assert r1.content == r2.content
+
+    assert len(_entries(tmp_path)) == 1
+    assert mgr.get_cached("https://example.com/a.htm") == b"small /a.htm"
+    if cache_mode == "Hishel-SQLite":
+        SQLiteStore.open(tmp_path / SQLITE_PATH).flush()
+        assert len(SQLiteStore(tmp_path / SQLITE_PATH)) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cache_mode", ["Hishel-Segment", "Hishel-SQLite"])
+async def test_small_entry_manager_async(tmp_path, cache_mode):
+    mgr = HttpxThrottleCache(cache_mode=cache_mode, cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    async with mgr.async_http_client() as client:
+        mock_client(client, MockOrigin(_body))
+        for url in ["https://example.com/a.htm", "https://example.com/large.htm"]:
+            r1 = await client.get(url)
+            r2 = await client.get(url)
+            assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+            assert r1.content == r2.content
+
+    assert len(_entries(tmp_path)) == 1
+    assert mgr.get_cached("https://example.com/a.htm") == b"small /a.htm"
+
+
+@pytest.mark.asyncio
+async def test_small_entries_async_off_loop(tmp_path, monkeypatch):
+    from test_storage import _entry
+
+    from httpxthrottlecache.storage import AsyncSQLiteFileStorage
+
+    threads = []
+    for name in ["get", "remove", "__contains__"]:
+        method = getattr(SQLiteStore, name)
+
+        def spy(self, key, method=method):
+            threads.append(threading.get_ident())
+            return method(self, key)
+
+        monkeypatch.setattr(SQLiteStore, name, spy)
+
+    # A remove may flush, waiting on another process's transaction, so none of these run on the event loop
+    storage = AsyncSQLiteFileStorage(base_path=tmp_path)
+    response, request, metadata = _entry(b"abc")
+    await storage.store("k", response=response, request=request, metadata=metadata)
+    await storage.update_metadata("k", response=response, request=request, metadata=metadata)
+    assert (await storage.retrieve("k"))[0].read() == b"abc"
+    await storage.remove("k")
+    assert await storage.retrieve("k") is None
+
+    assert threads and threading.get_ident() not in threads
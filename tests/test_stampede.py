@@ -1,7 +1,9 @@
 import pytest
+from conftest import MockOrigin, mock_client
 import httpx
 from httpx import Response
 import email
+import json
 import time
 import asyncio
 from httpxthrottlecache import HttpxThrottleCache
@@ -139,3 +141,73 @@ async def test_cache_different_requests(manager_cache: HttpxThrottleCache, monke
 
 
         logger.warning("Stampede results in many misses: calls=%s, misses=%s, hits=%s", calls, misses, hits)                 
+
+
+@pytest.mark.asyncio
+async def test_single_flight_async(tmp_path):
+    origin = MockOrigin(delay=0.05)
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={"example.com": {".*": True}})
+
+    async with manager.async_http_client() as client:
+        mock_client(client, origin)
+        resps = await asyncio.gather(*(client.get("https://example.com/file.bin") for _ in range(20)))
+
+    assert origin.calls == 1
+    assert [r.content for r in resps] == [b"abc"] * 20
+    assert sum(r.headers["x-cache"] == "HIT" for r in resps) == 19
+
+
+def test_single_flight_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    origin = MockOrigin(delay=0.1)
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={"example.com": {".*": True}})
+
+    with manager.http_client() as client:
+        mock_client(client, origin)
+        with ThreadPoolExecutor(8) as pool:
+            contents = list(pool.map(lambda _: client.get("https://example.com/file.bin").content, range(8)))
+
+    assert origin.calls == 1
+    assert contents == [b"abc"] * 8
+
+
+def test_uncacheable_not_locked(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    origin = MockOrigin(delay=0.1)
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={"example.com": {"/cached": True}})
+
+    with manager.http_client() as client:
+        mock_client(client, origin)
+        start = time.monotonic()
+        with ThreadPoolExecutor(4) as pool:
+            contents = list(pool.map(lambda _: client.get("https://example.com/other.bin").content, range(4)))
+
+    # Fetched concurrently, rather than one after another
+    assert contents == [b"abc"] * 4 and origin.calls == 4
+    assert time.monotonic() - start < 0.35
+    assert not list(tmp_path.rglob("*.lock"))
+
+
+def test_concurrent_writers_without_lock(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    manager = HttpxThrottleCache(cache_mode="FileCache", cache_dir=tmp_path, cache_rules={"example.com": {".*": True}})
+    bodies = [bytes([i]) * 100_000 for i in range(8)]
+    origin = MockOrigin(lambda req: [bodies[int(req.headers["x-i"])][i : i + 10_000] for i in range(0, 100_000, 10_000)], delay=0.001)
+
+    with manager.http_client() as client:
+        mock_client(client, origin)
+        client._transport._cache.locking = False
+
+        def fetch(i):
+            return client.get("https://example.com/file.bin", headers={"x-i": str(i)}).content
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(fetch, range(8)))
+
+    entry = tmp_path / "example.com" / "file.bin"
+    assert entry.read_bytes() in bodies
+    assert json.loads((tmp_path / "example.com" / "file.bin.meta").read_text())["fetched"]
+    assert sorted(p.name for p in (tmp_path / "example.com").iterdir()) == ["file.bin", "file.bin.meta"]
@@ -0,0 +1,282 @@
+import bz2
+import datetime
+import io
+import os
+import zlib
+
+import httpcore
+import pytest
+from conftest import MockOrigin, mock_client
+from hishel._serializers import Metadata
+from test_s3 import s3_mock
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.compression import CODECS
+from httpxthrottlecache.serializer import BinaryByteSerializer, CompressingSerializer, JSONByteSerializer
+from httpxthrottlecache.storage import StreamingFileStorage, StreamingS3Storage, UseCounter, read_entry, read_header
+
+
+def _entry(body: bytes):
+    response = httpcore.Response(200, headers=[(b"Content-Type", b"application/octet-stream")], content=body)
+    response.read()
+    request = httpcore.Request("GET", "https://example.com/file.bin")
+    metadata = Metadata(cache_key="k", created_at=datetime.datetime(2024, 1, 1), number_of_uses=0)
+    return response, request, metadata
+
+
+class _Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+
+@pytest.mark.parametrize("header_length", [None, True])
+@pytest.mark.parametrize("stream_type", [io.BytesIO, _Unseekable])
+def test_read_entry(header_length, stream_type):
+    header = b"x" * 100_000
+    data = header + b"\0" + b"body\0body"
+
+    serializer = JSONByteSerializer()
+    expected = (header, b"body\0body")
+    assert read_entry(stream_type(data), serializer, len(header) if header_length else None) == expected
+    assert read_entry(stream_type(b""), serializer) is None
+    assert read_header(stream_type(data), serializer) == header
+    assert read_header(stream_type(b""), serializer) is None
+
+
+@pytest.mark.parametrize("stream_type", [io.BytesIO, _Unseekable])
+@pytest.mark.parametrize("body", [b"", b"\0abc" * 1000, b"x" * 200_000])
+def test_read_entry_binary(stream_type, body):
+    serializer = BinaryByteSerializer()
+    response, request, metadata = _entry(body)
+    response.headers.append((b"X-Large", b"x" * 100_000))  # header longer than one block
+    header = serializer.dumps_header(response, request, metadata)
+
+    assert read_entry(stream_type(header + body), serializer) == (header, body)
+    assert read_entry(stream_type(header + body), serializer, len(header)) == (header, body)
+    assert read_header(stream_type(header + body), serializer) == header
+
+
+def test_binary_serializer():
+    serializer = BinaryByteSerializer()
+    response, request, metadata = _entry(b"\0abc" * 1000)
+    request.extensions["timeout"] = {"connect": 5.0}
+    response.extensions["http_version"] = b"HTTP/1.1"
+
+    data = serializer.dumps(response, request, metadata)
+    assert len(data) < len(JSONByteSerializer().dumps(response, request, metadata))
+
+    loaded_response, loaded_request, loaded_metadata = serializer.loads(data)
+    assert loaded_response.status == 200
+    assert loaded_response.headers == response.headers
+    assert loaded_response.extensions == {"http_version": b"HTTP/1.1"}
+    assert loaded_response.read() == b"\0abc" * 1000
+    assert loaded_request.method == b"GET" and loaded_request.url == request.url
+    assert loaded_request.extensions == {"timeout": {"connect": 5.0}}
+    assert loaded_metadata == Metadata(
+        cache_key="k", created_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc), number_of_uses=0
+    )
+
+
+def test_binary_serializer_reads_json_entries(tmp_path):
+    response, request, metadata = _entry(b"\0abc" * 1000)
+    StreamingFileStorage(base_path=tmp_path).store("k", response=response, request=request, metadata=metadata)
+
+    stored_response, stored_request, _ = StreamingFileStorage(
+        base_path=tmp_path, serializer=BinaryByteSerializer()
+    ).retrieve("k")
+    assert stored_response.read() == b"\0abc" * 1000
+    assert stored_request.url == request.url
+
+    data = JSONByteSerializer().dumps(response, request, metadata)
+    assert BinaryByteSerializer().loads(data)[0].read() == b"\0abc" * 1000
+
+
+def test_file_storage_roundtrip(tmp_path):
+    storage = StreamingFileStorage(base_path=tmp_path)
+    response, request, metadata = _entry(b"\0abc" * 1000)
+
+    storage.store("k", response=response, request=request, metadata=metadata)
+    # Same format as JSONByteSerializer
+    assert (tmp_path / "k").read_bytes() == JSONByteSerializer().dumps(response, request, metadata)
+
+    stored_response, stored_request, stored_metadata = storage.retrieve("k")
+    assert stored_response.read() == b"\0abc" * 1000
+    assert stored_request.url == request.url
+    assert stored_metadata["cache_key"] == "k"
+
+    assert storage.retrieve("missing") is None
+
+
+def test_s3_storage_roundtrip():
+    client = s3_mock()
+    storage = StreamingS3Storage(bucket_name="bucket", client=client)
+    response, request, metadata = _entry(b"\0abc" * 1000)
+
+    storage.store("k", response=response, request=request, metadata=metadata)
+    stored = client.store[("bucket", "hishel-k")]
+    assert stored["Body"] == JSONByteSerializer().dumps(response, request, metadata)
+    assert "created_at" in stored["Metadata"] and "header_length" in stored["Metadata"]
+
+    stored_response, _, _ = storage.retrieve("k")
+    assert stored_response.read() == b"\0abc" * 1000
+    assert storage.retrieve("missing") is None
+
+    stored_response, _, _ = storage.retrieve_header("k")
+    assert stored_response.status == 200 and stored_response.read() == b""
+    assert storage.retrieve_header("missing") is None
+
+
+def test_s3_manager(origin):
+    mgr = HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="bucket", s3_client=s3_mock(), cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        r1 = client.get("https://example.com/file.bin")
+        r2 = client.get("https://example.com/file.bin")
+
+    assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+    assert r2.content == b"abc"
+
+
+@pytest.mark.asyncio
+async def test_s3_manager_async(origin):
+    mgr = HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="bucket", s3_client=s3_mock(), cache_rules={".*": {".*": True}})
+
+    async with mgr.async_http_client() as client:
+        mock_client(client, origin)
+        r1 = await client.get("https://example.com/file.bin")
+        r2 = await client.get("https://example.com/file.bin")
+
+    assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+    assert r2.content == b"abc"
+
+
+def test_hit_does_not_rewrite(tmp_path, origin):
+    mgr = HttpxThrottleCache(cache_mode="Hishel-File", cache_dir=tmp_path, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        client.get("https://example.com/file.bin")
+        entry = next(p for p in tmp_path.iterdir() if p.name != ".gitignore")
+        written = entry.stat().st_mtime_ns, entry.read_bytes()
+
+        for _ in range(3):
+            r = client.get("https://example.com/file.bin")
+            assert r.extensions["from_cache"] is True
+
+    assert (entry.stat().st_mtime_ns, entry.read_bytes()) == written
+    assert r.extensions["cache_metadata"]["number_of_uses"] == 3
+
+
+def test_use_counter():
+    counter = UseCounter(max_entries=2, flush_every=3)
+    for key in ["a", "b", "c"]:
+        counter.retrieved(key, _entry(b"abc"))
+    assert list(counter._entries) == ["b", "c"]  # a was evicted
+
+    response, _, metadata = _entry(b"abc")
+    for uses in [1, 2]:
+        metadata["number_of_uses"] = uses
+        assert counter.updated("c", response, metadata)
+    metadata["number_of_uses"] = 3
+    assert not counter.updated("c", response, metadata)  # rewritten every 3 uses
+    assert not counter.updated("a", response, metadata)
+
+
+def test_s3_hit_does_not_rewrite(origin):
+    s3 = s3_mock()
+    puts = 0
+    upload_fileobj = s3.upload_fileobj
+
+    def counting_upload(*args, **kwargs):
+        nonlocal puts
+        puts += 1
+        return upload_fileobj(*args, **kwargs)
+
+    s3.upload_fileobj = counting_upload
+    mgr = HttpxThrottleCache(cache_mode="Hishel-S3", s3_bucket="bucket", s3_client=s3, cache_rules={".*": {".*": True}})
+
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        for _ in range(4):
+            client.get("https://example.com/file.bin")
+
+    assert puts == 1
+
+
+def _typed_entry(body: bytes, content_type: bytes, content_encoding: bytes = b""):
+    response, request, metadata = _entry(body)
+    response.headers[0] = (b"Content-Type", content_type)
+    if content_encoding:
+        response.headers.append((b"Content-Encoding", content_encoding))
+    return response, request, metadata
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_compressing_serializer(codec):
+    serializer = CompressingSerializer(default_codec=codec)
+    body = b'{"filings": [' + b'{"form": "10-K", "cik": 320193},' * 10_000 + b"]}"
+    response, request, metadata = _typed_entry(body, b"application/json")
+
+    header, stored = serializer.dumps_parts(response, request, metadata)
+    assert len(stored) < len(body) / 5
+
+    loaded_response, _, _ = serializer.loads(header + stored)
+    assert loaded_response.read() == body
+    assert loaded_response.headers == response.headers
+
+
+@pytest.mark.parametrize(
+    "content_type,content_encoding,body",
+    [
+        (b"application/zip", b"", b"x" * 10_000),  # already compressed type
+        (b"image/png", b"", b"x" * 10_000),
+        (b"text/html", b"gzip", b"x" * 10_000),  # already compressed on the wire
+        (b"text/html", b"", b"x" * 100),  # too small
+        (b"text/html", b"", os.urandom(10_000)),  # doesn't compress
+    ],
+)
+def test_compressing_serializer_skips(content_type, content_encoding, body):
+    serializer = CompressingSerializer()
+    response, request, metadata = _typed_entry(body, content_type, content_encoding)
+
+    header, stored = serializer.dumps_parts(response, request, metadata)
+    assert stored is body
+    assert serializer.loads(header + stored)[0].read() == body
+
+
+def test_compressing_serializer_codecs():
+    serializer = CompressingSerializer(codecs={"text/": "bz2", "application/octet-stream": None}, default_codec="zlib")
+    body = b"abc" * 10_000
+
+    header, stored = serializer.dumps_parts(*_typed_entry(body, b"text/plain; charset=utf-8"))
+    assert stored == bz2.compress(body)
+
+    assert serializer.dumps_parts(*_typed_entry(body, b"application/octet-stream"))[1] is body
+
+    header, stored = serializer.dumps_parts(*_typed_entry(body, b"application/xml"))
+    assert stored == zlib.compress(body)
+    # Readable without the CompressingSerializer
+    assert BinaryByteSerializer().loads(header + stored)[0].read() == body
+
+    with pytest.raises(ValueError):
+        CompressingSerializer(codecs={"text/": "nope"})
+
+
+def test_compression_manager(tmp_path):
+    mgr = HttpxThrottleCache(
+        cache_mode="Hishel-File", cache_dir=tmp_path, cache_rules={".*": {".*": True}}, cache_compression=True
+    )
+    body = b"<html>" + b"<p>filing</p>" * 10_000 + b"</html>"
+
+    with mgr.http_client() as client:
+        mock_client(client, MockOrigin(body, headers={"Content-Type": "text/html"}))
+        r1 = client.get("https://example.com/filing.htm")
+        r2 = client.get("https://example.com/filing.htm")
+
+    assert r1.extensions["from_cache"] is False and r2.extensions["from_cache"] is True
+    assert r1.content == r2.content == body
+
+    entry = next(p for p in tmp_path.iterdir() if p.name != ".gitignore")
+    assert entry.stat().st_size < len(body) / 5
+    assert mgr.get_cached("https://example.com/filing.htm") == body
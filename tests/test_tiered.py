@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from conftest import MockOrigin, mock_client
+from test_s3 import s3_mock
+
+from httpxthrottlecache import HttpxThrottleCache
+from httpxthrottlecache.filecache.transport import META_KEY
+
+
+def _origin():
+    return MockOrigin(b"abc" * 1000, headers={"Content-Type": "text/html"})
+
+
+def _worker(tmp_path, name, s3, rules=None):
+    return HttpxThrottleCache(
+        cache_mode="FileCache",
+        cache_dir=tmp_path / name,
+        s3_bucket="bucket",
+        s3_client=s3,
+        cache_rules=rules or {".*": {".*": True}},
+    )
+
+
+def _get(mgr, origin, url):
+    with mgr.http_client() as client:
+        mock_client(client, origin)
+        r = client.get(url)
+        r.read()
+    return r
+
+
+def test_tiered(tmp_path):
+    s3, origin = s3_mock(), _origin()
+    url = "https://example.com/filing.htm"
+
+    r = _get(_worker(tmp_path, "a", s3), origin, url)
+    assert r.headers["x-cache"] == "MISS" and origin.calls == 1
+    stored = s3.store[("bucket", "filecache/example.com/filing.htm")]
+    assert stored["Body"] == b"abc" * 1000 and META_KEY in stored["Metadata"]
+
+    # Another worker's local miss is filled from the tier, without going to the origin
+    b = _worker(tmp_path, "b", s3)
+    r = _get(b, origin, url)
+    assert r.headers["x-cache"] == "HIT" and r.content == b"abc" * 1000
+    assert r.headers["content-type"] == "text/html"
+    assert origin.calls == 1
+    assert (tmp_path / "b" / "example.com" / "filing.htm").read_bytes() == b"abc" * 1000
+    assert not list((tmp_path / "b" / "example.com").glob("*.tmp"))
+
+    assert _worker(tmp_path, "c", s3).get_cached(url) == b"abc" * 1000
+
+
+def test_tiered_miss_checks_tier_once(tmp_path, monkeypatch):
+    s3, origin = s3_mock(), _origin()
+    heads = []
+    head_object = s3.head_object
+
+    def counted(Bucket, Key):
+        heads.append(Key)
+        return head_object(Bucket=Bucket, Key=Key)
+
+    monkeypatch.setattr(s3, "head_object", counted)
+    r = _get(_worker(tmp_path, "a", s3), origin, "https://example.com/filing.htm")
+    assert r.headers["x-cache"] == "MISS"
+    assert heads == ["filecache/example.com/filing.htm"]
+
+
+def test_tiered_stale(tmp_path, monkeypatch):
+    s3, origin = s3_mock(), _origin()
+    url = "https://example.com/filing.htm"
+    rules = {".*": {".*": 10}}
+
+    _get(_worker(tmp_path, "a", s3, rules), origin, url)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+    r = _get(_worker(tmp_path, "b", s3, rules), origin, url)
+    assert r.headers["x-cache"] == "MISS" and origin.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_tiered_async(tmp_path):
+    s3, origin = s3_mock(), _origin()
+    url = "https://example.com/filing.htm"
+
+    for name in ["a", "b"]:
+        async with _worker(tmp_path, name, s3).async_http_client() as client:
+            mock_client(client, origin)
+            r = await client.get(url)
+            assert r.content == b"abc" * 1000
+
+    assert r.headers["x-cache"] == "HIT" and origin.calls == 1